@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+
+from CrossValidationPipeline import run_cross_validation_pipeline
+from preprocessing.General import combine_presence_and_background_into_single_gdf
+from training.Training import create_spatial_train_test_split
+
+BACKGROUND_REPLICATES_FILE = "background_replicates.parquet"
+
+
+def get_replicate_dataset(dataset, replicate_df):
+    """The dataset's presence points with another background draw, combined the same way"""
+    presence_df = dataset[dataset["label"] == 1].drop(columns="label").copy()
+    return combine_presence_and_background_into_single_gdf(
+        presence_df, replicate_df.drop(columns="replicate")
+    )
+
+
+def run_background_replicate_pipeline(dataset, background_replicates, cv_metrics, save_path):
+    """
+    Split and cross validate (with the optimised hyperparameters) every extra background replicate
+    as the model's own background was, and report the spread of mean F1 across all of them.
+    The replicates are saved next to the predictions for later analyses, e.g. ensembles.
+    """
+    mean_f1_scores = [cv_metrics["cv"]["mean_f1"]]
+    for k, replicate_df in background_replicates.groupby("replicate"):
+        print(f"Cross validating background replicate {k}")
+        replicate_dataset = get_replicate_dataset(dataset, replicate_df)
+        train_dataset, _, _ = create_spatial_train_test_split(replicate_dataset)
+        metrics = run_cross_validation_pipeline(dataset=train_dataset)
+        mean_f1_scores.append(metrics["cv"]["mean_f1"])
+
+    background_replicates_file_path = os.path.join(save_path, BACKGROUND_REPLICATES_FILE)
+    background_replicates.to_parquet(
+        background_replicates_file_path, index=False, compression="zstd"
+    )
+    print(f"Saved background replicates to: {background_replicates_file_path}")
+    return {
+        "background_replicates": {
+            "mean_f1": mean_f1_scores,
+            "mean": round(float(np.mean(mean_f1_scores)), 2),
+            "std": round(float(np.std(mean_f1_scores)), 2),
+        }
+    }
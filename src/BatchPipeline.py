@@ -0,0 +1,155 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import re
+
+from dataset import LoadData
+from DatasetPipeline import get_species_data_paths
+from Pipeline import run_experiment
+from preprocessing import AccessibleArea, General
+from preprocessing.DistanceToShore import DistanceToShore
+from preprocessing.FeatureCube import get_feature_cube
+from training.Parallel import split_thread_budget
+from ConfigHandler import config
+
+
+def get_species_slug(species):
+    return re.sub(r"[^a-z0-9]+", "_", str(species).lower()).strip("_")
+
+
+def write_if_changed(text, path):
+    """Only touch the file when its content changes, so stage cache fingerprints stay valid"""
+    if os.path.exists(path):
+        with open(path) as f:
+            if f.read() == text:
+                return
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def split_multi_species_data(data_path):
+    """Split a multi-species download into per-species presence files: {species: path}"""
+    print(f"Splitting multi-species data {data_path} by species...")
+    df = LoadData.load_raw_species_data(os.path.join(config.DATA.SPECIES.FOLDER, data_path))
+    counts = df["species"].value_counts()
+    if config.BATCH.SPECIES:
+        species_list = [species for species in config.BATCH.SPECIES if species in counts]
+        missing = set(config.BATCH.SPECIES) - set(species_list)
+        if missing:
+            print(f"No records for species {sorted(missing)}, skipping them")
+    else:
+        species_list = sorted(counts[counts >= config.BATCH.MIN_PRESENCE_RECORDS].index)
+
+    split_folder = os.path.join(config.DATA.SPECIES.FOLDER, config.BATCH.SPLIT_FOLDER)
+    os.makedirs(split_folder, exist_ok=True)
+    presence_paths = {}
+    for species, species_df in df[df["species"].isin(species_list)].groupby(
+        "species", observed=True
+    ):
+        relative_path = os.path.join(
+            config.BATCH.SPLIT_FOLDER, f"{get_species_slug(species)}.csv"
+        )
+        write_if_changed(
+            species_df.to_csv(sep="\t", index=False),
+            os.path.join(config.DATA.SPECIES.FOLDER, relative_path),
+        )
+        presence_paths[species] = relative_path
+    print(f"Split {len(presence_paths)} species out of {data_path}")
+    return presence_paths
+
+
+def get_batch_presence_paths():
+    """{name: presence path} from BATCH.PRESENCE_DATA_PATHS and/or BATCH.MULTI_SPECIES_DATA_PATH"""
+    presence_paths = {
+        os.path.splitext(os.path.basename(path))[0]: path
+        for path in config.BATCH.PRESENCE_DATA_PATHS
+    }
+    if config.BATCH.MULTI_SPECIES_DATA_PATH:
+        presence_paths.update(
+            split_multi_species_data(config.BATCH.MULTI_SPECIES_DATA_PATH)
+        )
+    if not presence_paths:
+        raise ValueError(
+            "Batch mode needs BATCH.PRESENCE_DATA_PATHS or BATCH.MULTI_SPECIES_DATA_PATH"
+        )
+    return presence_paths
+
+
+def get_union_bounding_box(presence_paths):
+    """Bounding box (accessible area padding included) covering every species' presence data"""
+    boxes = []
+    for presence_path in presence_paths.values():
+        presence_df = LoadData.load_raw_species_data(
+            os.path.join(config.DATA.SPECIES.FOLDER, presence_path)
+        )
+        presence_df, _ = General.remove_basic_issues(presence_df)
+        if len(presence_df):
+            boxes.append(AccessibleArea.obtain_initial_bounding_box(presence_df))
+    if not boxes:
+        raise ValueError("No species in the batch has presence data left after filtering")
+    min_lons, max_lons, min_lats, max_lats = zip(*boxes)
+    return min(min_lons), max(max_lons), min(min_lats), max(max_lats)
+
+
+def prepare_shared_inputs(presence_paths):
+    """Prepare the data every species shares once, before any worker starts"""
+    print("Preparing inputs shared by all species...")
+    _, background_path = get_species_data_paths()
+    if config.DATA.SPECIES.USE_PARQUET:
+        LoadData.load_raw_species_data(background_path)
+
+    min_lon, max_lon, min_lat, max_lat = get_union_bounding_box(presence_paths)
+    if config.PREPROCESSING.FEATURE_CUBE.USE:
+        get_feature_cube(min_lon, max_lon, min_lat, max_lat)
+    if (
+        "distance_to_shore_m" in config.PREPROCESSING.ENVIRONMENT_DATA
+        and config.PREPROCESSING.DISTANCE_TO_SHORE.MODE == "fast"
+    ):
+        DistanceToShore(min_lon, max_lon, min_lat, max_lat).load()
+
+
+def run_species_experiment(
+    experiment_title, experiment_description, presence_path, config_snapshot, threads
+):
+    """One species' full experiment in its own folder, run in a worker process"""
+    config.merge_update(config_snapshot)
+    config.TRAINING.MAX_THREADS = threads
+    config.DATA.SPECIES.PRESENCE_DATA_PATH = presence_path
+    # Prepared by prepare_shared_inputs - rebuilding them here would race the other workers
+    config.PREPROCESSING.FEATURE_CUBE.READ_ONLY = True
+    config.PREPROCESSING.DISTANCE_TO_SHORE.READ_ONLY = True
+    return run_experiment(experiment_title, experiment_description)
+
+
+def run_batch_experiment(experiment_title: str = "", experiment_description: str = ""):
+    """Run every species' experiment in its own process, returning {species: folder}"""
+    presence_paths = get_batch_presence_paths()
+    print(f"Running batch experiment '{experiment_title}' for {len(presence_paths)} species")
+    prepare_shared_inputs(presence_paths)
+
+    num_workers, threads_per_worker = split_thread_budget(
+        len(presence_paths), config.BATCH.MAX_WORKERS
+    )
+    results_paths = {}
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {
+            species: executor.submit(
+                run_species_experiment,
+                f"{experiment_title}_{get_species_slug(species)}",
+                f"{experiment_description} ({species})",
+                presence_path,
+                config.to_dict(),
+                threads_per_worker,
+            )
+            for species, presence_path in presence_paths.items()
+        }
+        for species, future in futures.items():
+            try:
+                results_paths[species] = future.result()
+                print(f"Finished {species}: {results_paths[species]}")
+            except Exception as e:
+                print(f"Experiment for {species} failed: {e!r}")
+    print(
+        f"Batch experiment '{experiment_title}' finished {len(results_paths)} of "
+        f"{len(presence_paths)} species"
+    )
+    return results_paths
@@ -1,10 +1,39 @@
+from evaluation.Prediction import (
+    apply_threshold,
+    evaluate_model_performance,
+    get_calibration,
+)
 from training.Training import cross_validate
 
 import numpy as np
 
+from ConfigHandler import config
 
-def run_cross_validation_pipeline(dataset):
-    precisions, recalls, f1_scores, best_thresholds, num_trees = cross_validate(dataset)
+
+def get_out_of_fold_metrics(prediction_store, best_thresholds):
+    """
+    Metrics over all out-of-fold predictions pooled, each fold thresholded at its own best
+    threshold, plus their calibration - read from the prediction store
+    """
+    out_of_fold = prediction_store.get("cv", "test")
+    thresholds = np.asarray(best_thresholds)[out_of_fold["fold"].values]
+    y_true = out_of_fold["label"].values
+    y_preds = apply_threshold(out_of_fold["prob"].values, thresholds)
+    precision, recall, f1 = evaluate_model_performance(y_true, y_preds)
+    return {
+        "precision": round(100 * precision, 2),
+        "recall": round(100 * recall, 2),
+        "f1": round(100 * f1, 2),
+        "calibration": get_calibration(
+            y_true, out_of_fold["prob"].values, config.PREDICTION.CALIBRATION_BINS
+        ),
+    }
+
+
+def run_cross_validation_pipeline(dataset, model_params=None, trial=None, prediction_store=None):
+    precisions, recalls, f1_scores, best_thresholds, num_trees = cross_validate(
+        dataset, model_params, trial, prediction_store
+    )
     metrics = {
         "cv": {
             "mean_f1": round(100 * float(np.mean(f1_scores)), 2),
@@ -16,4 +45,6 @@ def run_cross_validation_pipeline(dataset):
             "num_trees": num_trees,
         }
     }
+    if prediction_store is not None:
+        metrics["cv"]["out_of_fold"] = get_out_of_fold_metrics(prediction_store, best_thresholds)
     return metrics
@@ -1,12 +1,22 @@
 import os
+import time
+
+import numpy as np
 
 from training.Training import create_spatial_train_test_split
 
 from ConfigHandler import config
 
 
-def run_data_split_pipeline(dataset, save_path):
-    train_dataset, test_dataset = create_spatial_train_test_split(dataset)
+def create_data_split(dataset):
+    """Train/test datasets and the split stats text - no time taken, as the text is stage cached"""
+    start = time.perf_counter()
+    train_dataset, test_dataset, split_stats = create_spatial_train_test_split(dataset)
+    split_time = time.perf_counter() - start
+    removed_per_draw = split_stats["removed_per_draw"]
+    if len(removed_per_draw) == 0:
+        removed_per_draw = np.zeros(1, dtype=int)
+    print(f"Spatial train/test split took {split_time:.2f}s")
     stats = [
         "--- Training dataset ---",
         f"Size: {len(train_dataset)}",
@@ -16,8 +26,20 @@ def run_data_split_pipeline(dataset, save_path):
         f"Size: {len(test_dataset)}",
         f"Presence points: {(test_dataset['label'] == 1).sum()}",
         f"Background points: {(test_dataset['label'] == 0).sum()}",
+        "\n--- Split ---",
+        f"Test point draws: {split_stats['num_draws']}",
+        f"Candidates removed per draw - mean: {removed_per_draw.mean():.1f}, "
+        f"median: {np.median(removed_per_draw):.1f}, max: {removed_per_draw.max()}",
     ]
-    stats_text = "\n".join(stats)
+    return train_dataset, test_dataset, "\n".join(stats)
+
+
+def save_data_split_stats(stats_text, save_path):
     with open(os.path.join(save_path, "data_split_stats.txt"), "w") as f:
         f.write(stats_text)
+
+
+def run_data_split_pipeline(dataset, save_path):
+    train_dataset, test_dataset, stats_text = create_data_split(dataset)
+    save_data_split_stats(stats_text, save_path)
     return train_dataset, test_dataset
@@ -4,13 +4,23 @@ from dataset import LoadData
 from ConfigHandler import config
 
 
-def run_dataset_pipeline():
-    presence_dataset = LoadData.load_raw_species_data(
-        os.path.join(config.DATA.SPECIES.FOLDER, config.DATA.SPECIES.PRESENCE_DATA_PATH)
-    )
-    background_dataset = LoadData.load_raw_species_data(
+def get_species_data_paths():
+    return [
+        os.path.join(config.DATA.SPECIES.FOLDER, config.DATA.SPECIES.PRESENCE_DATA_PATH),
         os.path.join(
             config.DATA.SPECIES.FOLDER, config.DATA.SPECIES.BACKGROUND_DATA_PATH
-        )
-    )
+        ),
+    ]
+
+
+def run_dataset_pipeline():
+    """
+    With DATA.SPECIES.STREAM_BACKGROUND the background dataset is None - preprocessing then streams
+    it in chunks once it knows the bounding box, see `stream_background_dataset`.
+    """
+    presence_path, background_path = get_species_data_paths()
+    presence_dataset = LoadData.load_raw_species_data(presence_path)
+    if config.DATA.SPECIES.STREAM_BACKGROUND:
+        return presence_dataset, None
+    background_dataset = LoadData.load_raw_species_data(background_path)
     return presence_dataset, background_dataset
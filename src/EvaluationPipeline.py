@@ -1,19 +1,35 @@
-from evaluation.Prediction import predict_on_dataset, evaluate_model_performance
+from evaluation.Prediction import (
+    apply_threshold,
+    evaluate_model_performance,
+    get_calibration,
+)
+from evaluation.PredictionStore import PredictionStore
 from training.Training import prepare_data_for_modelling
 
 from ConfigHandler import config
 
 
-def run_evaluation_pipeline(dataset, model):
+def run_evaluation_pipeline(dataset, model, prediction_store=None):
+    """Test predictions go into the prediction store, and the metrics are computed from it"""
     print("Evaluating model on test dataset")
+    if prediction_store is None:
+        prediction_store = PredictionStore()
     X_test, y_test = prepare_data_for_modelling(dataset)
-    y_preds, _ = predict_on_dataset(model, X_test, config.PREDICTION.THRESHOLD)
-    precision, recall, f1 = evaluate_model_performance(y_test, y_preds)
+    prediction_store.add(
+        "final", "test", dataset.index.values, y_test, model.predict_proba(X_test)[:, 1]
+    )
+    test_predictions = prediction_store.get("final", "test")
+    y_true, y_probs = test_predictions["label"].values, test_predictions["prob"].values
+    y_preds = apply_threshold(y_probs, config.PREDICTION.THRESHOLD)
+    precision, recall, f1 = evaluate_model_performance(y_true, y_preds)
     metrics = {
         "test": {
             "precision": round(100 * precision, 2),
             "recall": round(100 * recall, 2),
             "f1": round(100 * f1, 2),
+            "calibration": get_calibration(
+                y_true, y_probs, config.PREDICTION.CALIBRATION_BINS
+            ),
         }
     }
     return metrics
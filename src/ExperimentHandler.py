@@ -3,16 +3,32 @@ import os
 import json
 
 
+def create_unique_folder(parent_path, folder_name):
+    """
+    Create parent_path/folder_name, adding _2, _3, ... if it is taken. os.mkdir is atomic, so
+    concurrent runs (e.g. sweep workers started in the same minute) never share a folder.
+    """
+    os.makedirs(parent_path, exist_ok=True)
+    path = os.path.join(parent_path, folder_name)
+    suffix = 1
+    while True:
+        try:
+            os.mkdir(path)
+            return path
+        except FileExistsError:
+            suffix += 1
+            path = os.path.join(parent_path, f"{folder_name}_{suffix}")
+
+
 class ExperimentHandler:
     def __init__(self, experiment_title=""):
         experiment_name = time.strftime("%Y-%m-%d_%H-%M")
         if experiment_title is not None:
             experiment_name += "_" + experiment_title
-        self.experiment_name = experiment_name
 
         outputs_path = "../outputs/experiments/"
-        self.results_path = os.path.join(outputs_path, experiment_name)
-        os.mkdir(self.results_path)
+        self.results_path = create_unique_folder(outputs_path, experiment_name)
+        self.experiment_name = os.path.basename(self.results_path)
         print(f"Created experiment folder: {self.results_path}")
 
     def save_config(self, config):
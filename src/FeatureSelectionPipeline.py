@@ -0,0 +1,79 @@
+import os
+
+import pandas as pd
+
+from ExperimentHandler import ExperimentHandler
+from Instrumentation import count_rows, get_timings, reset_timings, timed_stage
+from optimisation.FeatureSelection import select_features
+from Pipeline import (
+    add_config_params_for_current_experiment,
+    run_preprocessing_stages,
+    run_split_stage,
+)
+from ResultsHandler import ResultsHandler
+from StageCache import StageCache
+from ConfigHandler import config
+
+
+def get_candidate_features():
+    """FEATURE_SELECTION.CANDIDATES, or every variable in ENVIRONMENT_DATA if not set"""
+    return list(
+        config.FEATURE_SELECTION.CANDIDATES or config.PREPROCESSING.ENVIRONMENT_DATA
+    )
+
+
+def save_feature_selection_table(selection, save_path):
+    table = pd.DataFrame(
+        [
+            {
+                "features": ", ".join(evaluation["features"]),
+                "num_features": len(evaluation["features"]),
+                "mean_f1": evaluation["mean_f1"],
+                "std_f1": evaluation["std_f1"],
+                "num_folds_run": evaluation["num_folds_run"],
+                "pruned": evaluation["pruned"],
+            }
+            for evaluation in selection["evaluations"]
+        ]
+    )
+    table.to_csv(os.path.join(save_path, "feature_selection.csv"), index=False)
+
+
+def run_feature_selection(experiment_title: str = "", experiment_description: str = ""):
+    """
+    Preprocess once with every candidate variable (so environmental data is extracted once for
+    the superset), split as usual, then search feature subsets on the training data with spatial CV.
+    The experiment folder gets the search in results.json and feature_selection.csv, and a config
+    with ENVIRONMENT_DATA set to the best subset, ready for run_experiment.
+    Note rows are dropped for missing values in any candidate (DROP_NA_ENVIRONMENTAL), so every
+    subset is scored on the same rows.
+    Returns the experiment folder.
+    """
+    print(f"Running feature selection: {experiment_title}")
+    add_config_params_for_current_experiment(experiment_title, experiment_description)
+    reset_timings()
+    config.PREPROCESSING.ENVIRONMENT_DATA = get_candidate_features()
+
+    experiment_handler = ExperimentHandler(experiment_title=experiment_title)
+    outputs_save_path = experiment_handler.results_path
+    experiment_handler.save_config(config)
+    rh = ResultsHandler(results_path=outputs_save_path)
+
+    stage_cache = StageCache()
+    dataset, _, preprocessing_key, _ = run_preprocessing_stages(stage_cache)
+    with timed_stage("split", count_rows(dataset)) as stage:
+        train_dataset, test_dataset, _ = run_split_stage(
+            stage_cache, dataset, preprocessing_key, outputs_save_path
+        )
+        stage["rows_out"] = count_rows((train_dataset, test_dataset))
+
+    with timed_stage("feature_selection", count_rows(train_dataset)):
+        selection = select_features(train_dataset, config.PREPROCESSING.ENVIRONMENT_DATA)
+    save_feature_selection_table(selection, outputs_save_path)
+
+    config.PREPROCESSING.ENVIRONMENT_DATA = selection["best_features"]
+    experiment_handler.save_config(config)
+    rh.add_metric("feature_selection", selection)
+    rh.add_timings(get_timings())
+    rh.save_results()
+    return outputs_save_path
@@ -0,0 +1,134 @@
+from contextlib import contextmanager
+import os
+import resource
+import sys
+import threading
+import time
+
+import pandas as pd
+
+from ConfigHandler import config
+
+# Stages recorded so far this run, keyed "outer/inner" for nested stages, in the order they started
+TIMINGS = {}
+ACTIVE_STAGES = []
+SAMPLER = {"thread": None, "stop": None}
+
+
+def get_peak_rss_bytes():
+    """Peak resident memory of the whole process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def get_rss_bytes():
+    """Current resident memory - falls back to the process peak where /proc isn't available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return get_peak_rss_bytes()
+
+
+def get_cpu_time():
+    """User + system CPU time of all threads, plus finished child processes (e.g. optuna workers)"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def count_rows(obj):
+    """Rows of a (Geo)DataFrame, or summed over a tuple/list of them - None for anything else"""
+    if isinstance(obj, pd.DataFrame):
+        return len(obj)
+    if isinstance(obj, (tuple, list)):
+        counts = [count_rows(item) for item in obj]
+        if counts and all(count is not None for count in counts):
+            return sum(counts)
+    return None
+
+
+def update_peaks():
+    rss = get_rss_bytes()
+    for record in ACTIVE_STAGES:
+        record["peak_rss_bytes"] = max(record["peak_rss_bytes"], rss)
+
+
+def sample_memory(stop, interval):
+    while not stop.wait(interval):
+        update_peaks()
+
+
+def start_sampler():
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=sample_memory,
+        args=(stop, config.INSTRUMENTATION.SAMPLE_INTERVAL_S),
+        daemon=True,
+    )
+    thread.start()
+    SAMPLER.update(thread=thread, stop=stop)
+
+
+def stop_sampler():
+    SAMPLER["stop"].set()
+    SAMPLER["thread"].join()
+    SAMPLER.update(thread=None, stop=None)
+
+
+def reset_timings():
+    TIMINGS.clear()
+
+
+def get_timings():
+    """Recorded stages in results.json form - times in seconds, memory in MB"""
+    timings = {}
+    for name, record in TIMINGS.items():
+        timings[name] = {
+            "wall_time_s": round(record["wall_time_s"], 3),
+            "cpu_time_s": round(record["cpu_time_s"], 3),
+            "start_rss_mb": round(record["start_rss_bytes"] / 1024**2, 1),
+            "peak_rss_mb": round(record["peak_rss_bytes"] / 1024**2, 1),
+            "process_peak_rss_mb": round(record["process_peak_rss_bytes"] / 1024**2, 1),
+            "rows_in": record["rows_in"],
+            "rows_out": record["rows_out"],
+        }
+    return timings
+
+
+@contextmanager
+def timed_stage(name, rows_in=None):
+    """
+    Record wall time, CPU time and memory of the enclosed block under `name` (prefixed by any
+    enclosing stages). Yields the record, so the block can set record["rows_out"].
+    Peak RSS is sampled every INSTRUMENTATION.SAMPLE_INTERVAL_S by a background thread, so very
+    short spikes can be missed - process_peak_rss_mb is the exact peak of the run so far.
+    """
+    record = {"rows_in": rows_in, "rows_out": None}
+    if not config.INSTRUMENTATION.USE:
+        yield record
+        return
+
+    full_name = f"{ACTIVE_STAGES[-1]['name']}/{name}" if ACTIVE_STAGES else name
+    rss = get_rss_bytes()
+    record.update(name=full_name, start_rss_bytes=rss, peak_rss_bytes=rss)
+    TIMINGS[full_name] = record
+    ACTIVE_STAGES.append(record)
+    if SAMPLER["thread"] is None:
+        start_sampler()
+    start_wall, start_cpu = time.perf_counter(), get_cpu_time()
+    try:
+        yield record
+    finally:
+        record["wall_time_s"] = time.perf_counter() - start_wall
+        record["cpu_time_s"] = get_cpu_time() - start_cpu
+        update_peaks()
+        record["process_peak_rss_bytes"] = get_peak_rss_bytes()
+        ACTIVE_STAGES.remove(record)
+        if not ACTIVE_STAGES:
+            stop_sampler()
+        print(
+            f"Stage '{full_name}' took {record['wall_time_s']:.2f}s "
+            f"(CPU {record['cpu_time_s']:.2f}s, peak RSS "
+            f"{record['peak_rss_bytes'] / 1024**2:.0f} MB)"
+        )
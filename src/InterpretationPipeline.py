@@ -9,4 +9,4 @@ def run_interpretation_pipeline(model, dataset, accessible_area, save_path):
     with open(f"{save_path}/feature_importance.json", "w") as f:
         json.dump(feature_importance, f, indent=4)
     get_partial_dependence(model, dataset, save_path)
-    predict_over_accessible_area(model, dataset, accessible_area, save_path)
+    return predict_over_accessible_area(model, dataset, accessible_area, save_path)
@@ -1,5 +1,5 @@
 from optimisation.Optuna import optimise_hyperparameters_via_optuna
 
 
-def run_optimisation_pipeline(dataset):
-    optimise_hyperparameters_via_optuna(dataset)
+def run_optimisation_pipeline(dataset, data_key=None):
+    optimise_hyperparameters_via_optuna(dataset, data_key)
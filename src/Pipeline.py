@@ -1,16 +1,24 @@
 from ConfigHandler import config
 
+from BackgroundReplicatePipeline import run_background_replicate_pipeline
 from CrossValidationPipeline import run_cross_validation_pipeline
-from DatasetPipeline import run_dataset_pipeline
-from DataSplitPipeline import run_data_split_pipeline
+from DatasetPipeline import get_species_data_paths, run_dataset_pipeline
+from DataSplitPipeline import create_data_split, save_data_split_stats
 from EvaluationPipeline import run_evaluation_pipeline
+from evaluation.PredictionStore import PredictionStore
 from ExperimentHandler import ExperimentHandler
+from Instrumentation import count_rows, get_timings, reset_timings, timed_stage
 from InterpretationPipeline import run_interpretation_pipeline
 from OptimisationPipeline import run_optimisation_pipeline
-from PreprocessPipeline import run_preprocessing_pipeline
+from PreprocessPipeline import (
+    get_environmental_data_paths,
+    get_preprocessing_config,
+    run_preprocessing_pipeline,
+)
 from ProductionPipeline import run_production_pipeline
 from TrainingPipeline import run_training_pipeline
 from ResultsHandler import ResultsHandler
+from StageCache import StageCache
 
 
 def add_config_params_for_current_experiment(experiment_title, experiment_description):
@@ -18,52 +26,182 @@ def add_config_params_for_current_experiment(experiment_title, experiment_descri
     config.EXPERIMENT_DESCRIPTION = experiment_description
 
 
-def run_experiment(experiment_title: str = "", experiment_description: str = ""):
+def get_dataset_key(stage_cache):
+    return stage_cache.get_key(
+        "dataset",
+        [config.DATA.SPECIES],
+        files=get_species_data_paths(),
+        code=["dataset", "DatasetPipeline.py"],
+    )
+
+
+def get_preprocessing_key(stage_cache):
+    """Stage cache key of the preprocessed dataset - equal keys mean identical preprocessing"""
+    dataset_key = get_dataset_key(stage_cache)
+    preprocessing_key = stage_cache.get_key(
+        "preprocessing",
+        [config.DATA.ENVIRONMENTAL, get_preprocessing_config()],
+        upstream_keys=[dataset_key],
+        files=get_environmental_data_paths(),
+        code=["preprocessing", "PreprocessPipeline.py"],
+    )
+    return preprocessing_key
+
+
+def run_preprocessing_stages(stage_cache):
+    """
+    Dataset loading and preprocessing, skipped when their inputs haven't changed. The downloads
+    themselves are reused through their Parquet copies (DATA.SPECIES.USE_PARQUET), not stage cached.
+    """
+    preprocessing_key = get_preprocessing_key(stage_cache)
+
+    def compute():
+        # Get presence/absence data
+        with timed_stage("dataset") as stage:
+            presence_data, background_data = run_dataset_pipeline()
+            stage["rows_out"] = count_rows(
+                [data for data in (presence_data, background_data) if data is not None]
+            )
+
+        # Filtering, adding environmental variables, creating accessible area, bias correction
+        with timed_stage("preprocessing", stage["rows_out"]) as stage:
+            dataset, accessible_area, background_replicates = run_preprocessing_pipeline(
+                presence_data, background_data
+            )
+            stage["rows_out"] = count_rows(dataset)
+        outputs = {"dataset": dataset, "accessible_area": accessible_area}
+        # Extra background draws only with PREPROCESSING.BG_REPLICATES above 1
+        if background_replicates is not None:
+            outputs["background_replicates"] = background_replicates
+        return outputs
+
+    # Only timed as a whole on a cache hit - the dataset/preprocessing stages show a recompute
+    with timed_stage("preprocessing_stages") as stage:
+        outputs = stage_cache.run("preprocessing", preprocessing_key, compute)
+        stage["rows_out"] = count_rows(outputs["dataset"])
+    return (
+        outputs["dataset"],
+        outputs["accessible_area"],
+        preprocessing_key,
+        outputs.get("background_replicates"),
+    )
+
+
+def run_split_stage(stage_cache, dataset, preprocessing_key, save_path):
+    split_key = stage_cache.get_key(
+        "split",
+        [config.DATA_SPLIT],
+        upstream_keys=[preprocessing_key],
+        code=["training/Training.py", "DataSplitPipeline.py"],
+    )
+
+    def compute():
+        train_dataset, test_dataset, stats_text = create_data_split(dataset)
+        return {"train": train_dataset, "test": test_dataset, "stats": stats_text}
+
+    outputs = stage_cache.run("split", split_key, compute)
+    save_data_split_stats(outputs["stats"], save_path)
+    return outputs["train"], outputs["test"], split_key
+
+
+def run_experiment(
+    experiment_title: str = "", experiment_description: str = "", preprocessed=None
+):
+    """
+    `preprocessed` is an optional (dataset, accessible_area, preprocessing_key,
+    background_replicates) computed elsewhere - e.g. shared by a sweep - in which case dataset
+    loading and preprocessing are skipped.
+    Returns the experiment folder.
+    """
     print(f"Running experiment: {experiment_title}")
     add_config_params_for_current_experiment(experiment_title, experiment_description)
+    reset_timings()
 
     experiment_handler = ExperimentHandler(experiment_title=experiment_title)
 
     outputs_save_path = experiment_handler.results_path
     experiment_handler.save_config(config)
+    rh = ResultsHandler(results_path=outputs_save_path)
 
-    # Get presence/absence data
-    presence_data, background_data = run_dataset_pipeline()
-
-    # Filtering, adding environmental variables, creating accessible area, bias correction
-    dataset, accessible_area = run_preprocessing_pipeline(
-        presence_data, background_data
-    )
+    # Dataset loading, preprocessing and the split are reused from the stage cache when possible
+    stage_cache = StageCache()
+    if preprocessed is None:
+        preprocessed = run_preprocessing_stages(stage_cache)
+    dataset, accessible_area, preprocessing_key, background_replicates = preprocessed
 
     # Train/test for final evaluation - splitting with spatial blocking
-    train_dataset, test_dataset = run_data_split_pipeline(dataset, outputs_save_path)
+    with timed_stage("split", count_rows(dataset)) as stage:
+        train_dataset, test_dataset, split_key = run_split_stage(
+            stage_cache, dataset, preprocessing_key, outputs_save_path
+        )
+        stage["rows_out"] = count_rows((train_dataset, test_dataset))
 
     # Optuna optimisation of hyperparameters - e.g. max_depth - maximising F1 score in cross validation
-    run_optimisation_pipeline(dataset=train_dataset)
+    with timed_stage("optimisation", count_rows(train_dataset)) as stage:
+        run_optimisation_pipeline(dataset=train_dataset, data_key=split_key)
+        # Stages that train on a dataset record the rows they trained on
+        stage["rows_out"] = count_rows(train_dataset)
     experiment_handler.save_config(config)
 
+    # Probabilities from the final CV folds and the final model, shared by thresholding,
+    # metrics and calibration, and saved for later analyses
+    prediction_store = PredictionStore()
+
     # Post-optimisation, run a final cross-validation training + evaluation
     print("Running final cross validation")
-    cv_metrics = run_cross_validation_pipeline(dataset=train_dataset)
-    rh = ResultsHandler(results_path=outputs_save_path)
+    with timed_stage("cross_validation", count_rows(train_dataset)) as stage:
+        cv_metrics = run_cross_validation_pipeline(
+            dataset=train_dataset, prediction_store=prediction_store
+        )
+        stage["rows_out"] = count_rows(prediction_store.get("cv", "test"))
     rh.add_multiple_metrics(metrics=cv_metrics)
 
+    # How much the CV score depends on the background draw - PREPROCESSING.BG_REPLICATES
+    if background_replicates is not None:
+        with timed_stage("background_replicates", count_rows(background_replicates)):
+            replicate_metrics = run_background_replicate_pipeline(
+                dataset=dataset,
+                background_replicates=background_replicates,
+                cv_metrics=cv_metrics,
+                save_path=outputs_save_path,
+            )
+        rh.add_multiple_metrics(metrics=replicate_metrics)
+
     # Train and test the final model based on optimised hyperparams
-    pred_model = run_training_pipeline(dataset=train_dataset)
+    with timed_stage("training", count_rows(train_dataset)) as stage:
+        pred_model = run_training_pipeline(
+            dataset=train_dataset, prediction_store=prediction_store
+        )
+        stage["rows_out"] = count_rows(train_dataset)
     experiment_handler.save_config(config)
-    metrics = run_evaluation_pipeline(dataset=test_dataset, model=pred_model)
+    with timed_stage("evaluation", count_rows(test_dataset)) as stage:
+        metrics = run_evaluation_pipeline(
+            dataset=test_dataset, model=pred_model, prediction_store=prediction_store
+        )
+        stage["rows_out"] = count_rows(prediction_store.get("final", "test"))
     rh.add_multiple_metrics(metrics=metrics)
+    prediction_store.save(outputs_save_path)
+    rh.add_timings(get_timings())
     rh.save_results()
 
     # Save some plots (e.g. accessible area prediction plot, partial dependency plot)
     # and useful interpretations like feature importance
-    run_interpretation_pipeline(
-        model=pred_model,
-        dataset=test_dataset,
-        accessible_area=accessible_area,
-        save_path=outputs_save_path,
-    )
+    with timed_stage("interpretation", count_rows(test_dataset)) as stage:
+        pred_raster = run_interpretation_pipeline(
+            model=pred_model,
+            dataset=test_dataset,
+            accessible_area=accessible_area,
+            save_path=outputs_save_path,
+        )
+        # Rows out are the raster cells predicted
+        stage["rows_out"] = int(pred_raster.notnull().sum())
 
     # Production-ready files to plug into inference code
-    run_production_pipeline(model=pred_model, save_path=outputs_save_path)
+    with timed_stage("production"):
+        run_production_pipeline(model=pred_model, save_path=outputs_save_path)
     experiment_handler.save_config(config)
+
+    # Saved again so the timings cover the whole run
+    rh.add_timings(get_timings())
+    rh.save_results()
+    return outputs_save_path
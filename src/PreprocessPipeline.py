@@ -1,44 +1,168 @@
+import glob
+import os
+
+import pandas as pd
+
+from dataset import LoadData
+from DatasetPipeline import get_species_data_paths
+from Instrumentation import count_rows, timed_stage
 from preprocessing import AccessibleArea, BackgroundSampling, EnvironmentData, General
+from preprocessing.DistanceToShore import DistanceToShore, get_coastline_path
+from preprocessing.FeatureCube import get_cube_variables, get_source_path
+from ConfigHandler import config
 
 
-def run_preprocessing_pipeline(presence_df, background_df):
-    # Basic filtering for both sets
-    presence_df = General.filter_basic_issues_from_dataset(presence_df)
-    background_df = General.filter_basic_issues_from_dataset(background_df)
-    presence_gdf = General.convert_to_geodataframe(presence_df)
-    background_gdf = General.convert_to_geodataframe(background_df)
+def get_preprocessing_config():
+    """
+    config.PREPROCESSING without the READ_ONLY flags batch and sweep workers set - they don't
+    change the output, so a worker's keys match those of an interactive run
+    """
+    preprocessing_config = config.PREPROCESSING.to_dict()
+    for section in ("FEATURE_CUBE", "DISTANCE_TO_SHORE"):
+        preprocessing_config[section].pop("READ_ONLY", None)
+    return preprocessing_config
 
-    # Accessible area
-    min_lon, max_lon, min_lat, max_lat = AccessibleArea.obtain_initial_bounding_box(
-        presence_gdf
+
+def get_environmental_data_paths():
+    """Source files preprocessing reads - Bio-ORACLE layers and every file of the coastline"""
+    coastline_files = glob.glob(os.path.join(os.path.dirname(get_coastline_path()), "*"))
+    return [get_source_path(var) for var in get_cube_variables()] + sorted(
+        coastline_files
     )
-    background_gdf = AccessibleArea.filter_background_on_bounding_box(
-        background_gdf, min_lon, max_lon, min_lat, max_lat
+
+
+def stream_background_dataset(min_lon, max_lon, min_lat, max_lat):
+    """
+    Read the background download in chunks of DATA.SPECIES.STREAM_CHUNK_ROWS rows and apply the
+    basic and bounding box filters to each, so only surviving rows are ever held together.
+    Totals are reported the same way as loading and filtering the whole file at once.
+    """
+    print("Streaming background data...")
+    _, background_path = get_species_data_paths()
+    surviving_chunks = []
+    species = set()
+    num_rows = 0
+    removed = {}
+    chunks = LoadData.iter_species_data_chunks(
+        background_path, config.DATA.SPECIES.STREAM_CHUNK_ROWS
     )
-    accessible_area = AccessibleArea.create_accessible_area(
-        min_lon, max_lon, min_lat, max_lat
+    for i, chunk in enumerate(chunks):
+        num_rows += chunk.shape[0]
+        species.update(chunk["species"].dropna().unique())
+        chunk_rows = chunk.shape[0]
+        chunk, chunk_removed = General.remove_basic_issues(chunk)
+        chunk, num_outside = AccessibleArea.remove_outside_bounding_box(
+            chunk, min_lon, max_lon, min_lat, max_lat
+        )
+        chunk_removed["bounding box"] = num_outside
+        for reason, num_removed in chunk_removed.items():
+            removed[reason] = removed.get(reason, 0) + num_removed
+        surviving_chunks.append(chunk)
+        print(
+            f"Background chunk {i + 1}: kept {chunk.shape[0]} of {chunk_rows} rows "
+            f"({num_rows} rows read so far)"
+        )
+    print(f"Species Counts: {len(species)}")
+    print(f"Initial number of rows: {num_rows}")
+    General.print_filter_counts(num_rows, removed)
+    return pd.concat(surviving_chunks, ignore_index=True)
+
+
+def sample_background_replicates(accessible_area, background_df):
+    """
+    PREPROCESSING.BG_REPLICATES background sets drawn from the same bias raster, stacked with a
+    "replicate" column so their environment data is gathered in one pass
+    """
+    replicates = BackgroundSampling.sample_background_point_replicates(
+        accessible_area, background_df, n_replicates=config.PREPROCESSING.BG_REPLICATES
     )
-    presence_gdf = AccessibleArea.filter_data_to_be_within_accessible_area(
-        presence_gdf, accessible_area
+    return pd.concat(
+        [replicate.assign(replicate=k) for k, replicate in enumerate(replicates)],
+        ignore_index=True,
     )
-    background_gdf = AccessibleArea.filter_data_to_be_within_accessible_area(
-        background_gdf, accessible_area
+
+
+def split_background_replicates(background_df):
+    """
+    Replicate 0 is the background the model is trained on (the same draw whatever the number of
+    replicates); the others are returned together, or None if there are none
+    """
+    is_model_background = background_df["replicate"] == 0
+    model_background_df = background_df[is_model_background].drop(columns="replicate")
+    if is_model_background.all():
+        return model_background_df.reset_index(drop=True), None
+    return (
+        model_background_df.reset_index(drop=True),
+        background_df[~is_model_background].reset_index(drop=True),
     )
-    background_gdf = General.filter_dataset_1_by_distance_to_dataset_2(
-        background_gdf, presence_gdf
+
+
+def run_preprocessing_pipeline(presence_df, background_df):
+    """
+    Distance-based steps all work on the latitude/longitude columns, so points stay plain
+    DataFrames until they are combined into the final GeoDataFrame.
+    Returns the dataset, the accessible area and the extra background replicates (or None).
+    """
+    # Basic filtering for both sets - a None background is streamed with the filters applied
+    with timed_stage("basic_filtering", count_rows(presence_df)) as stage:
+        presence_df = General.filter_basic_issues_from_dataset(presence_df)
+        stage["rows_out"] = count_rows(presence_df)
+    min_lon, max_lon, min_lat, max_lat = AccessibleArea.obtain_initial_bounding_box(
+        presence_df
     )
+    with timed_stage("background_filtering", count_rows(background_df)) as stage:
+        if background_df is None:
+            background_df = stream_background_dataset(min_lon, max_lon, min_lat, max_lat)
+        else:
+            background_df = General.filter_basic_issues_from_dataset(background_df)
+            background_df = AccessibleArea.filter_background_on_bounding_box(
+                background_df, min_lon, max_lon, min_lat, max_lat
+            )
+        stage["rows_out"] = count_rows(background_df)
+
+    # Accessible area
+    with timed_stage(
+        "accessible_area", count_rows((presence_df, background_df))
+    ) as stage:
+        accessible_area = AccessibleArea.create_accessible_area(
+            min_lon, max_lon, min_lat, max_lat
+        )
+        presence_df = AccessibleArea.filter_data_to_be_within_accessible_area(
+            presence_df, accessible_area
+        )
+        background_df = AccessibleArea.filter_data_to_be_within_accessible_area(
+            background_df, accessible_area
+        )
+        background_df = General.filter_dataset_1_by_distance_to_dataset_2(
+            background_df, presence_df
+        )
+        stage["rows_out"] = count_rows((presence_df, background_df))
 
     # Load environment data - doing this before picking points to remove NaNs earlier
-    presence_gdf = EnvironmentData.load_all_environment_variables(presence_gdf)
+    with timed_stage("presence_environment_data", count_rows(presence_df)) as stage:
+        distance_to_shore = DistanceToShore.from_accessible_area(accessible_area)
+        presence_df = EnvironmentData.load_all_environment_variables(
+            presence_df, distance_to_shore
+        )
+        stage["rows_out"] = count_rows(presence_df)
 
     # Bias correction incl pseudo-absence selection
-    presence_gdf = General.spatially_thin(presence_gdf)
-    background_gdf = BackgroundSampling.sample_background_points(
-        accessible_area, background_gdf
-    )
-    background_gdf = EnvironmentData.load_all_environment_variables(background_gdf)
+    with timed_stage("spatial_thinning", count_rows(presence_df)) as stage:
+        presence_df = General.spatially_thin(presence_df)
+        stage["rows_out"] = count_rows(presence_df)
+    with timed_stage("background_sampling", count_rows(background_df)) as stage:
+        background_df = sample_background_replicates(accessible_area, background_df)
+        stage["rows_out"] = count_rows(background_df)
+    with timed_stage("background_environment_data", count_rows(background_df)) as stage:
+        background_df = EnvironmentData.load_all_environment_variables(
+            background_df, distance_to_shore
+        )
+        stage["rows_out"] = count_rows(background_df)
+    background_df, background_replicates = split_background_replicates(background_df)
 
-    gdf = General.combine_presence_and_background_into_single_gdf(
-        presence_gdf, background_gdf
-    )
-    return gdf, accessible_area
+    with timed_stage("combine", count_rows((presence_df, background_df))) as stage:
+        gdf = General.combine_presence_and_background_into_single_gdf(
+            presence_df, background_df
+        )
+        stage["rows_out"] = count_rows(gdf)
+    return gdf, accessible_area, background_replicates
@@ -25,6 +25,10 @@ class ResultsHandler:
     def add_multiple_metrics(self, metrics):
         self.results.update(metrics)
 
+    def add_timings(self, timings):
+        """Per-stage wall/CPU time, peak memory and row counts - see Instrumentation.timed_stage"""
+        self.results["timings"] = timings
+
     def save_results(self, results_name="results.json"):
         results_file_path = os.path.join(self.results_path, results_name)
         results_file = open(results_file_path, "w")
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+import xarray as xr
+
+from ConfigHandler import config
+
+# Pipeline stages in order - invalidating one also invalidates every stage after it
+STAGES = ["dataset", "preprocessing", "split"]
+SRC_FOLDER = pathlib.Path(__file__).parent
+MANIFEST_FILE = "manifest.json"
+
+
+def fingerprint_file(path):
+    stat = os.stat(path)
+    return [os.path.normpath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def fingerprint_code(paths):
+    """Hash of the source of modules/packages (relative to src/), so code changes count too"""
+    key = hashlib.sha1()
+    for path in paths:
+        path = SRC_FOLDER / path
+        files = sorted(path.rglob("*.py")) if path.is_dir() else [path]
+        for file in files:
+            key.update(str(file.relative_to(SRC_FOLDER)).encode())
+            key.update(file.read_bytes())
+    return key.hexdigest()
+
+
+def get_folder_size(path):
+    size = 0
+    for file in pathlib.Path(path).rglob("*"):
+        try:
+            size += file.stat().st_size if file.is_file() else 0
+        except FileNotFoundError:
+            # Evicted or replaced by another process mid-walk
+            pass
+    return size
+
+
+def get_mtime(path):
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        return 0
+
+
+def save_output(obj, folder, name):
+    """Write one stage output in a fast binary format, returning how to read it back"""
+    if isinstance(obj, pd.DataFrame):
+        try:
+            obj.to_parquet(os.path.join(folder, f"{name}.parquet"))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # GBIF columns can mix types within a column, which parquet can't hold
+            obj.to_pickle(os.path.join(folder, f"{name}.pkl"))
+            return "pickle"
+        return "geoparquet" if isinstance(obj, gpd.GeoDataFrame) else "parquet"
+    if isinstance(obj, xr.DataArray):
+        obj.to_netcdf(os.path.join(folder, f"{name}.nc"))
+        return "netcdf"
+    if isinstance(obj, str):
+        with open(os.path.join(folder, f"{name}.txt"), "w") as f:
+            f.write(obj)
+        return "text"
+    raise TypeError(f"Can't cache stage output '{name}' of type {type(obj).__name__}")
+
+
+def load_output(folder, name, output_format):
+    if output_format == "geoparquet":
+        return gpd.read_parquet(os.path.join(folder, f"{name}.parquet"))
+    if output_format == "parquet":
+        return pd.read_parquet(os.path.join(folder, f"{name}.parquet"))
+    if output_format == "pickle":
+        return pd.read_pickle(os.path.join(folder, f"{name}.pkl"))
+    if output_format == "netcdf":
+        with xr.open_dataarray(os.path.join(folder, f"{name}.nc")) as data_array:
+            return data_array.load()
+    if output_format == "text":
+        with open(os.path.join(folder, f"{name}.txt")) as f:
+            return f.read()
+    raise ValueError(f"Unknown stage output format: {output_format}")
+
+
+class StageCache:
+    """Content-addressed store of pipeline stage outputs under STAGE_CACHE.FOLDER"""
+
+    def __init__(self):
+        self.use = config.STAGE_CACHE.USE
+        self.folder = config.STAGE_CACHE.FOLDER
+        invalidated = [STAGES.index(stage) for stage in config.STAGE_CACHE.INVALIDATE]
+        self.first_invalidated = min(invalidated, default=len(STAGES))
+
+    def get_key(self, stage, config_sections, upstream_keys=(), files=(), code=()):
+        inputs = {
+            "stage": stage,
+            "config": config_sections,
+            "upstream": list(upstream_keys),
+            "files": [fingerprint_file(path) for path in files],
+            "code": fingerprint_code(code),
+        }
+        payload = json.dumps(inputs, sort_keys=True, default=str).encode()
+        return f"{stage}_{hashlib.sha1(payload).hexdigest()}"
+
+    def is_invalidated(self, stage):
+        return STAGES.index(stage) >= self.first_invalidated
+
+    def load(self, stage, key):
+        entry_path = os.path.join(self.folder, key)
+        manifest_path = os.path.join(entry_path, MANIFEST_FILE)
+        if not self.use or self.is_invalidated(stage):
+            return None
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        outputs = {
+            name: load_output(entry_path, name, output_format)
+            for name, output_format in manifest["outputs"].items()
+        }
+        # Mark as recently used for eviction
+        os.utime(entry_path)
+        print(f"Loaded {stage} outputs from stage cache: {entry_path}")
+        return outputs
+
+    def save(self, stage, key, outputs):
+        if not self.use:
+            return
+        entry_path = os.path.join(self.folder, key)
+        tmp_path = f"{entry_path}.tmp{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        manifest = {
+            "stage": stage,
+            "outputs": {
+                name: save_output(obj, tmp_path, name) for name, obj in outputs.items()
+            },
+        }
+        # Manifest last - entries without one are incomplete and ignored
+        with open(os.path.join(tmp_path, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=4)
+        shutil.rmtree(entry_path, ignore_errors=True)
+        os.replace(tmp_path, entry_path)
+        print(f"Saved {stage} outputs to stage cache: {entry_path}")
+        self.evict(keep=key)
+
+    def run(self, stage, key, compute):
+        """Stage outputs from the cache, or from `compute()` (a dict) and stored for next time"""
+        outputs = self.load(stage, key)
+        if outputs is None:
+            outputs = compute()
+            self.save(stage, key, outputs)
+        return outputs
+
+    def evict(self, keep=None):
+        max_bytes = config.STAGE_CACHE.MAX_SIZE_MB * 1024**2
+        entries = [
+            entry
+            for entry in pathlib.Path(self.folder).iterdir()
+            if entry.is_dir() and (entry / MANIFEST_FILE).exists()
+        ]
+        sizes = {entry: get_folder_size(entry) for entry in entries}
+        total_bytes = sum(sizes.values())
+        for entry in sorted(entries, key=get_mtime):
+            if total_bytes <= max_bytes:
+                break
+            if entry.name == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total_bytes -= sizes[entry]
+            print(f"Evicted {entry.name} from stage cache")
+
+    def clear(self, stage=None):
+        """Delete every cached entry (of one stage, if given)"""
+        if not os.path.exists(self.folder):
+            return
+        for entry in pathlib.Path(self.folder).iterdir():
+            if entry.is_dir() and (stage is None or entry.name.startswith(f"{stage}_")):
+                shutil.rmtree(entry)
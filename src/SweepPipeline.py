@@ -0,0 +1,266 @@
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import xarray as xr
+
+from ExperimentHandler import create_unique_folder
+from Pipeline import get_preprocessing_key, run_experiment, run_preprocessing_stages
+from preprocessing.DistanceToShore import DistanceToShore
+from preprocessing.FeatureCube import get_cube_variables, get_feature_cube
+from preprocessing.General import convert_to_geodataframe
+from StageCache import StageCache
+from training.Parallel import split_thread_budget
+from ConfigHandler import config
+
+DATASET_FILE = "dataset.arrow"
+BACKGROUND_REPLICATES_FILE = "background_replicates.arrow"
+ACCESSIBLE_AREA_FILE = "accessible_area.npy"
+LATITUDE_FILE = "latitude.npy"
+LONGITUDE_FILE = "longitude.npy"
+MANIFEST_FILE = "manifest.json"
+
+
+def set_config_value(path, value):
+    """Set a dotted config path (e.g. "MODEL.MAX_DEPTH") - it must already exist, to catch typos"""
+    *parents, key = path.split(".")
+    section = config
+    for parent in parents:
+        section = section[parent]
+    if key not in section:
+        raise KeyError(f"Unknown config setting in sweep: {path}")
+    section[key] = value
+
+
+def apply_overrides(overrides):
+    for path, value in overrides.items():
+        set_config_value(path, value)
+
+
+def get_sweep_variants():
+    """Config overrides (dotted paths) for each SWEEP.GRID combination and SWEEP.VARIANTS entry"""
+    grid = config.SWEEP.GRID.to_dict()
+    grid_variants = [
+        dict(zip(grid, values)) for values in itertools.product(*grid.values())
+    ]
+    variants = [dict(variant) for variant in config.SWEEP.VARIANTS] or [{}]
+    sweep_variants = [
+        {**variant, **grid_variant}
+        for variant in variants
+        for grid_variant in grid_variants
+    ]
+    if sweep_variants == [{}]:
+        raise ValueError("Sweep needs SWEEP.GRID and/or SWEEP.VARIANTS")
+    return sweep_variants
+
+
+def export_table(df, path):
+    table = pa.Table.from_pandas(
+        pd.DataFrame(df).drop(columns="geometry", errors="ignore"), preserve_index=False
+    )
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def load_table(path):
+    return pa.ipc.open_file(pa.memory_map(path)).read_all().to_pandas(split_blocks=True)
+
+
+def export_preprocessed(dataset, accessible_area, background_replicates, folder):
+    """Write preprocessed outputs as Arrow IPC and .npy, so workers can memory-map them"""
+    os.makedirs(folder, exist_ok=True)
+    export_table(dataset, os.path.join(folder, DATASET_FILE))
+    if background_replicates is not None:
+        export_table(background_replicates, os.path.join(folder, BACKGROUND_REPLICATES_FILE))
+    np.save(os.path.join(folder, ACCESSIBLE_AREA_FILE), accessible_area.values)
+    np.save(os.path.join(folder, LATITUDE_FILE), accessible_area["latitude"].values)
+    np.save(os.path.join(folder, LONGITUDE_FILE), accessible_area["longitude"].values)
+    with open(os.path.join(folder, MANIFEST_FILE), "w") as f:
+        json.dump({"accessible_area_name": accessible_area.name}, f)
+
+
+def load_preprocessed(folder):
+    """Memory-mapped, read-only outputs written by `export_preprocessed`"""
+    with open(os.path.join(folder, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    dataset = convert_to_geodataframe(load_table(os.path.join(folder, DATASET_FILE)))
+    background_replicates_path = os.path.join(folder, BACKGROUND_REPLICATES_FILE)
+    background_replicates = None
+    if os.path.exists(background_replicates_path):
+        background_replicates = load_table(background_replicates_path)
+    accessible_area = xr.DataArray(
+        np.load(os.path.join(folder, ACCESSIBLE_AREA_FILE), mmap_mode="r"),
+        coords={
+            "latitude": np.load(os.path.join(folder, LATITUDE_FILE)),
+            "longitude": np.load(os.path.join(folder, LONGITUDE_FILE)),
+        },
+        dims=("latitude", "longitude"),
+        name=manifest["accessible_area_name"],
+    )
+    return dataset, accessible_area, background_replicates
+
+
+def prepare_shared_environment(sweep_variants, region_bounds, config_snapshot):
+    """Build the feature cube and distance raster for every variant before workers start"""
+    variables = []
+    needs_raster = False
+    for overrides in sweep_variants:
+        config.merge_update(config_snapshot)
+        apply_overrides(overrides)
+        variables += [var for var in get_cube_variables() if var not in variables]
+        needs_raster |= (
+            "distance_to_shore_m" in config.PREPROCESSING.ENVIRONMENT_DATA
+            and config.PREPROCESSING.DISTANCE_TO_SHORE.MODE == "fast"
+        )
+    config.merge_update(config_snapshot)
+
+    min_lons, max_lons, min_lats, max_lats = zip(*region_bounds)
+    bounds = (min(min_lons), max(max_lons), min(min_lats), max(max_lats))
+    if config.PREPROCESSING.FEATURE_CUBE.USE:
+        get_feature_cube(*bounds, variables=variables)
+    if needs_raster:
+        DistanceToShore(*bounds, mode="fast").load()
+
+
+def prepare_shared_datasets(sweep_variants, shared_folder, config_snapshot):
+    """Preprocess and export once per distinct preprocessing config: the variants' keys"""
+    stage_cache = StageCache()
+    preprocessing_keys = []
+    region_bounds = []
+    for overrides in sweep_variants:
+        config.merge_update(config_snapshot)
+        apply_overrides(overrides)
+        preprocessing_key = get_preprocessing_key(stage_cache)
+        preprocessing_keys.append(preprocessing_key)
+        folder = os.path.join(shared_folder, preprocessing_key)
+        if not os.path.exists(os.path.join(folder, MANIFEST_FILE)):
+            dataset, accessible_area, _, background_replicates = run_preprocessing_stages(
+                stage_cache
+            )
+            export_preprocessed(dataset, accessible_area, background_replicates, folder)
+            region_bounds.append(DistanceToShore.from_accessible_area(accessible_area).bounds)
+    config.merge_update(config_snapshot)
+    prepare_shared_environment(sweep_variants, region_bounds, config_snapshot)
+    print(
+        f"Prepared {len(set(preprocessing_keys))} preprocessed dataset(s) "
+        f"for {len(sweep_variants)} runs"
+    )
+    return preprocessing_keys
+
+
+def run_sweep_experiment(
+    experiment_title,
+    experiment_description,
+    overrides,
+    shared_folder,
+    preprocessing_key,
+    config_snapshot,
+    threads,
+):
+    """One sweep run on the shared preprocessed data, in a worker process"""
+    config.merge_update(config_snapshot)
+    apply_overrides(overrides)
+    config.TRAINING.MAX_THREADS = threads
+    config.PREPROCESSING.FEATURE_CUBE.READ_ONLY = True
+    config.PREPROCESSING.DISTANCE_TO_SHORE.READ_ONLY = True
+    dataset, accessible_area, background_replicates = load_preprocessed(
+        os.path.join(shared_folder, preprocessing_key)
+    )
+    return run_experiment(
+        experiment_title,
+        experiment_description,
+        preprocessed=(dataset, accessible_area, preprocessing_key, background_replicates),
+    )
+
+
+def summarise_run(run, override_columns):
+    """One summary table row: overrides, headline metrics and total wall time of a run"""
+    row = {"run": run["title"], "status": run["status"]}
+    row.update({column: run["overrides"].get(column) for column in override_columns})
+    results_file = os.path.join(run.get("folder") or "", "results.json")
+    if run["status"] == "finished" and os.path.exists(results_file):
+        with open(results_file) as f:
+            results = json.load(f)
+        row.update(
+            {
+                "cv_mean_f1": results.get("cv", {}).get("mean_f1"),
+                "cv_std_f1": results.get("cv", {}).get("std_f1"),
+                "test_precision": results.get("test", {}).get("precision"),
+                "test_recall": results.get("test", {}).get("recall"),
+                "test_f1": results.get("test", {}).get("f1"),
+                "wall_time_s": round(
+                    sum(
+                        timing["wall_time_s"]
+                        for name, timing in results.get("timings", {}).items()
+                        if "/" not in name
+                    ),
+                    2,
+                ),
+            }
+        )
+    row["folder"] = run.get("folder")
+    return row
+
+
+def run_sweep(sweep_title: str = "", sweep_description: str = ""):
+    """Run one experiment per SWEEP variant in a process pool and summarise them in summary.csv"""
+    sweep_variants = get_sweep_variants()
+    sweep_folder = create_unique_folder(
+        config.SWEEP.FOLDER, f"{time.strftime('%Y-%m-%d_%H-%M')}_{sweep_title}"
+    )
+    print(f"Running sweep '{sweep_title}' with {len(sweep_variants)} runs in {sweep_folder}")
+    shared_folder = os.path.join(sweep_folder, "shared")
+    config_snapshot = config.to_dict()
+    with open(os.path.join(sweep_folder, "sweep.json"), "w") as f:
+        json.dump(
+            {"description": sweep_description, "variants": sweep_variants}, f, indent=4
+        )
+
+    try:
+        preprocessing_keys = prepare_shared_datasets(
+            sweep_variants, shared_folder, config_snapshot
+        )
+        num_workers, threads_per_worker = split_thread_budget(
+            len(sweep_variants), config.SWEEP.MAX_WORKERS
+        )
+        runs = [
+            {"title": f"{sweep_title}_{i:03d}", "overrides": overrides}
+            for i, overrides in enumerate(sweep_variants)
+        ]
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = [
+                executor.submit(
+                    run_sweep_experiment,
+                    run["title"],
+                    f"{sweep_description} ({run['overrides']})",
+                    run["overrides"],
+                    shared_folder,
+                    preprocessing_key,
+                    config_snapshot,
+                    threads_per_worker,
+                )
+                for run, preprocessing_key in zip(runs, preprocessing_keys)
+            ]
+            for run, future in zip(runs, futures):
+                try:
+                    run["folder"] = future.result()
+                    run["status"] = "finished"
+                except Exception as e:
+                    run["status"] = f"failed: {e!r}"
+                print(f"Sweep run {run['title']} {run['status']}")
+    finally:
+        shutil.rmtree(shared_folder, ignore_errors=True)
+
+    override_columns = list(dict.fromkeys(key for run in runs for key in run["overrides"]))
+    summary = pd.DataFrame([summarise_run(run, override_columns) for run in runs])
+    summary.to_csv(os.path.join(sweep_folder, "summary.csv"), index=False)
+    print(summary.drop(columns="folder").to_string(index=False))
+    print(f"Saved sweep summary to: {os.path.join(sweep_folder, 'summary.csv')}")
+    return summary
@@ -1,6 +1,7 @@
 from sklearn.model_selection import train_test_split
 
-from optimisation.Threshold import find_optimal_threshold
+from evaluation.PredictionStore import PredictionStore
+from optimisation.Threshold import find_optimal_threshold_from_probs
 from training.Model import create_xgboost_model, train_xgboost_model
 from training.Training import (
     prepare_data_for_modelling,
@@ -10,12 +11,16 @@ from training.Training import (
 from ConfigHandler import config
 
 
-def run_training_pipeline(dataset):
+def run_training_pipeline(dataset, prediction_store=None):
+    """The threshold is found from the validation predictions kept in the prediction store"""
     print("Training final model")
+    if prediction_store is None:
+        prediction_store = PredictionStore()
     X, y = prepare_data_for_modelling(dataset)
-    X_train, X_val, y_train, y_val = train_test_split(
+    X_train, X_val, y_train, y_val, _, rows_val = train_test_split(
         X,
         y,
+        dataset.index.values,
         test_size=config.TRAINING.VAL_PROP,
         random_state=0,
         stratify=y,
@@ -23,6 +28,10 @@ def run_training_pipeline(dataset):
     pos_weight = calculate_class_weights(y_train)
     model = create_xgboost_model(pos_weight)
     model = train_xgboost_model(model, X_train, y_train, X_val, y_val)
-    best_threshold = find_optimal_threshold(model, X_val, y_val)
+    prediction_store.add("final", "val", rows_val, y_val, model.predict_proba(X_val)[:, 1])
+    val_predictions = prediction_store.get("final", "val")
+    best_threshold = find_optimal_threshold_from_probs(
+        val_predictions["label"].values, val_predictions["prob"].values
+    )
     config.PREDICTION.THRESHOLD = best_threshold.item()
     return model
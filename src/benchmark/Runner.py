@@ -0,0 +1,182 @@
+import json
+import os
+import platform
+import subprocess
+import time
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from benchmark.Stages import BENCHMARKS, SyntheticWorld
+from Instrumentation import count_rows, get_timings, reset_timings, timed_stage
+from ResultsHandler import NpEncoder
+from ConfigHandler import config
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_environment_info():
+    """What the numbers depend on besides the code - compare like with like"""
+    return {
+        "git_commit": get_git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "xgboost": xgb.__version__,
+    }
+
+
+def get_scales(stage):
+    max_points = config.BENCHMARK.MAX_POINTS.get(stage)
+    return [
+        scale for scale in config.BENCHMARK.SCALES if max_points is None or scale <= max_points
+    ]
+
+
+def run_benchmark(world, stage, num_points):
+    """
+    Time one stage at one scale: a warm-up call (first-use costs like building the feature cube or
+    loading the coastline index), then BENCHMARK.REPEATS timed calls.
+    """
+    config_snapshot = config.to_dict()
+    try:
+        run = BENCHMARKS[stage](world, num_points)
+        for _ in range(config.BENCHMARK.WARMUP):
+            run()
+        reset_timings()
+        rows_out = None
+        for i in range(config.BENCHMARK.REPEATS):
+            with timed_stage(f"{stage}_{i}", num_points) as record:
+                record["rows_out"] = count_rows(run())
+            rows_out = record["rows_out"]
+        records = list(get_timings().values())
+    finally:
+        config.merge_update(config_snapshot)
+
+    wall_times = [record["wall_time_s"] for record in records]
+    return {
+        "stage": stage,
+        "num_points": num_points,
+        "repeats": len(records),
+        "wall_time_s": {
+            "min": min(wall_times),
+            "median": float(np.median(wall_times)),
+            "max": max(wall_times),
+        },
+        "cpu_time_s": float(np.median([record["cpu_time_s"] for record in records])),
+        "peak_rss_mb": max(record["peak_rss_mb"] for record in records),
+        "rows_out": rows_out,
+    }
+
+
+def run_benchmarks(stages=None, scales=None):
+    """Every stage (default: all in Stages.BENCHMARKS) at every scale it allows"""
+    if scales is not None:
+        config.BENCHMARK.SCALES = sorted(scales)
+    world = SyntheticWorld()
+    results = []
+    for stage in stages or list(BENCHMARKS):
+        for num_points in get_scales(stage):
+            print(f"Benchmarking {stage} with {num_points} points...")
+            result = run_benchmark(world, stage, num_points)
+            results.append(result)
+            print(
+                f"Benchmark {stage} ({num_points} points): "
+                f"{result['wall_time_s']['median']:.3f}s median wall time"
+            )
+    return {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "environment": get_environment_info(),
+        "config": config.BENCHMARK.to_dict(),
+        "results": results,
+    }
+
+
+def save_benchmark_results(benchmark_results, path=None):
+    if path is None:
+        path = os.path.join(
+            config.BENCHMARK.FOLDER, f"{time.strftime('%Y-%m-%d_%H-%M-%S')}.json"
+        )
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(benchmark_results, f, indent=4, cls=NpEncoder)
+    print(f"Saved benchmark results to: {path}")
+    return path
+
+
+def load_benchmark_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_benchmark_results(benchmark_results, baseline_results):
+    """
+    Compare median wall times per (stage, num_points) with a baseline. A stage regresses if it is
+    more than BENCHMARK.REGRESSION_TOLERANCE slower and the slowdown is over
+    BENCHMARK.MIN_REGRESSION_S (so noise on very fast stages isn't flagged).
+    """
+    tolerance = config.BENCHMARK.REGRESSION_TOLERANCE
+    baseline = {
+        (result["stage"], result["num_points"]): result
+        for result in baseline_results["results"]
+    }
+    comparison = []
+    for result in benchmark_results["results"]:
+        key = (result["stage"], result["num_points"])
+        current_time = result["wall_time_s"]["median"]
+        row = {
+            "stage": result["stage"],
+            "num_points": result["num_points"],
+            "wall_time_s": current_time,
+            "baseline_wall_time_s": None,
+            "ratio": None,
+            "status": "new",
+        }
+        if key in baseline:
+            baseline_time = baseline[key]["wall_time_s"]["median"]
+            slowdown = current_time - baseline_time
+            row["baseline_wall_time_s"] = baseline_time
+            row["ratio"] = current_time / baseline_time if baseline_time > 0 else None
+            if (
+                slowdown > config.BENCHMARK.MIN_REGRESSION_S
+                and current_time > baseline_time * (1 + tolerance)
+            ):
+                row["status"] = "regression"
+            elif (
+                -slowdown > config.BENCHMARK.MIN_REGRESSION_S
+                and current_time < baseline_time * (1 - tolerance)
+            ):
+                row["status"] = "improvement"
+            else:
+                row["status"] = "ok"
+        comparison.append(row)
+    return comparison
+
+
+def print_comparison(comparison):
+    print(f"{'stage':<45}{'points':>10}{'baseline_s':>12}{'current_s':>12}{'ratio':>8}  status")
+    for row in comparison:
+        baseline_time = row["baseline_wall_time_s"]
+        ratio = row["ratio"]
+        print(
+            f"{row['stage']:<45}{row['num_points']:>10}"
+            f"{'-' if baseline_time is None else f'{baseline_time:.3f}':>12}"
+            f"{row['wall_time_s']:>12.3f}"
+            f"{'-' if ratio is None else f'{ratio:.2f}':>8}  {row['status']}"
+        )
+    num_regressions = sum(row["status"] == "regression" for row in comparison)
+    print(f"{num_regressions} regression(s) against the baseline")
+    return num_regressions
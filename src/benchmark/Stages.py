@@ -0,0 +1,244 @@
+import math
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from benchmark.SyntheticData import (
+    create_environment_data,
+    create_gbif_data,
+    create_land,
+    get_grid,
+    sample_clustered_points,
+    save_gbif_data,
+    use_synthetic_data,
+)
+from dataset import LoadData
+from evaluation.RasterPrediction import predict_over_raster
+from preprocessing import AccessibleArea, BackgroundSampling, EnvironmentData, General
+from preprocessing.DistanceToShore import DistanceToShore
+from preprocessing.FeatureCube import get_source_path
+from training import Training
+from training.FoldData import clear_fold_data_cache
+from training.Model import create_xgboost_model, train_xgboost_model
+from ConfigHandler import config
+
+SPECIES = ["Felimare picta", "Hypselodoris villafranca", "Asterias rubens", "Anemonia viridis"]
+
+
+class SyntheticWorld:
+    """
+    Synthetic study region shared by every benchmark: Bio-ORACLE-style layers and a coastline on
+    disk under BENCHMARK.DATA_FOLDER (created once, reused by later runs), plus point sets and
+    labelled datasets generated on demand for each scale.
+    """
+
+    def __init__(self, folder=None, seed=None):
+        self.folder = folder or config.BENCHMARK.DATA_FOLDER
+        self.seed = config.BENCHMARK.SEED if seed is None else seed
+        self.bounds = tuple(config.BENCHMARK.BOUNDS)
+        self.resolution = config.BENCHMARK.RESOLUTION
+        use_synthetic_data(self.folder)
+        if os.path.exists(get_source_path("bathymetry")):
+            # Land only depends on the seed, so it matches the layers already on disk
+            self.land = create_land(self.bounds, np.random.default_rng(self.seed))
+        else:
+            self.land = create_environment_data(
+                config.DATA.ENVIRONMENTAL.FOLDER, self.bounds, self.resolution, self.seed
+            )
+        self.accessible_area = AccessibleArea.create_accessible_area(*self.bounds)
+        self.points = {}
+        self.datasets = {}
+        self.raw_data = {}
+
+    def get_rng(self, *keys):
+        return np.random.default_rng([self.seed, *keys])
+
+    def get_points(self, num_points, key=0, num_clusters=200, spread=0.3):
+        """Clustered points (incl. some on land) with the columns left after basic filtering"""
+        cache_key = (num_points, key, num_clusters, spread)
+        if cache_key not in self.points:
+            rng = self.get_rng(num_points, key)
+            lats, lons = sample_clustered_points(
+                self.land, self.bounds, num_points, rng, num_clusters, spread
+            )
+            self.points[cache_key] = pd.DataFrame(
+                {
+                    "gbifID": np.arange(num_points, dtype=np.int64),
+                    "species": rng.choice(SPECIES, num_points),
+                    "latitude": lats,
+                    "longitude": lons,
+                    "coordinateUncertaintyInMeters": rng.uniform(1, 500, num_points),
+                }
+            )
+        return self.points[cache_key]
+
+    def get_gbif_path(self, num_rows):
+        """A GBIF-format download of `num_rows` occurrences, written on first use"""
+        path = os.path.join(config.DATA.SPECIES.FOLDER, f"occurrences_{num_rows}.csv")
+        if not os.path.exists(path):
+            df = create_gbif_data(
+                self.land, self.bounds, num_rows, SPECIES, self.get_rng(num_rows, 1)
+            )
+            save_gbif_data(df, path)
+        return path
+
+    def get_raw_data(self, num_rows):
+        if num_rows not in self.raw_data:
+            self.raw_data[num_rows] = pd.read_csv(self.get_gbif_path(num_rows), sep="\t")
+        return self.raw_data[num_rows]
+
+    def get_dataset(self, num_points):
+        """
+        Labelled dataset of `num_points` ocean points with environmental features, like the output
+        of preprocessing. Labels follow a noisy logistic response to the features (~10% presence).
+        """
+        if num_points not in self.datasets:
+            rng = self.get_rng(num_points, 2)
+            distance_to_shore = DistanceToShore.from_accessible_area(self.accessible_area)
+            chunks, num_kept = [], 0
+            while num_kept < num_points:
+                lats, lons = sample_clustered_points(
+                    self.land, self.bounds, 2 * (num_points - num_kept), rng
+                )
+                chunk = EnvironmentData.load_all_environment_variables(
+                    pd.DataFrame({"latitude": lats, "longitude": lons}), distance_to_shore
+                )
+                chunks.append(chunk)
+                num_kept += len(chunk)
+            dataset = pd.concat(chunks, ignore_index=True).iloc[:num_points]
+            features = dataset[config.PREPROCESSING.ENVIRONMENT_DATA].values
+            features = (features - features.mean(axis=0)) / (features.std(axis=0) + 1e-9)
+            response = features @ rng.normal(size=features.shape[1]) + rng.normal(
+                0, 1, num_points
+            )
+            dataset["label"] = (response > np.quantile(response, 0.9)).astype(int)
+            self.datasets[num_points] = dataset
+        return self.datasets[num_points]
+
+    def get_prediction_area(self, num_cells):
+        """A window of the grid with about `num_cells` cells (capped at the grid), all accessible"""
+        lats, lons = get_grid(self.bounds, self.resolution)
+        num_rows = min(len(lats), max(1, int(math.sqrt(num_cells))))
+        num_cols = min(len(lons), max(1, math.ceil(num_cells / num_rows)))
+        return xr.DataArray(
+            np.ones((num_rows, num_cols), dtype=np.uint8),
+            coords={"latitude": lats[:num_rows], "longitude": lons[:num_cols]},
+            dims=("latitude", "longitude"),
+            name="M_accessible",
+        )
+
+
+def train_benchmark_model(dataset):
+    X, y = Training.prepare_data_for_modelling(dataset)
+    model = create_xgboost_model(Training.calculate_class_weights(y))
+    return train_xgboost_model(model, X, y, X, y)
+
+
+# Each benchmark prepares its inputs (untimed) and returns the call to time, which returns its
+# output so rows out can be counted
+
+
+def bench_load_raw_species_data(world, num_points):
+    path = world.get_gbif_path(num_points)
+    config.DATA.SPECIES.USE_PARQUET = False
+    return lambda: LoadData.load_raw_species_data(path)
+
+
+def bench_filter_basic_issues_from_dataset(world, num_points):
+    df = world.get_raw_data(num_points)
+    return lambda: General.filter_basic_issues_from_dataset(df)
+
+
+def bench_filter_data_to_be_within_accessible_area(world, num_points):
+    points = world.get_points(num_points)
+    return lambda: AccessibleArea.filter_data_to_be_within_accessible_area(
+        points, world.accessible_area
+    )
+
+
+def bench_filter_dataset_1_by_distance_to_dataset_2(world, num_points):
+    background = world.get_points(num_points)
+    presence = world.get_points(max(1, num_points // 10), key=1)
+    return lambda: General.filter_dataset_1_by_distance_to_dataset_2(background, presence)
+
+
+def bench_load_all_environment_variables(world, num_points):
+    points = world.get_points(num_points)[["latitude", "longitude"]]
+
+    def run():
+        distance_to_shore = DistanceToShore.from_accessible_area(world.accessible_area)
+        return EnvironmentData.load_all_environment_variables(points.copy(), distance_to_shore)
+
+    return run
+
+
+def bench_create_raw_raster(world, num_points):
+    points = world.get_points(num_points)
+    return lambda: BackgroundSampling.create_raw_raster(points, world.accessible_area)
+
+
+def bench_sample_background_points(world, num_points):
+    points = world.get_points(num_points)
+    return lambda: BackgroundSampling.sample_background_points(world.accessible_area, points)
+
+
+def bench_spatially_thin(world, num_points):
+    points = world.get_points(num_points)
+    return lambda: General.spatially_thin(points)
+
+
+def bench_spatially_thin_hotspots(world, num_points):
+    """Common species case: 2000 dense hotspots (~3km spread), many points within thinning range"""
+    points = world.get_points(num_points, num_clusters=2000, spread=0.03)
+    return lambda: General.spatially_thin(points)
+
+
+def bench_create_spatial_train_test_split(world, num_points):
+    dataset = world.get_dataset(num_points)
+    return lambda: Training.create_spatial_train_test_split(dataset)[:2]
+
+
+def bench_create_spatial_folds(world, num_points):
+    dataset = world.get_dataset(num_points)
+
+    def run():
+        Training.FOLD_ID_CACHE.clear()
+        return Training.create_spatial_folds(dataset)[0]
+
+    return run
+
+
+def bench_cross_validate(world, num_points):
+    dataset = world.get_dataset(num_points)
+
+    def run():
+        Training.FOLD_ID_CACHE.clear()
+        clear_fold_data_cache()
+        Training.cross_validate(dataset)
+
+    return run
+
+
+def bench_predict_over_accessible_area(world, num_points):
+    model = train_benchmark_model(world.get_dataset(config.BENCHMARK.PREDICTION_TRAIN_POINTS))
+    accessible_area = world.get_prediction_area(num_points)
+    return lambda: predict_over_raster(model, accessible_area)
+
+
+BENCHMARKS = {
+    "load_raw_species_data": bench_load_raw_species_data,
+    "filter_basic_issues_from_dataset": bench_filter_basic_issues_from_dataset,
+    "filter_data_to_be_within_accessible_area": bench_filter_data_to_be_within_accessible_area,
+    "filter_dataset_1_by_distance_to_dataset_2": bench_filter_dataset_1_by_distance_to_dataset_2,
+    "load_all_environment_variables": bench_load_all_environment_variables,
+    "create_raw_raster": bench_create_raw_raster,
+    "sample_background_points": bench_sample_background_points,
+    "spatially_thin": bench_spatially_thin,
+    "spatially_thin_hotspots": bench_spatially_thin_hotspots,
+    "create_spatial_train_test_split": bench_create_spatial_train_test_split,
+    "create_spatial_folds": bench_create_spatial_folds,
+    "cross_validate": bench_cross_validate,
+    "predict_over_accessible_area": bench_predict_over_accessible_area,
+}
@@ -0,0 +1,192 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+import xarray as xr
+from scipy.ndimage import distance_transform_edt, gaussian_filter
+
+from preprocessing.FeatureCube import TIME_SLICE
+from ConfigHandler import config
+
+# Bio-ORACLE variable names inside each file, keyed by the layer's file name
+BIO_ORACLE_VARIABLES = {
+    "bathymetry": "bathymetry_mean",
+    "chlorophyll": "chl_mean",
+    "mean_sst": "thetao_mean",
+    "range_sst": "thetao_range",
+    "salinity": "so_mean",
+    "slope": "slope_mean",
+}
+
+
+def get_grid(bounds, resolution):
+    """Cell centres of a Bio-ORACLE-style grid over (min_lon, max_lon, min_lat, max_lat)"""
+    min_lon, max_lon, min_lat, max_lat = bounds
+    lons = np.round(np.arange(min_lon + resolution / 2, max_lon, resolution), 6)
+    lats = np.round(np.arange(min_lat + resolution / 2, max_lat, resolution), 6)
+    return lats, lons
+
+
+def create_land(bounds, rng, num_islands=40):
+    """A land mass along the northern edge plus random islands, as one (Multi)Polygon"""
+    min_lon, max_lon, min_lat, max_lat = bounds
+    width, height = max_lon - min_lon, max_lat - min_lat
+    coast_lons = np.linspace(min_lon - 1, max_lon + 1, 60)
+    coast_lats = (
+        max_lat
+        - 0.2 * height
+        + 0.08 * height * np.sin(coast_lons / width * 6 * np.pi)
+        + rng.normal(0, 0.01 * height, len(coast_lons))
+    )
+    mainland = shapely.Polygon(
+        list(zip(coast_lons, coast_lats))
+        + [(max_lon + 1, max_lat + 1), (min_lon - 1, max_lat + 1)]
+    )
+    islands = shapely.buffer(
+        shapely.points(
+            rng.uniform(min_lon, max_lon, num_islands),
+            rng.uniform(min_lat, max_lat - 0.2 * height, num_islands),
+        ),
+        rng.uniform(0.005, 0.03, num_islands) * width,
+    )
+    return shapely.union_all(np.append(islands, mainland))
+
+
+def create_environment_layers(land, lats, lons, rng):
+    """
+    Smooth synthetic layers on the grid - NaN on land, and bathymetry that deepens away from the
+    coast so there is a continental shelf for the accessible area.
+    """
+    lon2d, lat2d = np.meshgrid(lons, lats)
+    is_land = shapely.contains_xy(land, lon2d, lat2d)
+    resolution = abs(lons[1] - lons[0])
+    cells_from_coast = distance_transform_edt(~is_land)
+    noise = gaussian_filter(rng.normal(size=lon2d.shape), sigma=10)
+    noise /= np.abs(noise).max()
+
+    depth = np.minimum(5000, 150 * (cells_from_coast * resolution / 0.05) ** 1.3)
+    layers = {
+        "bathymetry": -depth * (1 + 0.3 * noise),
+        "chlorophyll": np.exp(-cells_from_coast / 40) * 3 + 0.1 * (noise + 1),
+        "mean_sst": 30 - 0.5 * (lat2d - lats.min()) + 2 * noise,
+        "range_sst": 6 + 3 * np.cos(np.radians(lat2d) * 4) + noise,
+        "salinity": 37 + 1.5 * noise + 0.02 * (lon2d - lons.min()),
+        "slope": np.abs(np.gradient(depth, axis=0)) + np.abs(np.gradient(depth, axis=1)),
+    }
+    return {
+        name: np.where(is_land, np.nan, values).astype(np.float32)
+        for name, values in layers.items()
+    }
+
+
+def save_bio_oracle_layer(path, var_name, values, lats, lons):
+    ds = xr.Dataset(
+        {var_name: (("time", "latitude", "longitude"), values[None])},
+        coords={
+            "time": pd.to_datetime([TIME_SLICE]),
+            "latitude": lats,
+            "longitude": lons,
+        },
+    )
+    ds.to_netcdf(path)
+
+
+def create_environment_data(folder, bounds, resolution, seed=0):
+    """Bio-ORACLE-style NetCDF layers and a Natural Earth-style coastline shapefile in `folder`"""
+    print(f"Creating synthetic environmental data in {folder}...")
+    rng = np.random.default_rng(seed)
+    land = create_land(bounds, rng)
+    lats, lons = get_grid(bounds, resolution)
+    layers = create_environment_layers(land, lats, lons, rng)
+
+    bio_oracle_folder = os.path.join(folder, config.DATA.ENVIRONMENTAL.BIO_ORACLE.FOLDER)
+    os.makedirs(bio_oracle_folder, exist_ok=True)
+    for name, values in layers.items():
+        save_bio_oracle_layer(
+            os.path.join(bio_oracle_folder, f"{name}.nc"),
+            BIO_ORACLE_VARIABLES[name],
+            values,
+            lats,
+            lons,
+        )
+
+    coastline_path = os.path.join(folder, config.DATA.ENVIRONMENTAL.COASTLINE_DATA_PATH)
+    os.makedirs(os.path.dirname(coastline_path), exist_ok=True)
+    coastline = shapely.get_parts(shapely.boundary(land))
+    gpd.GeoDataFrame(
+        {"featurecla": ["Coastline"] * len(coastline)},
+        geometry=coastline,
+        crs="EPSG:4326",
+    ).to_file(coastline_path)
+    return land
+
+
+def sample_clustered_points(land, bounds, num_points, rng, num_clusters=200, spread=0.3):
+    """
+    Points clustered around spots near the coast, like real observations (divers, harbours),
+    plus 10% scattered uniformly. Points on land are kept - filtering them is part of the pipeline.
+    """
+    min_lon, max_lon, min_lat, max_lat = bounds
+    coast = shapely.boundary(land)
+    centres = shapely.line_interpolate_point(
+        coast, rng.uniform(0, 1, num_clusters), normalized=True
+    )
+    centre_lons, centre_lats = shapely.get_x(centres), shapely.get_y(centres)
+    num_clustered = int(num_points * 0.9)
+    cluster = rng.integers(num_clusters, size=num_clustered)
+    lons = np.concatenate(
+        [
+            centre_lons[cluster] + rng.normal(0, spread, num_clustered),
+            rng.uniform(min_lon, max_lon, num_points - num_clustered),
+        ]
+    )
+    lats = np.concatenate(
+        [
+            centre_lats[cluster] + rng.normal(0, spread, num_clustered),
+            rng.uniform(min_lat, max_lat, num_points - num_clustered),
+        ]
+    )
+    order = rng.permutation(num_points)
+    return (
+        np.clip(lats[order], min_lat, max_lat),
+        np.clip(lons[order], min_lon, max_lon),
+    )
+
+
+def create_gbif_data(land, bounds, num_rows, species, rng):
+    """
+    Occurrences in GBIF download format (the columns LoadData reads, plus a few it skips), with the
+    issues General filters out: missing or large coordinate uncertainty and missing coordinates.
+    """
+    lats, lons = sample_clustered_points(land, bounds, num_rows, rng)
+    uncertainty = rng.lognormal(4, 1.5, num_rows).round(1)
+    uncertainty[rng.random(num_rows) < 0.3] = np.nan
+    lats[rng.random(num_rows) < 0.01] = np.nan
+    years = rng.integers(1990, 2025, num_rows)
+    return pd.DataFrame(
+        {
+            "gbifID": rng.permutation(np.arange(num_rows, dtype=np.int64) + 10**9),
+            "occurrenceID": [f"urn:synthetic:{i}" for i in range(num_rows)],
+            "basisOfRecord": rng.choice(["HUMAN_OBSERVATION", "PRESERVED_SPECIMEN"], num_rows),
+            "species": rng.choice(species, num_rows),
+            "countryCode": rng.choice(["ES", "FR", "IT", "GR", "HR", "TR"], num_rows),
+            "decimalLatitude": lats.round(5),
+            "decimalLongitude": lons.round(5),
+            "coordinateUncertaintyInMeters": uncertainty,
+            "eventDate": pd.to_datetime(years.astype(str)).strftime("%Y-%m-%d"),
+            "year": years,
+        }
+    )
+
+
+def save_gbif_data(df, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_csv(path, sep="\t", index=False)
+
+
+def use_synthetic_data(folder):
+    """Point config.DATA at synthetic data in `folder` (laid out like data/)"""
+    config.DATA.SPECIES.FOLDER = os.path.join(folder, "gbif")
+    config.DATA.ENVIRONMENTAL.FOLDER = os.path.join(folder, "environmental")
@@ -1,10 +1,169 @@
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+from pyarrow import parquet as pq
 
 from ConfigHandler import config
 
 
+def get_species_columns():
+    """
+    Columns (and dtypes) read from GBIF downloads - DATA.SPECIES.COLUMNS plus any column named by
+    PREPROCESSING config, whose dtype is left to the parser.
+    """
+    columns = dict(config.DATA.SPECIES.COLUMNS)
+    for column in [
+        config.PREPROCESSING.BG_WEIGHT_COLUMN,
+        config.PREPROCESSING.SPATIAL_THINNING_PRIORITY_COLUMN,
+    ]:
+        if column is not None and column not in columns:
+            columns[column] = None
+    return columns
+
+
+def get_parquet_stem(data_path):
+    """
+    The download's path relative to DATA.SPECIES.FOLDER, without extension and with "--" for
+    folder separators - so e.g. species/foo.csv and foo.csv get different copies
+    """
+    relative_path = os.path.relpath(data_path, config.DATA.SPECIES.FOLDER)
+    parts = os.path.normpath(os.path.splitext(relative_path)[0]).split(os.sep)
+    return "--".join(".up" if part == os.pardir else part for part in parts)
+
+
+def get_parquet_path(data_path, columns):
+    """Parquet copy of a download, named by the source file's fingerprint and the columns kept"""
+    stat = os.stat(data_path)
+    key = hashlib.sha1(
+        json.dumps([stat.st_size, stat.st_mtime_ns, columns], sort_keys=True).encode()
+    ).hexdigest()[:16]
+    stem = get_parquet_stem(data_path)
+    return os.path.join(
+        config.DATA.SPECIES.FOLDER,
+        config.DATA.SPECIES.PARQUET_FOLDER,
+        f"{stem}_{key}.parquet",
+    )
+
+
+def read_species_csv(data_path, columns):
+    """Only the needed columns, with the multithreaded pyarrow parser"""
+    return pd.read_csv(
+        data_path,
+        sep="\t",
+        usecols=list(columns),
+        dtype={column: dtype for column, dtype in columns.items() if dtype is not None},
+        engine="pyarrow",
+        on_bad_lines="skip",
+    )
+
+
+def get_arrow_type(dtype):
+    if dtype == "category":
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.from_numpy_dtype(np.dtype(dtype))
+
+
+def iter_csv_batches(data_path, columns):
+    """Stream the needed columns of a download in blocks, parsed like `read_species_csv`"""
+    reader = pa_csv.open_csv(
+        data_path,
+        read_options=pa_csv.ReadOptions(use_threads=True),
+        parse_options=pa_csv.ParseOptions(
+            delimiter="\t", invalid_row_handler=lambda row: "skip"
+        ),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=list(columns),
+            column_types={
+                column: get_arrow_type(dtype)
+                for column, dtype in columns.items()
+                if dtype is not None
+            },
+            strings_can_be_null=True,
+        ),
+    )
+    for batch in reader:
+        yield batch
+
+
+def get_tmp_path(parquet_path):
+    return f"{parquet_path}.tmp{os.getpid()}"
+
+
+def finish_parquet_copy(data_path, parquet_path, tmp_path):
+    # Copies of older versions of this download (only - not of downloads sharing a name prefix)
+    # are no longer needed
+    old_copy = re.compile(re.escape(get_parquet_stem(data_path)) + r"_[0-9a-f]{16}\.parquet")
+    parquet_folder = os.path.dirname(parquet_path)
+    for file_name in os.listdir(parquet_folder):
+        if old_copy.fullmatch(file_name):
+            try:
+                os.remove(os.path.join(parquet_folder, file_name))
+            except FileNotFoundError:
+                # Removed by another process (e.g. a batch worker) in the meantime
+                pass
+    os.replace(tmp_path, parquet_path)
+    print(f"Saved parquet copy of {data_path} to {parquet_path}")
+
+
+def save_parquet_copy(df, data_path, parquet_path):
+    os.makedirs(os.path.dirname(parquet_path), exist_ok=True)
+    tmp_path = get_tmp_path(parquet_path)
+    df.to_parquet(tmp_path)
+    finish_parquet_copy(data_path, parquet_path, tmp_path)
+
+
 def load_raw_species_data(data_path):
-    df = pd.read_csv(data_path, sep="\t", on_bad_lines="skip")
+    columns = get_species_columns()
+    if config.DATA.SPECIES.USE_PARQUET:
+        parquet_path = get_parquet_path(data_path, columns)
+        if os.path.exists(parquet_path):
+            df = pd.read_parquet(parquet_path)
+        else:
+            df = read_species_csv(data_path, columns)
+            save_parquet_copy(df, data_path, parquet_path)
+    else:
+        df = read_species_csv(data_path, columns)
     print(f"Species Counts: {df['species'].nunique()}")
     print(f"Initial number of rows: {df.shape[0]}")
     return df
+
+
+def iter_species_data_chunks(data_path, chunk_rows):
+    """
+    Yield a download as DataFrames of about `chunk_rows` rows, so it never has to fit in memory.
+    Reads the Parquet copy if there is one, otherwise streams the CSV and writes the copy on the way.
+    """
+    columns = get_species_columns()
+    parquet_path = None
+    if config.DATA.SPECIES.USE_PARQUET:
+        parquet_path = get_parquet_path(data_path, columns)
+        if os.path.exists(parquet_path):
+            parquet_file = pq.ParquetFile(parquet_path)
+            for batch in parquet_file.iter_batches(batch_size=chunk_rows):
+                yield batch.to_pandas()
+            return
+        os.makedirs(os.path.dirname(parquet_path), exist_ok=True)
+
+    writer = None
+    pending, pending_rows = [], 0
+    for batch in iter_csv_batches(data_path, columns):
+        if parquet_path is not None:
+            if writer is None:
+                writer = pq.ParquetWriter(get_tmp_path(parquet_path), batch.schema)
+            writer.write_batch(batch)
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        if pending_rows >= chunk_rows:
+            yield pa.Table.from_batches(pending).to_pandas()
+            pending, pending_rows = [], 0
+    if pending:
+        yield pa.Table.from_batches(pending).to_pandas()
+    if writer is not None:
+        writer.close()
+        finish_parquet_copy(data_path, parquet_path, get_tmp_path(parquet_path))
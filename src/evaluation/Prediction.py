@@ -8,10 +8,14 @@ from sklearn.metrics import (
 
 def predict_on_dataset(model, X_test, threshold):
     y_probs = model.predict_proba(X_test)[:, 1]
-    y_preds = (y_probs >= threshold).astype(int)
+    y_preds = apply_threshold(y_probs, threshold)
     return y_preds, y_probs
 
 
+def apply_threshold(y_probs, threshold):
+    return (y_probs >= threshold).astype(int)
+
+
 def evaluate_model_performance(y_test, y_preds):
     weights = np.where(
         y_test == 1, 0.5 / (y_test == 1).sum(), 0.5 / (y_test == 0).sum()
@@ -20,3 +24,24 @@ def evaluate_model_performance(y_test, y_preds):
     recall = recall_score(y_test, y_preds)
     f1 = f1_score(y_test, y_preds, sample_weight=weights)
     return precision, recall, f1
+
+
+def get_calibration(y_true, y_probs, num_bins=10):
+    """
+    Reliability curve - mean predicted probability vs observed presence rate in equal-width
+    probability bins (empty bins left out) - and the Brier score
+    """
+    y_true = np.asarray(y_true, dtype=float)
+    y_probs = np.asarray(y_probs, dtype=float)
+    bins = np.clip((y_probs * num_bins).astype(int), 0, num_bins - 1)
+    counts = np.bincount(bins, minlength=num_bins)
+    non_empty = counts > 0
+    mean_probs = np.bincount(bins, weights=y_probs, minlength=num_bins)[non_empty]
+    presence_rates = np.bincount(bins, weights=y_true, minlength=num_bins)[non_empty]
+    return {
+        "brier_score": round(float(np.mean((y_probs - y_true) ** 2)), 4),
+        "bin_lower": [round(i / num_bins, 4) for i in np.flatnonzero(non_empty)],
+        "mean_prob": np.round(mean_probs / counts[non_empty], 4).tolist(),
+        "presence_rate": np.round(presence_rates / counts[non_empty], 4).tolist(),
+        "count": counts[non_empty].tolist(),
+    }
@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+PREDICTIONS_FILE = "predictions.parquet"
+FINAL_MODEL_FOLD = -1
+
+
+class PredictionStore:
+    """
+    Predicted probabilities of every model an experiment trains, kept so thresholds, metrics and
+    calibration are computed from them rather than by asking the model again:
+    - model "cv": each fold's validation and out-of-fold (split "test") predictions
+    - model "final": the final model's validation and test predictions (fold -1)
+    Rows are index labels of the preprocessed dataset, so predictions can be joined back to it.
+    """
+
+    def __init__(self, predictions=None):
+        self.parts = [] if predictions is None else [predictions]
+
+    def add(self, model, split, rows, y_true, y_probs, fold=FINAL_MODEL_FOLD):
+        self.parts.append(
+            pd.DataFrame(
+                {
+                    "model": model,
+                    "fold": np.int8(fold),
+                    "split": split,
+                    "row": np.asarray(rows, dtype=np.int64),
+                    "label": np.asarray(y_true, dtype=np.int8),
+                    "prob": np.asarray(y_probs, dtype=np.float32),
+                }
+            )
+        )
+
+    def to_frame(self):
+        predictions = pd.concat(self.parts, ignore_index=True)
+        self.parts = [predictions]
+        return predictions
+
+    def get(self, model, split, fold=None):
+        """Predictions for one model and split (and optionally one fold), in the order added"""
+        predictions = self.to_frame()
+        mask = (predictions["model"] == model) & (predictions["split"] == split)
+        if fold is not None:
+            mask &= predictions["fold"] == fold
+        return predictions[mask]
+
+    def save(self, save_path):
+        """Compact Parquet: categorical model/split, int8 fold and label, float32 probabilities"""
+        predictions = self.to_frame().astype({"model": "category", "split": "category"})
+        predictions_file_path = os.path.join(save_path, PREDICTIONS_FILE)
+        predictions.to_parquet(predictions_file_path, index=False, compression="zstd")
+        print(f"Saved {len(predictions)} predictions to: {predictions_file_path}")
+
+    @classmethod
+    def load(cls, save_path):
+        predictions = pd.read_parquet(os.path.join(save_path, PREDICTIONS_FILE))
+        return cls(predictions.astype({"model": str, "split": str}))
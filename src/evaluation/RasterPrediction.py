@@ -0,0 +1,116 @@
+from concurrent.futures import ThreadPoolExecutor
+import math
+
+import numpy as np
+import xarray as xr
+
+from preprocessing.DistanceToShore import DistanceToShore
+from preprocessing.EnvironmentData import gather_environment_features
+from preprocessing.FeatureCube import get_feature_cube
+from training.Parallel import split_thread_budget
+from ConfigHandler import config
+
+
+def estimate_bytes_per_cell():
+    """Feature row, coordinates, grid indices and probability for one predicted cell"""
+    return 8 * (len(config.PREPROCESSING.ENVIRONMENT_DATA) + 8)
+
+
+def get_tile_size():
+    """PREDICTION.TILE_SIZE, shrunk if a single tile would not fit in PREDICTION.MAX_MEMORY_MB"""
+    max_cells = config.PREDICTION.MAX_MEMORY_MB * 1024**2 // estimate_bytes_per_cell()
+    return max(1, min(config.PREDICTION.TILE_SIZE, math.isqrt(max_cells)))
+
+
+def get_max_tile_workers(tile_size):
+    """Tiles in flight at once, so their working memory stays under PREDICTION.MAX_MEMORY_MB"""
+    tile_bytes = tile_size**2 * estimate_bytes_per_cell()
+    max_workers = max(1, config.PREDICTION.MAX_MEMORY_MB * 1024**2 // tile_bytes)
+    if config.PREDICTION.MAX_WORKERS:
+        max_workers = min(max_workers, config.PREDICTION.MAX_WORKERS)
+    return max_workers
+
+
+def get_tiles(shape, tile_size):
+    return [
+        (slice(row, row + tile_size), slice(col, col + tile_size))
+        for row in range(0, shape[0], tile_size)
+        for col in range(0, shape[1], tile_size)
+    ]
+
+
+def predict_tile(model, mask, lats, lons, tile, cube, distance_to_shore, pred_raster):
+    """Predict the accessible cells of one tile straight into its part of `pred_raster`"""
+    rows, cols = tile
+    cell_rows, cell_cols = np.nonzero(mask[rows, cols])
+    if len(cell_rows) == 0:
+        return 0
+    X = gather_environment_features(
+        cube, lats[rows][cell_rows], lons[cols][cell_cols], distance_to_shore
+    )
+    if config.PREPROCESSING.DROP_NA_ENVIRONMENTAL:
+        keep = ~np.isnan(X).any(axis=1)
+        X, cell_rows, cell_cols = X[keep], cell_rows[keep], cell_cols[keep]
+        if len(X) == 0:
+            return 0
+    pred_raster[rows, cols][cell_rows, cell_cols] = model.predict_proba(X)[:, 1]
+    return len(X)
+
+
+def predict_over_raster(model, accessible_area, distance_to_shore=None):
+    """
+    Habitat suitability (positive class probability) for every accessible cell, as a raster on
+    the accessible area's grid - NaN outside it.
+    The grid is processed in tiles on a thread pool: features are gathered for all accessible
+    cells of a tile at once and predicted in one call, so memory is bounded by tile size and
+    number of workers rather than by the size of the accessible area.
+    """
+    print("Predicting over accessible area...")
+    mask = accessible_area.values == 1
+    lats = accessible_area["latitude"].values
+    lons = accessible_area["longitude"].values
+    cube = get_feature_cube(lons.min(), lons.max(), lats.min(), lats.max())
+    if distance_to_shore is None:
+        distance_to_shore = DistanceToShore.from_accessible_area(accessible_area)
+    if "distance_to_shore_m" in config.PREPROCESSING.ENVIRONMENT_DATA:
+        # Load the coastline index up front rather than racing to do it in every worker
+        distance_to_shore.load()
+
+    tile_size = get_tile_size()
+    tiles = get_tiles(mask.shape, tile_size)
+    num_workers, threads_per_worker = split_thread_budget(
+        len(tiles), get_max_tile_workers(tile_size)
+    )
+    pred_raster = np.full(mask.shape, np.nan, dtype=float)
+
+    original_n_jobs = model.get_params()["n_jobs"]
+    model.set_params(n_jobs=threads_per_worker)
+    try:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            num_predicted = sum(
+                executor.map(
+                    lambda tile: predict_tile(
+                        model,
+                        mask,
+                        lats,
+                        lons,
+                        tile,
+                        cube,
+                        distance_to_shore,
+                        pred_raster,
+                    ),
+                    tiles,
+                )
+            )
+    finally:
+        model.set_params(n_jobs=original_n_jobs)
+    print(
+        f"Predicted {num_predicted} cells in {len(tiles)} tiles of {tile_size}x{tile_size} "
+        f"using {num_workers} workers"
+    )
+    return xr.DataArray(
+        pred_raster,
+        coords={"latitude": lats, "longitude": lons},
+        dims=("latitude", "longitude"),
+        name="prediction_prob",
+    )
@@ -2,12 +2,11 @@ import os
 
 import geopandas as gpd
 from matplotlib import pyplot as plt
-import numpy as np
 import pandas as pd
 from sklearn.inspection import PartialDependenceDisplay
 
-from evaluation.Prediction import predict_on_dataset
-from preprocessing.EnvironmentData import load_all_environment_variables
+from evaluation.RasterPrediction import predict_over_raster
+from preprocessing.DistanceToShore import DistanceToShore
 from training.Training import prepare_data_for_modelling
 from ConfigHandler import config
 
@@ -101,33 +100,15 @@ def get_partial_dependence(model, dataset, save_path):
 
 
 def predict_over_accessible_area(model, dataset, accessible_area, save_path):
-    accessible_df = accessible_area.to_dataframe().reset_index()
-
-    lat_min = accessible_df["latitude"].min()
-    lat_max = accessible_df["latitude"].max()
-    lon_min = accessible_df["longitude"].min()
-    lon_max = accessible_df["longitude"].max()
-    accessible_df = accessible_df[accessible_df["M_accessible"] == 1].reset_index(
-        drop=True
+    pred_raster = predict_over_raster(
+        model, accessible_area, DistanceToShore.from_accessible_area(accessible_area)
     )
-    accessible_gdf = gpd.GeoDataFrame(
-        accessible_df,
-        geometry=gpd.points_from_xy(accessible_df.longitude, accessible_df.latitude),
-        crs="EPSG:4326",
-    )
-    accessible_gdf = load_all_environment_variables(accessible_gdf)
-    X, _ = prepare_data_for_modelling(accessible_gdf)
-    y_preds, y_probs = predict_on_dataset(model, X, config.PREDICTION.THRESHOLD)
-    accessible_gdf["prediction"] = y_preds
-    accessible_gdf["prediction_prob"] = y_probs
-
-    accessible_gdf = accessible_gdf.to_crs(epsg=4326)
 
     visualise_data_on_map(
-        lon_min,
-        lon_max,
-        lat_min,
-        lat_max,
+        accessible_area["longitude"].min().item(),
+        accessible_area["longitude"].max().item(),
+        accessible_area["latitude"].min().item(),
+        accessible_area["latitude"].max().item(),
         [dataset[dataset["label"] == 1], dataset[dataset["label"] == 0]],
         ["green", "red"],
         ["Presence", "Pseudo-absence"],
@@ -136,24 +117,14 @@ def predict_over_accessible_area(model, dataset, accessible_area, save_path):
         show_plot=False,
     )
 
-    # Convert to raster for colormesh
-    lats = np.unique(accessible_area["latitude"].values)
-    lons = np.unique(accessible_area["longitude"].values)
-    pred_raster = np.full((len(lats), len(lons)), np.nan, dtype=float)
-    lat_to_idx = {lat: i for i, lat in enumerate(lats)}
-    lon_to_idx = {lon: j for j, lon in enumerate(lons)}
-    for _, row in accessible_gdf.iterrows():
-        i = lat_to_idx.get(row["latitude"])
-        j = lon_to_idx.get(row["longitude"])
-        pred_raster[i, j] = row["prediction_prob"]
-
     plt.gca().pcolormesh(
-        lons,
-        lats,
-        pred_raster,
+        pred_raster["longitude"].values,
+        pred_raster["latitude"].values,
+        pred_raster.values,
         cmap="cividis",
         label="Predicted Suitability",
     )
     plt.legend()
     plt.savefig(os.path.join(save_path, "accessible_area_prediction.png"))
     plt.close()
+    return pred_raster
@@ -5,7 +5,9 @@ from ConfigHandler import config
 
 warnings.filterwarnings("ignore")
 
-run_experiment(
-    experiment_title="first_run",
-    experiment_description="Ensuring the pipeline can run.",
-)
+# Guarded so optimisation worker processes can import this module without rerunning it
+if __name__ == "__main__":
+    run_experiment(
+        experiment_title="first_run",
+        experiment_description="Ensuring the pipeline can run.",
+    )
@@ -0,0 +1,12 @@
+import warnings
+
+from BatchPipeline import run_batch_experiment
+from ConfigHandler import config
+
+warnings.filterwarnings("ignore")
+
+if __name__ == "__main__":
+    run_batch_experiment(
+        experiment_title="batch",
+        experiment_description="Species in BATCH against the shared background data.",
+    )
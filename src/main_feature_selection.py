@@ -0,0 +1,12 @@
+import warnings
+
+from FeatureSelectionPipeline import run_feature_selection
+from ConfigHandler import config
+
+warnings.filterwarnings("ignore")
+
+if __name__ == "__main__":
+    run_feature_selection(
+        experiment_title="feature_selection",
+        experiment_description="Environmental variable subset search with spatial CV.",
+    )
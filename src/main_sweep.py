@@ -0,0 +1,12 @@
+import warnings
+
+from SweepPipeline import run_sweep
+from ConfigHandler import config
+
+warnings.filterwarnings("ignore")
+
+if __name__ == "__main__":
+    run_sweep(
+        sweep_title="sweep",
+        sweep_description="Every combination of SWEEP.GRID for each of SWEEP.VARIANTS.",
+    )
@@ -0,0 +1,211 @@
+import itertools
+import math
+
+import numpy as np
+
+from training.FoldData import get_fold_data_key
+from training.Parallel import split_thread_budget
+from training.Training import create_spatial_folds, train_and_evaluate_fold
+
+from ConfigHandler import config
+
+
+class SubsetEvaluator:
+    """
+    Spatial CV of feature subsets on one in-memory feature matrix. The superset of variables is
+    extracted once (the dataset's columns); each subset is a column slice of it, and the fold IDs
+    only depend on the coordinates so every subset shares them.
+    """
+
+    def __init__(self, dataset, features):
+        self.features = list(features)
+        self.X = dataset[self.features].to_numpy(dtype=np.float32)
+        self.y = dataset["label"].values
+        _, self.fold_ids = create_spatial_folds(dataset)
+        self.num_folds = config.TRAINING.NUM_FOLDS
+        self.fold_order = list(range(self.num_folds))
+        self.evaluations = {}
+
+    def get_subset_key(self, subset):
+        """Subsets in superset column order, so the same subset is never evaluated twice"""
+        subset = set(subset)
+        return tuple(feature for feature in self.features if feature in subset)
+
+    def evaluate(self, subset, bar=None):
+        """
+        Mean F1 (%) of the subset over the spatial folds, or None if it was pruned: folds run one
+        after another, and the subset is dropped as soon as it cannot reach `bar` even with a
+        perfect F1 on every remaining fold (or, with FEATURE_SELECTION.PRUNE_MARGIN, as soon as its
+        running mean is more than that margin below `bar`).
+        """
+        subset = self.get_subset_key(subset)
+        if subset in self.evaluations:
+            return self.evaluations[subset]["mean_f1"]
+
+        columns = [self.features.index(feature) for feature in subset]
+        X = np.ascontiguousarray(self.X[:, columns])
+        data_key = get_fold_data_key(X, self.y, self.fold_ids)
+        _, threads = split_thread_budget(1)
+        margin = config.FEATURE_SELECTION.PRUNE_MARGIN
+
+        f1_scores = {}
+        pruned = False
+        for i in self.fold_order:
+            _, _, f1, *_ = train_and_evaluate_fold(
+                X, self.y, self.fold_ids, i, threads, data_key=data_key
+            )
+            f1_scores[i] = 100 * f1
+            num_remaining = self.num_folds - len(f1_scores)
+            if bar is None or not num_remaining:
+                continue
+            upper_bound = (sum(f1_scores.values()) + 100 * num_remaining) / self.num_folds
+            running_mean = np.mean(list(f1_scores.values()))
+            if upper_bound < bar or (margin is not None and running_mean < bar - margin):
+                pruned = True
+                break
+
+        mean_f1 = None if pruned else round(float(np.mean(list(f1_scores.values()))), 2)
+        self.evaluations[subset] = {
+            "features": list(subset),
+            "mean_f1": mean_f1,
+            "std_f1": None if pruned else round(float(np.std(list(f1_scores.values()))), 2),
+            "f1": {fold: round(f1, 2) for fold, f1 in sorted(f1_scores.items())},
+            "num_folds_run": len(f1_scores),
+            "pruned": pruned,
+        }
+        status = "pruned" if pruned else f"mean F1 {mean_f1}"
+        print(f"Feature subset {list(subset)}: {status} ({len(f1_scores)} folds)")
+        return mean_f1
+
+    def set_best(self, subset):
+        """Run the best subset's weakest folds first - other subsets are then pruned sooner"""
+        f1_scores = self.evaluations[self.get_subset_key(subset)]["f1"]
+        self.fold_order = sorted(f1_scores, key=f1_scores.get)
+
+
+def get_bar(*scores):
+    """The score a subset has to reach to be worth finishing - None if there is nothing to beat"""
+    scores = [score for score in scores if score is not None]
+    return max(scores) if scores else None
+
+
+def is_better(score, best_score):
+    return score is not None and (best_score is None or score > best_score)
+
+
+def search_exhaustive(evaluator, candidates, always_include):
+    """Every subset within the size limits, smallest first (so ties go to fewer features)"""
+    min_size = max(config.FEATURE_SELECTION.MIN_FEATURES - len(always_include), 0)
+    max_size = config.FEATURE_SELECTION.MAX_FEATURES
+    max_size = len(candidates) if max_size is None else max_size - len(always_include)
+    max_size = min(max_size, len(candidates))
+    num_subsets = sum(math.comb(len(candidates), size) for size in range(min_size, max_size + 1))
+    if num_subsets > config.FEATURE_SELECTION.MAX_EXHAUSTIVE_SUBSETS:
+        raise ValueError(
+            f"Exhaustive feature selection would evaluate {num_subsets} subsets "
+            f"(FEATURE_SELECTION.MAX_EXHAUSTIVE_SUBSETS is "
+            f"{config.FEATURE_SELECTION.MAX_EXHAUSTIVE_SUBSETS}) - use forward or backward mode"
+        )
+
+    best_subset, best_score = None, None
+    for size in range(min_size, max_size + 1):
+        for combination in itertools.combinations(candidates, size):
+            subset = always_include + list(combination)
+            if not subset:
+                continue
+            score = evaluator.evaluate(subset, bar=best_score)
+            if is_better(score, best_score):
+                best_subset, best_score = subset, score
+                evaluator.set_best(best_subset)
+    return best_subset, best_score
+
+
+def search_stepwise(evaluator, candidates, always_include, forward):
+    """
+    Forward selection adds, and backward elimination removes, one feature per step - the one
+    giving the best mean F1. Forward stops once no addition gains FEATURE_SELECTION.MIN_GAIN;
+    backward stops once every removal loses more than MIN_GAIN.
+    """
+    min_gain = config.FEATURE_SELECTION.MIN_GAIN
+    min_features = max(config.FEATURE_SELECTION.MIN_FEATURES, len(always_include), 1)
+    max_features = config.FEATURE_SELECTION.MAX_FEATURES or len(always_include) + len(candidates)
+
+    if forward:
+        subset = list(always_include)
+        best_score = evaluator.evaluate(subset) if subset else None
+    else:
+        subset = always_include + list(candidates)
+        best_score = evaluator.evaluate(subset)
+    if best_score is not None:
+        evaluator.set_best(subset)
+
+    while True:
+        if forward:
+            if len(subset) >= max_features:
+                break
+            steps = [subset + [feature] for feature in candidates if feature not in subset]
+            target = None if best_score is None else best_score + min_gain
+        else:
+            if len(subset) <= min_features:
+                break
+            steps = [
+                [other for other in subset if other != feature]
+                for feature in subset
+                if feature not in always_include
+            ]
+            target = best_score - min_gain
+        # Until MIN_FEATURES is reached every forward step is taken, improving or not
+        if forward and len(subset) < min_features:
+            target = None
+
+        step_subset, step_score = None, None
+        for candidate in steps:
+            score = evaluator.evaluate(candidate, bar=get_bar(target, step_score))
+            if is_better(score, step_score):
+                step_subset, step_score = candidate, score
+        if step_subset is None or (target is not None and step_score < target):
+            break
+        subset, best_score = step_subset, step_score
+        evaluator.set_best(subset)
+    return subset, best_score
+
+
+def select_features(dataset, features=None):
+    """
+    Feature subset search (FEATURE_SELECTION.MODE: "exhaustive", "forward" or "backward") over
+    `features` (default ENVIRONMENT_DATA), scored by the mean F1 of the usual spatial CV.
+    Every feature in FEATURE_SELECTION.ALWAYS_INCLUDE is part of every subset.
+    """
+    features = list(features or config.PREPROCESSING.ENVIRONMENT_DATA)
+    always_include = [f for f in features if f in config.FEATURE_SELECTION.ALWAYS_INCLUDE]
+    missing = set(config.FEATURE_SELECTION.ALWAYS_INCLUDE) - set(features)
+    if missing:
+        raise ValueError(f"FEATURE_SELECTION.ALWAYS_INCLUDE not among the features: {missing}")
+    candidates = [feature for feature in features if feature not in always_include]
+
+    mode = config.FEATURE_SELECTION.MODE
+    print(f"Running {mode} feature selection over {len(features)} features...")
+    evaluator = SubsetEvaluator(dataset, features)
+    if mode == "exhaustive":
+        best_subset, best_score = search_exhaustive(evaluator, candidates, always_include)
+    elif mode in ("forward", "backward"):
+        best_subset, best_score = search_stepwise(
+            evaluator, candidates, always_include, forward=mode == "forward"
+        )
+    else:
+        raise ValueError(f"Unknown FEATURE_SELECTION.MODE: {mode}")
+
+    evaluations = list(evaluator.evaluations.values())
+    print(
+        f"Best features ({best_score} mean F1): {best_subset} - "
+        f"{len(evaluations)} subsets evaluated, {sum(e['pruned'] for e in evaluations)} pruned"
+    )
+    return {
+        "mode": mode,
+        "features": features,
+        "best_features": list(evaluator.get_subset_key(best_subset)),
+        "best_mean_f1": best_score,
+        "num_evaluated": len(evaluations),
+        "num_pruned": sum(e["pruned"] for e in evaluations),
+        "evaluations": evaluations,
+    }
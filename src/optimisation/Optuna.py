@@ -1,9 +1,21 @@
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+
 import optuna
+from optuna.trial import TrialState
 
 from CrossValidationPipeline import run_cross_validation_pipeline
+from optimisation.Pruning import create_pruner
+from optimisation.WarmStart import is_warm_start_trial, warm_start_study
+from PreprocessPipeline import get_preprocessing_config
+from training.Parallel import split_thread_budget
 
 from ConfigHandler import config
 
+FINISHED_STATES = (TrialState.COMPLETE, TrialState.PRUNED)
+
 
 def update_config(params: dict) -> None:
     """Update config params for new optuna experiment"""
@@ -24,63 +36,45 @@ def update_config(params: dict) -> None:
         config.MODEL.REG_ALPHA = params["REG_ALPHA"]
 
 
-def objective(trial, dataset):
-    """Objective function for optuna optimisation"""
-    param_config = config.OPTIMISATION.PARAMS
+INT_PARAMS = ("N_ESTIMATORS", "MAX_DEPTH")
+
+
+def get_search_distributions() -> dict:
+    """Search space from config.OPTIMISATION.PARAMS, in config order"""
+    distributions = {}
+    for name, param_config in config.OPTIMISATION.PARAMS.items():
+        if not param_config.USE:
+            continue
+        if name in INT_PARAMS:
+            distributions[name] = optuna.distributions.IntDistribution(
+                param_config.MIN, param_config.MAX, step=param_config.STEP
+            )
+        else:
+            distributions[name] = optuna.distributions.FloatDistribution(
+                param_config.MIN, param_config.MAX, step=param_config.STEP
+            )
+    return distributions
+
+
+def suggest_params(trial) -> dict:
+    """Hyperparameters for this trial - passed to training directly rather than via config"""
     params = {}
-    if param_config.N_ESTIMATORS.USE:
-        params["N_ESTIMATORS"] = trial.suggest_int(
-            "N_ESTIMATORS",
-            param_config.N_ESTIMATORS.MIN,
-            param_config.N_ESTIMATORS.MAX,
-            step=param_config.N_ESTIMATORS.STEP,
-        )
-    if param_config.MAX_DEPTH.USE:
-        params["MAX_DEPTH"] = trial.suggest_int(
-            "MAX_DEPTH",
-            param_config.MAX_DEPTH.MIN,
-            param_config.MAX_DEPTH.MAX,
-            step=param_config.MAX_DEPTH.STEP,
-        )
-    if param_config.LEARNING_RATE.USE:
-        params["LEARNING_RATE"] = trial.suggest_float(
-            "LEARNING_RATE",
-            param_config.LEARNING_RATE.MIN,
-            param_config.LEARNING_RATE.MAX,
-            step=param_config.LEARNING_RATE.STEP,
-        )
-    if param_config.SUBSAMPLE.USE:
-        params["SUBSAMPLE"] = trial.suggest_float(
-            "SUBSAMPLE",
-            param_config.SUBSAMPLE.MIN,
-            param_config.SUBSAMPLE.MAX,
-            step=param_config.SUBSAMPLE.STEP,
-        )
-    if param_config.COLSAMPLE_BYTREE.USE:
-        params["COLSAMPLE_BYTREE"] = trial.suggest_float(
-            "COLSAMPLE_BYTREE",
-            param_config.COLSAMPLE_BYTREE.MIN,
-            param_config.COLSAMPLE_BYTREE.MAX,
-            step=param_config.COLSAMPLE_BYTREE.STEP,
-        )
-    if param_config.REG_LAMBDA.USE:
-        params["REG_LAMBDA"] = trial.suggest_float(
-            "REG_LAMBDA",
-            param_config.REG_LAMBDA.MIN,
-            param_config.REG_LAMBDA.MAX,
-            step=param_config.REG_LAMBDA.STEP,
-        )
-    if param_config.REG_ALPHA.USE:
-        params["REG_ALPHA"] = trial.suggest_float(
-            "REG_ALPHA",
-            param_config.REG_ALPHA.MIN,
-            param_config.REG_ALPHA.MAX,
-            step=param_config.REG_ALPHA.STEP,
-        )
+    for name, distribution in get_search_distributions().items():
+        if isinstance(distribution, optuna.distributions.IntDistribution):
+            params[name] = trial.suggest_int(
+                name, distribution.low, distribution.high, step=distribution.step
+            )
+        else:
+            params[name] = trial.suggest_float(
+                name, distribution.low, distribution.high, step=distribution.step
+            )
+    return params
 
-    update_config(params)
 
-    metrics = run_cross_validation_pipeline(dataset)
+def objective(trial, dataset):
+    """Objective function for optuna optimisation"""
+    params = suggest_params(trial)
+    metrics = run_cross_validation_pipeline(dataset, model_params=params, trial=trial)
     print(metrics)
 
     objective = -1.0 * metrics["cv"]["mean_f1"]
@@ -89,29 +83,220 @@ def objective(trial, dataset):
     return objective
 
 
-def optimise_hyperparameters_via_optuna(dataset):
+def get_study_name(data_key=None):
+    """Defaults to the experiment title plus a fingerprint of the settings and data"""
+    if config.OPTIMISATION.STORAGE.STUDY_NAME:
+        return config.OPTIMISATION.STORAGE.STUDY_NAME
+    title = config.get("EXPERIMENT_TITLE") or "optuna_study"
+    return f"{title}_{get_search_fingerprint(data_key)[:8]}"
+
+
+def get_storage(study_name):
+    """
+    Persistent study storage shared by every worker (and host, if FOLDER is on a shared filesystem).
+    Returns None for an in-memory study.
+    """
+    storage_config = config.OPTIMISATION.STORAGE
+    if not storage_config.BACKEND:
+        return None
+    os.makedirs(storage_config.FOLDER, exist_ok=True)
+    path = os.path.abspath(os.path.join(storage_config.FOLDER, study_name))
+    if storage_config.BACKEND == "sqlite":
+        return f"sqlite:///{path}.db"
+    if storage_config.BACKEND == "journal":
+        return optuna.storages.JournalStorage(
+            optuna.storages.journal.JournalFileBackend(f"{path}.log")
+        )
+    raise ValueError(f"Unknown optuna storage backend: {storage_config.BACKEND}")
+
+
+def get_search_fingerprint(data_key=None):
+    """
+    Settings and data (the split's stage cache key) a stored study's trials depend on - resuming
+    with different ones would mix results
+    """
+    relevant = {
+        "DATA_KEY": data_key,
+        "PARAMS": config.OPTIMISATION.PARAMS,
+        "DATA": config.DATA,
+        "PREPROCESSING": get_preprocessing_config(),
+        "DATA_SPLIT": config.DATA_SPLIT,
+        "TRAINING": {
+            key: config.TRAINING[key]
+            for key in ["SCALE_POS_WEIGHT", "NUM_FOLDS", "MIN_DISTANCE_BETWEEN_FOLDS_M", "VAL_PROP"]
+        },
+        "EARLY_STOPPING_ROUNDS": config.MODEL.EARLY_STOPPING_ROUNDS,
+    }
+    return hashlib.sha1(json.dumps(relevant, sort_keys=True).encode()).hexdigest()
+
+
+def load_study(study_name, data_key=None):
     if config.OPTIMISATION.USE_RANDOM_SAMPLER:
-        study = optuna.create_study(sampler=optuna.samplers.RandomSampler())
+        sampler = optuna.samplers.RandomSampler()
     else:
-        study = optuna.create_study()
-    if not config.OPTIMISATION.USE_OPTUNA:
-        return study
-
-    study.enqueue_trial(
-        {
-            "N_ESTIMATORS": 2000,
-            "MAX_DEPTH": 5,
-            "LEARNING_RATE": 0.03,
-            "SUBSAMPLE": 0.8,
-            "COLSAMPLE_BYTREE": 0.8,
-            "REG_LAMBDA": 1.0,
-            "REG_ALPHA": 0.0,
-        }
+        sampler = None
+    study = optuna.create_study(
+        study_name=study_name,
+        storage=get_storage(study_name),
+        sampler=sampler,
+        pruner=create_pruner(),
+        load_if_exists=True,
+    )
+    fingerprint = get_search_fingerprint(data_key)
+    stored_fingerprint = study.user_attrs.get("search_fingerprint")
+    if stored_fingerprint is None:
+        study.set_user_attr("search_fingerprint", fingerprint)
+    elif stored_fingerprint != fingerprint:
+        raise ValueError(
+            f"Stored optuna study '{study.study_name}' was run with different settings - "
+            "set OPTIMISATION.STORAGE.STUDY_NAME to start a new one"
+        )
+    return study
+
+
+def count_finished_trials(study):
+    """Trials run by this study - warm start history doesn't count towards N_TRIALS"""
+    return sum(
+        not is_warm_start_trial(trial)
+        for trial in study.get_trials(deepcopy=False, states=FINISHED_STATES)
+    )
+
+
+def get_best_trial(study):
+    """Best trial evaluated on the current data, i.e. ignoring warm start history"""
+    trials = [
+        trial
+        for trial in study.get_trials(deepcopy=False, states=(TrialState.COMPLETE,))
+        if not is_warm_start_trial(trial)
+    ]
+    return min(trials, key=lambda trial: trial.value)
+
+
+def stop_when_enough_trials(study, trial):
+    if count_finished_trials(study) >= config.OPTIMISATION.N_TRIALS:
+        study.stop()
+
+
+def count_boosting_rounds(study):
+    return sum(
+        trial.user_attrs.get("boosting_rounds", 0)
+        for trial in study.get_trials(deepcopy=False)
     )
 
+
+def is_budget_spent(study):
+    max_rounds = config.OPTIMISATION.BUDGET.MAX_BOOSTING_ROUNDS
+    return bool(max_rounds) and count_boosting_rounds(study) >= max_rounds
+
+
+def stop_when_budget_spent(study, trial):
+    if is_budget_spent(study):
+        print(f"Optuna boosting round budget spent after trial {trial.number}")
+        study.stop()
+
+
+def optimise_study(study, dataset):
+    """
+    Run trials until the study (across all workers) has N_TRIALS finished trials, or until the
+    BUDGET (wall-clock seconds per run, total boosting rounds across the study) is spent.
+    """
+    if is_budget_spent(study):
+        return
     study.optimize(
         lambda trial: objective(trial, dataset),
         n_trials=config.OPTIMISATION.N_TRIALS,
+        timeout=config.OPTIMISATION.BUDGET.TIMEOUT_S,
+        callbacks=[
+            stop_when_enough_trials,
+            stop_when_budget_spent,
+        ],
     )
-    update_config(study.best_trial.params)
+
+
+def is_study_done(study_name):
+    """Whether a stored study already has N_TRIALS finished trials (or has spent its budget)"""
+    storage = get_storage(study_name)
+    if storage is None:
+        return False
+    try:
+        study = optuna.load_study(study_name=study_name, storage=storage)
+    except KeyError:
+        return False
+    return count_finished_trials(study) >= config.OPTIMISATION.N_TRIALS or is_budget_spent(study)
+
+
+def resolve_study_name(data_key=None):
+    """
+    An interrupted study is resumed, but a finished one is only reused when named explicitly in
+    OPTIMISATION.STORAGE.STUDY_NAME - otherwise the next free _2, _3, ... name starts a new study
+    """
+    study_name = get_study_name(data_key)
+    if config.OPTIMISATION.STORAGE.STUDY_NAME:
+        return study_name
+    suffix = 1
+    name = study_name
+    while is_study_done(name):
+        suffix += 1
+        name = f"{study_name}_{suffix}"
+    return name
+
+
+def run_optimisation_worker(dataset, study_name, data_key, config_snapshot, threads_per_worker):
+    """Entry point for worker processes - they rebuild the config rather than share it"""
+    config.merge_update(config_snapshot)
+    config.TRAINING.MAX_THREADS = threads_per_worker
+    optimise_study(load_study(study_name, data_key), dataset)
+
+
+def optimise_hyperparameters_via_optuna(dataset, data_key=None):
+    """`data_key` identifies the data (e.g. the split's stage cache key) the trials are run on"""
+    if not config.OPTIMISATION.USE_OPTUNA:
+        return optuna.create_study()
+    study_name = resolve_study_name(data_key)
+    study = load_study(study_name, data_key)
+
+    num_finished = count_finished_trials(study)
+    if num_finished:
+        print(f"Resuming optuna study '{study.study_name}' from {num_finished} finished trials")
+    else:
+        if config.OPTIMISATION.WARM_START.USE:
+            warm_start_study(study, get_search_distributions(), get_storage)
+        study.enqueue_trial(
+            {
+                "N_ESTIMATORS": 2000,
+                "MAX_DEPTH": 5,
+                "LEARNING_RATE": 0.03,
+                "SUBSAMPLE": 0.8,
+                "COLSAMPLE_BYTREE": 0.8,
+                "REG_LAMBDA": 1.0,
+                "REG_ALPHA": 0.0,
+            },
+            skip_if_exists=True,
+        )
+
+    if num_finished < config.OPTIMISATION.N_TRIALS:
+        num_workers = config.OPTIMISATION.N_WORKERS
+        if num_workers > 1 and not config.OPTIMISATION.STORAGE.BACKEND:
+            raise ValueError("OPTIMISATION.N_WORKERS > 1 needs OPTIMISATION.STORAGE.BACKEND")
+        if num_workers > 1:
+            num_workers, threads_per_worker = split_thread_budget(num_workers)
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                futures = [
+                    executor.submit(
+                        run_optimisation_worker,
+                        dataset,
+                        study_name,
+                        data_key,
+                        config.to_dict(),
+                        threads_per_worker,
+                    )
+                    for _ in range(num_workers)
+                ]
+                for future in futures:
+                    future.result()
+            study = load_study(study_name, data_key)
+        else:
+            optimise_study(study, dataset)
+
+    update_config(get_best_trial(study).params)
     return study
@@ -0,0 +1,101 @@
+import threading
+
+import numpy as np
+import optuna
+import xgboost as xgb
+
+from ConfigHandler import config
+
+# Folds of one trial may train concurrently and each adds its rounds
+BOOSTING_ROUNDS_LOCK = threading.Lock()
+
+
+def is_pruning_enabled(trial):
+    return trial is not None and bool(config.OPTIMISATION.PRUNING.PRUNER)
+
+
+def get_max_boosting_rounds():
+    if config.OPTIMISATION.PARAMS.N_ESTIMATORS.USE:
+        return config.OPTIMISATION.PARAMS.N_ESTIMATORS.MAX
+    return config.MODEL.N_ESTIMATORS
+
+
+def is_fold_by_fold(trial):
+    """
+    Whether a trial's folds must train one after another: for per-fold reports, and for boosting
+    reports to pruners that read the step as resource used (successive halving, hyperband) - from
+    concurrent folds that step would be whichever fold is furthest ahead
+    """
+    pruning_config = config.OPTIMISATION.PRUNING
+    return is_pruning_enabled(trial) and (
+        pruning_config.REPORT == "fold" or pruning_config.PRUNER != "median"
+    )
+
+
+def get_boosting_step_offset(trial, fold):
+    """
+    Median pruning compares trials at the same step, so steps are unique per (fold, boosting round).
+    Otherwise the step is the trial's boosting rounds so far - its resource used.
+    """
+    if config.OPTIMISATION.PRUNING.PRUNER == "median":
+        return fold * get_max_boosting_rounds()
+    return trial.user_attrs.get("boosting_rounds", 0)
+
+
+def create_pruner():
+    """
+    Pruners from config.OPTIMISATION.PRUNING. Intermediate values are reported either per fold
+    (REPORT "fold": running mean F1) or during boosting (REPORT "boosting": validation AUCPR every
+    BOOSTING_REPORT_INTERVAL rounds) - both negated, as the study minimises.
+    """
+    pruning_config = config.OPTIMISATION.PRUNING
+    if not pruning_config.PRUNER:
+        return optuna.pruners.NopPruner()
+    if pruning_config.PRUNER == "median":
+        return optuna.pruners.MedianPruner(
+            n_startup_trials=pruning_config.N_STARTUP_TRIALS,
+            n_warmup_steps=pruning_config.N_WARMUP_STEPS,
+        )
+    if pruning_config.PRUNER == "successive_halving":
+        return optuna.pruners.SuccessiveHalvingPruner()
+    if pruning_config.PRUNER == "hyperband":
+        if pruning_config.REPORT == "boosting":
+            max_resource = config.TRAINING.NUM_FOLDS * get_max_boosting_rounds()
+        else:
+            max_resource = config.TRAINING.NUM_FOLDS
+        return optuna.pruners.HyperbandPruner(min_resource=1, max_resource=max_resource)
+    raise ValueError(f"Unknown optuna pruner: {pruning_config.PRUNER}")
+
+
+def add_boosting_rounds(trial, num_rounds):
+    """Keep count of boosting rounds spent on a trial, for the MAX_BOOSTING_ROUNDS budget"""
+    with BOOSTING_ROUNDS_LOCK:
+        trial.set_user_attr(
+            "boosting_rounds", trial.user_attrs.get("boosting_rounds", 0) + num_rounds
+        )
+
+
+def report_fold(trial, fold, f1_scores):
+    """Report the running mean F1 after a fold - returns whether the trial should be pruned"""
+    trial.report(-100 * float(np.mean(f1_scores)), fold)
+    return trial.should_prune()
+
+
+class BoostingPruningCallback(xgb.callback.TrainingCallback):
+    """Report validation AUCPR while boosting and stop training as soon as the pruner says so"""
+
+    def __init__(self, trial, fold):
+        super().__init__()
+        self.trial = trial
+        self.step_offset = get_boosting_step_offset(trial, fold)
+        self.pruned = False
+
+    def after_iteration(self, model, epoch, evals_log):
+        if (epoch + 1) % config.OPTIMISATION.PRUNING.BOOSTING_REPORT_INTERVAL:
+            return False
+        aucpr = evals_log["validation_0"]["aucpr"][-1]
+        self.trial.report(-100 * float(aucpr), self.step_offset + epoch)
+        if self.trial.should_prune():
+            self.pruned = True
+            return True
+        return False
@@ -5,6 +5,10 @@ from sklearn.metrics import precision_recall_curve
 def find_optimal_threshold(model, X_val, y_val):
     """Use F1 Score weighted by class to find optimal threshold."""
     y_probs = model.predict_proba(X_val)[:, 1]
+    return find_optimal_threshold_from_probs(y_val, y_probs)
+
+
+def find_optimal_threshold_from_probs(y_val, y_probs):
     weights = np.where(y_val == 1, 0.5 / (y_val == 1).sum(), 0.5 / (y_val == 0).sum())
     precision, recall, thresholds = precision_recall_curve(
         y_val, y_probs, sample_weight=weights
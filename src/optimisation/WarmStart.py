@@ -0,0 +1,125 @@
+import glob
+import json
+import os
+
+import optuna
+from optuna.trial import TrialState
+
+from ConfigHandler import config
+
+WARM_START_ATTR = "warm_start_source"
+
+
+def is_warm_start_trial(trial):
+    return WARM_START_ATTR in trial.user_attrs
+
+
+def create_history_trial(params, value, distributions, source):
+    """
+    A finished trial carrying a previous run's result, for the sampler's history.
+    Returns None if the params don't fit the current search space.
+    """
+    if set(params) != set(distributions):
+        return None
+    try:
+        return optuna.trial.create_trial(
+            params=params,
+            distributions=distributions,
+            value=value,
+            user_attrs={WARM_START_ATTR: source},
+        )
+    except ValueError:
+        return None
+
+
+def load_trials_from_experiments(distributions):
+    """
+    Tuned hyperparameters and final CV scores from outputs/experiments/*/ runs that used the same
+    environmental features and optimised the same hyperparameters.
+    """
+    trials = []
+    pattern = os.path.join(config.OPTIMISATION.WARM_START.EXPERIMENTS_FOLDER, "*")
+    for experiment_path in sorted(glob.glob(pattern)):
+        config_path = os.path.join(experiment_path, "config.json")
+        results_path = os.path.join(experiment_path, "results.json")
+        if not (os.path.exists(config_path) and os.path.exists(results_path)):
+            continue
+        with open(config_path) as f:
+            experiment_config = json.load(f)
+        with open(results_path) as f:
+            results = json.load(f)
+        if "cv" not in results or "MODEL" not in experiment_config:
+            continue
+        experiment_features = experiment_config.get("PREPROCESSING", {}).get(
+            "ENVIRONMENT_DATA"
+        )
+        if experiment_features != list(config.PREPROCESSING.ENVIRONMENT_DATA):
+            continue
+        experiment_params = experiment_config.get("OPTIMISATION", {}).get("PARAMS", {})
+        if {name for name, param in experiment_params.items() if param.get("USE")} != set(
+            distributions
+        ):
+            continue
+        params = {name: experiment_config["MODEL"][name] for name in distributions}
+        # Objective is the negated CV mean F1 (in %), as in Optuna.objective
+        trial = create_history_trial(
+            params,
+            -1.0 * results["cv"]["mean_f1"],
+            distributions,
+            os.path.basename(experiment_path),
+        )
+        if trial is not None:
+            trials.append(trial)
+    return trials
+
+
+def load_trials_from_studies(distributions, get_storage):
+    """Finished trials from persisted optuna studies named in WARM_START.STUDY_NAMES"""
+    trials = []
+    for study_name in config.OPTIMISATION.WARM_START.STUDY_NAMES:
+        storage = get_storage(study_name)
+        if storage is None:
+            print(f"Warm start study '{study_name}' needs OPTIMISATION.STORAGE, skipping")
+            continue
+        try:
+            previous_study = optuna.load_study(study_name=study_name, storage=storage)
+        except KeyError:
+            print(f"Warm start study '{study_name}' not found, skipping")
+            continue
+        for previous_trial in previous_study.get_trials(
+            deepcopy=False, states=(TrialState.COMPLETE,)
+        ):
+            if is_warm_start_trial(previous_trial):
+                continue
+            trial = create_history_trial(
+                previous_trial.params, previous_trial.value, distributions, study_name
+            )
+            if trial is not None:
+                trials.append(trial)
+    return trials
+
+
+def warm_start_study(study, distributions, get_storage):
+    """
+    Seed a fresh study with compatible results from previous runs and enqueue the best of them,
+    so they are re-evaluated on the current data first.
+    """
+    if study.user_attrs.get("warm_started"):
+        return
+    trials = load_trials_from_experiments(distributions) + load_trials_from_studies(
+        distributions, get_storage
+    )
+    # Enqueue before adding the history, otherwise the history would count as already tried
+    enqueued = []
+    for trial in sorted(trials, key=lambda trial: trial.value):
+        if len(enqueued) == config.OPTIMISATION.WARM_START.NUM_ENQUEUED:
+            break
+        if trial.params not in enqueued:
+            study.enqueue_trial(trial.params)
+            enqueued.append(trial.params)
+    study.add_trials(trials)
+    study.set_user_attr("warm_started", True)
+    print(
+        f"Warm started optuna study with {len(trials)} previous trials, "
+        f"enqueued the best {len(enqueued)}"
+    )
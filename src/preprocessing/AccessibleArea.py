@@ -1,8 +1,8 @@
-import os
-
 import numpy as np
 import xarray as xr
 
+from preprocessing.EnvironmentData import get_nearest_grid_indices
+from preprocessing.FeatureCube import get_bathymetry_variable, get_feature_cube
 from ConfigHandler import config
 
 
@@ -15,21 +15,23 @@ def obtain_initial_bounding_box(presence_gdf):
     return min_lon, max_lon, min_lat, max_lat
 
 
+def remove_outside_bounding_box(df, min_lon, max_lon, min_lat, max_lat):
+    """Rows inside the bounding box, plus how many were outside"""
+    inside = (
+        (df["longitude"] >= min_lon)
+        & (df["longitude"] <= max_lon)
+        & (df["latitude"] >= min_lat)
+        & (df["latitude"] <= max_lat)
+    )
+    return df[inside].reset_index(drop=True), (~inside).sum()
+
+
 def filter_background_on_bounding_box(
     background_gdf, min_lon, max_lon, min_lat, max_lat
 ):
-    num_to_remove = (
-        (background_gdf["longitude"] < min_lon)
-        | (background_gdf["longitude"] > max_lon)
-        | (background_gdf["latitude"] < min_lat)
-        | (background_gdf["latitude"] > max_lat)
-    ).sum()
-    background_gdf = background_gdf[
-        (background_gdf["longitude"] >= min_lon)
-        & (background_gdf["longitude"] <= max_lon)
-        & (background_gdf["latitude"] >= min_lat)
-        & (background_gdf["latitude"] <= max_lat)
-    ].reset_index(drop=True)
+    background_gdf, num_to_remove = remove_outside_bounding_box(
+        background_gdf, min_lon, max_lon, min_lat, max_lat
+    )
     print(
         f"Filtered out {num_to_remove} rows based on bounding box, leaving {background_gdf.shape[0]} rows"
     )
@@ -46,14 +48,8 @@ def create_accessible_area(min_lon, max_lon, min_lat, max_lat):
     TODO: unsure if I can always assume a nan in bathymetry means land, need to check this with Bio-ORACLE docs
     """
     print("Creating accessible area...")
-    ds = xr.open_dataset(
-        os.path.join(
-            config.DATA.ENVIRONMENTAL.FOLDER,
-            config.DATA.ENVIRONMENTAL.BIO_ORACLE.FOLDER,
-            config.DATA.ENVIRONMENTAL.BIO_ORACLE.BATHYMETRY_FILE,
-        )
-    )
-    bathy = ds["bathymetry_mean"]
+    cube = get_feature_cube(min_lon, max_lon, min_lat, max_lat)
+    bathy = cube.layer(get_bathymetry_variable())
 
     # Limit to bounding box
     bathy = bathy.sel(
@@ -67,8 +63,8 @@ def create_accessible_area(min_lon, max_lon, min_lat, max_lat):
     padding = config.PREPROCESSING.ACCESSIBLE_AREA.PADDING
     region_mask = (lon2d < max_lon - padding - 4) | (lat2d > min_lat - padding + 15.5)
 
-    ocean_mask = np.isfinite(bathy.values)[0]
-    shelf_mask = (bathy.values >= -config.PREPROCESSING.ACCESSIBLE_AREA.MAX_DEPTH)[0]
+    ocean_mask = np.isfinite(bathy.values)
+    shelf_mask = bathy.values >= -config.PREPROCESSING.ACCESSIBLE_AREA.MAX_DEPTH
     accessible_area_mask = ocean_mask & shelf_mask & region_mask
 
     accessible_area = xr.DataArray(
@@ -83,7 +79,6 @@ def create_accessible_area(min_lon, max_lon, min_lat, max_lat):
 
 def filter_data_to_be_within_accessible_area(gdf, accessible_area):
     print("Filtering data to be within accessible area...")
-    gdf = gdf.to_crs(epsg=4326)
 
     # Basic fast bounding box filter
     min_lon = accessible_area["longitude"].min().item()
@@ -97,16 +92,12 @@ def filter_data_to_be_within_accessible_area(gdf, accessible_area):
         & (gdf["latitude"] <= max_lat)
     ].reset_index(drop=True)
 
-    # Now filter in more detail based on accessible area mask
-    gdf_filtered = gdf[
-        gdf.geometry.apply(
-            lambda point: accessible_area.sel(
-                longitude=point.x, latitude=point.y, method="nearest"
-            ).values
-            == 1
-        )
-    ].reset_index(drop=True)
-    gdf_removed = gdf[~gdf.index.isin(gdf_filtered.index)].reset_index(drop=True)
+    # Now filter in more detail based on accessible area mask - one gather for all points
+    lat_idx, lon_idx = get_nearest_grid_indices(
+        accessible_area, gdf["latitude"].values, gdf["longitude"].values
+    )
+    in_accessible_area = accessible_area.values[lat_idx, lon_idx] == 1
+    gdf_filtered = gdf[in_accessible_area].reset_index(drop=True)
     n_removed = gdf.shape[0] - gdf_filtered.shape[0]
     print(
         f"Filtered out {n_removed} rows based on accessible area, leaving {gdf_filtered.shape[0]} rows"
@@ -1,37 +1,64 @@
-import geopandas as gpd
 import numpy as np
 import pandas as pd
 from scipy.ndimage import gaussian_filter
-from tqdm import tqdm
 
+from preprocessing import General
+from preprocessing.EnvironmentData import get_nearest_grid_indices
 from ConfigHandler import config
 
 
 def filter_dataset_1_by_distance_to_dataset_2(gdf_1, gdf_2, threshold_m):
-    gdf_1 = gdf_1.to_crs(epsg=3857)
-    gdf_2 = gdf_2.to_crs(epsg=3857)
-    joined = gdf_1.sjoin_nearest(gdf_2[["geometry"]], how="left", distance_col="dist_m")
-    joined = joined.drop_duplicates("gbifID")
-    gdf_1 = gdf_1.loc[joined["dist_m"] >= threshold_m].copy()
-    gdf_1 = gdf_1.to_crs(epsg=4326).reset_index(drop=True)
-    gdf_2 = gdf_2.to_crs(epsg=4326).reset_index(drop=True)
-    return gdf_1
-
-
-def create_raw_raster(gdf, accessible_area):
-    raster = np.zeros_like(accessible_area, dtype=int)
+    return General.filter_dataset_1_by_distance_to_dataset_2(gdf_1, gdf_2, threshold_m)
+
+
+def find_nearest_coordinate_indices(coords, values):
+    """
+    Vectorised `np.abs(coords - value).argmin()` for sorted coords via binary search.
+    Ties go to the lower index, as argmin returns the first occurrence.
+    """
+    if len(coords) == 1:
+        return np.zeros(len(values), dtype=int)
+    ascending = coords[0] <= coords[-1]
+    sorted_coords = coords if ascending else coords[::-1]
+    right = np.clip(np.searchsorted(sorted_coords, values), 1, len(coords) - 1)
+    left = right - 1
+    left_dist = np.abs(sorted_coords[left] - values)
+    right_dist = np.abs(sorted_coords[right] - values)
+    if ascending:
+        return np.where(left_dist <= right_dist, left, right)
+    return len(coords) - 1 - np.where(left_dist < right_dist, left, right)
+
+
+def create_raw_raster(gdf, accessible_area, weights=None):
+    """
+    Count (or sum the weights of) background occurrences per accessible area cell.
+    `weights` can be a column name of gdf or an array, e.g. for effort-weighted bias surfaces.
+    """
+    print("Creating raw raster for background sampling...")
     lons = accessible_area["longitude"].values
     lats = accessible_area["latitude"].values
-    print("Creating raw raster for background sampling...")
-    for lon, lat in tqdm(zip(gdf["longitude"], gdf["latitude"])):
-        lon_idx = np.abs(lons - lon).argmin()
-        lat_idx = np.abs(lats - lat).argmin()
-        if (
-            accessible_area.sel(longitude=lon, latitude=lat, method="nearest").values
-            == 0
-        ):
-            continue
-        raster[lat_idx, lon_idx] += 1
+    point_lons = gdf["longitude"].values
+    point_lats = gdf["latitude"].values
+    if isinstance(weights, str):
+        weights = gdf[weights].values
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)
+
+    # Bin every point in one pass, dropping those whose nearest cell is not accessible
+    lon_idx = find_nearest_coordinate_indices(lons, point_lons)
+    lat_idx = find_nearest_coordinate_indices(lats, point_lats)
+    mask_lat_idx, mask_lon_idx = get_nearest_grid_indices(
+        accessible_area, point_lats, point_lons
+    )
+    accessible = accessible_area.values[mask_lat_idx, mask_lon_idx] != 0
+    flat_idx = np.ravel_multi_index(
+        (lat_idx[accessible], lon_idx[accessible]), accessible_area.shape
+    )
+    raster = np.bincount(
+        flat_idx,
+        weights=None if weights is None else weights[accessible],
+        minlength=accessible_area.size,
+    ).reshape(accessible_area.shape)
     # Expect large number in a hotspot, median of 0 as most points are empty, but still a decently large amount of non-zero points
     print(
         f"Raster stats - max: {raster.max()}, median: {np.median(raster)}, non-zero count: {(raster > 0).sum()}"
@@ -45,27 +72,64 @@ def create_probability_raster(raw_raster, sigma=1):
     return prob_raster
 
 
-def sample_background_points(accessible_area, background_gdf):
-    bg_raster = create_raw_raster(background_gdf, accessible_area)
+def create_sampling_table(prob_raster):
+    """
+    Keep only the non-zero cells of the probability raster with their cumulative probabilities.
+    Built once and reused for every draw.
+    """
+    support = np.flatnonzero(prob_raster)
+    probs = prob_raster.ravel()[support]
+    cdf = np.cumsum(probs)
+    return support, probs / cdf[-1], cdf / cdf[-1]
+
+
+def draw_from_sampling_table(sampling_table, size, rng, replace=True):
+    support, probs, cdf = sampling_table
+    if replace:
+        draws = np.searchsorted(cdf, rng.random(size), side="right")
+        return support[np.minimum(draws, len(support) - 1)]
+    if size > len(support):
+        raise ValueError(
+            f"Cannot draw {size} background points without replacement from {len(support)} cells"
+        )
+    # Weighted sampling without replacement: keep the smallest exponential keys (Efraimidis-Spirakis)
+    keys = rng.exponential(size=len(support)) / probs
+    return support[np.argpartition(keys, size - 1)[:size]] if size else support[:0]
+
+
+def sample_background_point_replicates(
+    accessible_area, background_gdf, n_replicates=1, seed=None, replace=None
+):
+    """
+    Draw n_replicates independent background sets from one bias raster.
+    Each replicate gets its own Generator stream spawned from the seed, so replicate k is the same
+    whatever n_replicates is.
+    """
+    seed = config.PREPROCESSING.BG_SAMPLE_SEED if seed is None else seed
+    replace = config.PREPROCESSING.BG_SAMPLE_WITH_REPLACEMENT if replace is None else replace
+    bg_raster = create_raw_raster(
+        background_gdf, accessible_area, weights=config.PREPROCESSING.BG_WEIGHT_COLUMN
+    )
     bg_prob_raster = create_probability_raster(bg_raster, sigma=1)
+    sampling_table = create_sampling_table(bg_prob_raster)
 
     lons = accessible_area["longitude"].values
     lats = accessible_area["latitude"].values
 
-    np.random.seed(42)
-    background_points = np.random.choice(
-        np.arange(bg_prob_raster.size),
-        size=config.PREPROCESSING.BG_SAMPLE_SIZE,
-        replace=True,
-        p=bg_prob_raster.flatten(),
-    )
-    background_indices = np.unravel_index(background_points, bg_prob_raster.shape)
-    background_lons = lons[background_indices[1]]
-    background_lats = lats[background_indices[0]]
-    bg_vars = pd.DataFrame({"latitude": background_lats, "longitude": background_lons})
-    gbg_vars = gpd.GeoDataFrame(
-        bg_vars,
-        geometry=gpd.points_from_xy(bg_vars.longitude, bg_vars.latitude),
-        crs="EPSG:4326",
-    )
-    return gbg_vars
+    replicates = []
+    for replicate_seed in np.random.SeedSequence(seed).spawn(n_replicates):
+        rng = np.random.default_rng(replicate_seed)
+        background_points = draw_from_sampling_table(
+            sampling_table, config.PREPROCESSING.BG_SAMPLE_SIZE, rng, replace=replace
+        )
+        background_indices = np.unravel_index(background_points, bg_prob_raster.shape)
+        background_lons = lons[background_indices[1]]
+        background_lats = lats[background_indices[0]]
+        replicates.append(
+            pd.DataFrame({"latitude": background_lats, "longitude": background_lons})
+        )
+    return replicates
+
+
+def sample_background_points(accessible_area, background_gdf):
+    return sample_background_point_replicates(accessible_area, background_gdf)[0]
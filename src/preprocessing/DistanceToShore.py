@@ -0,0 +1,247 @@
+import glob
+import hashlib
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+from pyproj import Transformer
+import shapely
+import xarray as xr
+
+from preprocessing.FeatureCube import get_bathymetry_variable, get_feature_cube
+from ConfigHandler import config
+
+TO_METRES = Transformer.from_crs("EPSG:4326", "EPSG:3857", always_xy=True)
+
+
+def get_coastline_path():
+    return os.path.join(
+        config.DATA.ENVIRONMENTAL.FOLDER,
+        config.DATA.ENVIRONMENTAL.COASTLINE_DATA_PATH,
+    )
+
+
+def get_coastline_fingerprint():
+    """Path, size and mtime of every file of the coastline (.shp, .shx, .dbf, ...) as one hash"""
+    stem = os.path.splitext(get_coastline_path())[0]
+    fingerprints = []
+    for path in sorted(glob.glob(f"{glob.escape(stem)}.*")):
+        stat = os.stat(path)
+        fingerprints.append([os.path.normpath(path), stat.st_size, stat.st_mtime_ns])
+    return hashlib.sha1(json.dumps(fingerprints).encode()).hexdigest()
+
+
+def get_raster_cache_pattern():
+    stem, ext = os.path.splitext(config.PREPROCESSING.DISTANCE_TO_SHORE.RASTER_CACHE_FILE)
+    return os.path.join(config.DATA.ENVIRONMENTAL.FOLDER, f"{stem}_*{ext}")
+
+
+def get_raster_cache_path(lats, lons, coastline_fingerprint):
+    """RASTER_CACHE_FILE named by the grid's bounds and resolution and the coastline fingerprint"""
+    grid = [lats.min(), lats.max(), len(lats), lons.min(), lons.max(), len(lons)]
+    key = hashlib.sha1(
+        json.dumps([coastline_fingerprint, grid], default=float).encode()
+    ).hexdigest()[:16]
+    return get_raster_cache_pattern().replace("*", key)
+
+
+def load_cached_raster(path, lats, lons, coastline_fingerprint):
+    """The grid's part of a cached raster, or None if it is outdated or doesn't cover the grid"""
+    try:
+        with xr.open_dataarray(path) as cached:
+            if cached.attrs.get("coastline_fingerprint") != coastline_fingerprint:
+                return None
+            cached = cached.sel(
+                latitude=slice(lats.min(), lats.max()),
+                longitude=slice(lons.min(), lons.max()),
+            ).load()
+    except FileNotFoundError:
+        return None
+    if np.array_equal(cached["latitude"].values, lats) and np.array_equal(
+        cached["longitude"].values, lons
+    ):
+        return cached
+    return None
+
+
+def split_into_segments(geometries):
+    """Break coastline (multi)linestrings into two-point segments, so an STRtree can prune them"""
+    lines = shapely.get_parts(np.asarray(geometries))
+    coords, line_idx = shapely.get_coordinates(lines, return_index=True)
+    same_line = line_idx[1:] == line_idx[:-1]
+    segments = np.stack([coords[:-1][same_line], coords[1:][same_line]], axis=1)
+    return shapely.linestrings(segments)
+
+
+def nearest_distances(tree, x, y):
+    distances = np.full(len(x), np.inf)
+    if len(x) == 0 or len(tree) == 0:
+        return distances
+    indices, dists = tree.query_nearest(
+        shapely.points(x, y), return_distance=True, all_matches=False
+    )
+    distances[indices[0]] = dists
+    return distances
+
+
+class DistanceToShore:
+    """Distance to the nearest coastline in EPSG:3857 metres, in "exact" or "fast" (raster) mode"""
+
+    def __init__(self, min_lon, max_lon, min_lat, max_lat, mode=None):
+        self.mode = mode or config.PREPROCESSING.DISTANCE_TO_SHORE.MODE
+        if self.mode not in ("exact", "fast"):
+            raise ValueError(f"Unknown distance to shore mode: {self.mode}")
+        self.bounds = (min_lon, max_lon, min_lat, max_lat)
+        self.tree = None
+        self.clip_box = None
+        self.full_tree = None
+        self.raster = None
+
+    def load(self):
+        """Read and index the coastline (and raster in fast mode) on first use only."""
+        if self.tree is not None:
+            return
+        min_lon, max_lon, min_lat, max_lat = self.bounds
+        padding = config.PREPROCESSING.DISTANCE_TO_SHORE.CLIP_PADDING
+        clip_min_lon = max(min_lon - padding, -180)
+        clip_max_lon = min(max_lon + padding, 180)
+        clip_min_lat = max(min_lat - padding, -85)
+        clip_max_lat = min(max_lat + padding, 85)
+        coastline = gpd.read_file(
+            get_coastline_path(),
+            bbox=(clip_min_lon, clip_min_lat, clip_max_lon, clip_max_lat),
+        ).to_crs(epsg=3857)
+        x_min, y_min = TO_METRES.transform(clip_min_lon, clip_min_lat)
+        x_max, y_max = TO_METRES.transform(clip_max_lon, clip_max_lat)
+        self.clip_box = (x_min, y_min, x_max, y_max)
+        clipped = shapely.clip_by_rect(coastline.geometry.values, *self.clip_box)
+        self.tree = shapely.STRtree(split_into_segments(clipped))
+
+        if self.mode == "fast":
+            self.raster = self.load_or_create_raster()
+
+    @classmethod
+    def from_accessible_area(cls, accessible_area, mode=None):
+        return cls(
+            accessible_area["longitude"].min().item(),
+            accessible_area["longitude"].max().item(),
+            accessible_area["latitude"].min().item(),
+            accessible_area["latitude"].max().item(),
+            mode=mode,
+        )
+
+    @classmethod
+    def from_points(cls, lats, lons, mode=None):
+        if len(lats) == 0:
+            return cls(0.0, 0.0, 0.0, 0.0, mode=mode)
+        return cls(
+            float(np.min(lons)),
+            float(np.max(lons)),
+            float(np.min(lats)),
+            float(np.max(lats)),
+            mode=mode,
+        )
+
+    def get_full_tree(self):
+        if self.full_tree is None:
+            coastline = gpd.read_file(get_coastline_path()).to_crs(epsg=3857)
+            self.full_tree = shapely.STRtree(
+                split_into_segments(coastline.geometry.values)
+            )
+        return self.full_tree
+
+    def query_exact(self, lats, lons):
+        x, y = TO_METRES.transform(np.asarray(lons), np.asarray(lats))
+        distances = nearest_distances(self.tree, x, y)
+
+        # Anything closer to the clip boundary than to the clipped coastline may have a nearer
+        # coastline outside the clip box
+        x_min, y_min, x_max, y_max = self.clip_box
+        dist_to_boundary = np.minimum.reduce(
+            [x - x_min, x_max - x, y - y_min, y_max - y]
+        )
+        unsure = distances > dist_to_boundary
+        if unsure.any():
+            distances[unsure] = nearest_distances(
+                self.get_full_tree(), x[unsure], y[unsure]
+            )
+        return distances
+
+    def get_grid(self):
+        min_lon, max_lon, min_lat, max_lat = self.bounds
+        bathy = get_feature_cube(min_lon, max_lon, min_lat, max_lat).layer(
+            get_bathymetry_variable()
+        )
+        bathy = bathy.sel(
+            longitude=slice(min_lon, max_lon), latitude=slice(min_lat, max_lat)
+        )
+        return bathy["latitude"].values, bathy["longitude"].values
+
+    def load_or_create_raster(self):
+        """A cached raster of the current coastline covering this grid, or else a new one"""
+        lats, lons = self.get_grid()
+        coastline_fingerprint = get_coastline_fingerprint()
+        cache_path = get_raster_cache_path(lats, lons, coastline_fingerprint)
+        # This grid's own raster first, then any other region's that covers it
+        for path in [cache_path] + sorted(glob.glob(get_raster_cache_pattern())):
+            cached = load_cached_raster(path, lats, lons, coastline_fingerprint)
+            if cached is not None:
+                print(f"Loaded distance to shore raster from {path}")
+                return cached
+        if config.PREPROCESSING.DISTANCE_TO_SHORE.READ_ONLY:
+            raise RuntimeError(
+                f"No distance to shore raster covers {self.bounds}, and DISTANCE_TO_SHORE.READ_ONLY"
+                " is set - it must be created before the worker processes start"
+            )
+
+        print("Creating distance to shore raster...")
+        lon2d, lat2d = np.meshgrid(lons, lats)
+        distances = self.query_exact(lat2d.ravel(), lon2d.ravel())
+        raster = xr.DataArray(
+            distances.reshape(lat2d.shape),
+            coords={"latitude": lats, "longitude": lons},
+            dims=("latitude", "longitude"),
+            name="distance_to_shore_m",
+            attrs={"coastline_fingerprint": coastline_fingerprint},
+        )
+        # Written to a temporary file and swapped in, so readers never see a partial file
+        tmp_path = f"{cache_path}.tmp{os.getpid()}"
+        raster.to_netcdf(tmp_path)
+        os.replace(tmp_path, cache_path)
+        print(f"Saved distance to shore raster to {cache_path}")
+        return raster
+
+    def query_fast(self, lats, lons):
+        lats, lons = np.asarray(lats), np.asarray(lons)
+        lat_idx = self.raster.indexes["latitude"].get_indexer(lats, method="nearest")
+        lon_idx = self.raster.indexes["longitude"].get_indexer(lons, method="nearest")
+        distances = self.raster.values[lat_idx, lon_idx]
+
+        # Points off the raster would snap to an edge cell, so answer those exactly
+        min_lon, max_lon, min_lat, max_lat = self.bounds
+        outside = (lons < min_lon) | (lons > max_lon) | (lats < min_lat) | (lats > max_lat)
+        if outside.any():
+            distances[outside] = self.query_exact(lats[outside], lons[outside])
+        return distances
+
+    def query(self, lats, lons):
+        if len(lats) == 0:
+            return np.array([], dtype=float)
+        self.load()
+        if self.mode == "fast":
+            return self.query_fast(lats, lons)
+        return self.query_exact(lats, lons)
+
+    def max_error_m(self):
+        """Upper bound on |fast - exact|: the largest half cell diagonal in EPSG:3857 metres."""
+        self.load()
+        if self.raster is None:
+            return 0.0
+        lats = self.raster["latitude"].values
+        lons = self.raster["longitude"].values
+        if len(lats) < 2 or len(lons) < 2:
+            return 0.0
+        x, _ = TO_METRES.transform(lons, np.zeros_like(lons))
+        _, y = TO_METRES.transform(np.zeros_like(lats), lats)
+        return 0.5 * np.hypot(np.abs(np.diff(x)).max(), np.abs(np.diff(y)).max())
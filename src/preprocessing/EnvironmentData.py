@@ -1,71 +1,54 @@
-import os
-
-import geopandas as gpd
-import xarray as xr
+import numpy as np
 
+from preprocessing.DistanceToShore import DistanceToShore
+from preprocessing.FeatureCube import get_feature_cube
 from ConfigHandler import config
 
 
-def get_variable_based_on_lat_and_lon(ds, var_name, lat, lon):
-    return (
-        ds[var_name]
-        .sel(time="1970-01-01", longitude=lon, latitude=lat, method="nearest")
-        .values.item()
-    )
+def get_nearest_grid_indices(ds, lats, lons):
+    """
+    Nearest grid cell indices for every point at once.
+    Uses the same pandas index lookup as `.sel(..., method="nearest")`, so ties
+    on cell edges resolve identically to the row-by-row selection.
+    """
+    lat_idx = ds.indexes["latitude"].get_indexer(np.asarray(lats), method="nearest")
+    lon_idx = ds.indexes["longitude"].get_indexer(np.asarray(lons), method="nearest")
+    return lat_idx, lon_idx
 
 
-def load_distance_to_shore(gdf):
-    if "distance_to_shore_m" not in config.PREPROCESSING.ENVIRONMENT_DATA:
-        return gdf
-    gdf = gdf.to_crs(epsg=3857)
-    coastline = gpd.read_file(
-        os.path.join(
-            config.DATA.ENVIRONMENTAL.FOLDER,
-            config.DATA.ENVIRONMENTAL.COASTLINE_DATA_PATH,
-        )
-    )
-    coastline = coastline.to_crs(epsg=3857)
-    gdf["distance_to_shore_m"] = gdf.geometry.apply(
-        lambda point: coastline.distance(point).min()
+def gather_environment_features(cube, lats, lons, distance_to_shore=None):
+    """
+    Feature matrix for arrays of coordinates, columns in ENVIRONMENT_DATA order: one gather from
+    the feature cube for the Bio-ORACLE layers plus distance to shore.
+    """
+    lats, lons = np.asarray(lats), np.asarray(lons)
+    variables = config.PREPROCESSING.ENVIRONMENT_DATA
+    features = np.empty((len(lats), len(variables)))
+    cube_columns = [i for i, var in enumerate(variables) if var != "distance_to_shore_m"]
+    features[:, cube_columns] = cube.gather(
+        lats, lons, [variables[i] for i in cube_columns]
     )
-    gdf = gdf.to_crs(epsg=4326)
-    return gdf
+    if "distance_to_shore_m" in variables:
+        if distance_to_shore is None:
+            distance_to_shore = DistanceToShore.from_points(lats, lons)
+        features[:, variables.index("distance_to_shore_m")] = distance_to_shore.query(
+            lats, lons
+        )
+    return features
 
 
-def load_all_environment_variables(gdf):
+def load_all_environment_variables(gdf, distance_to_shore=None):
     print("Loading in environment variables...")
     variables = config.PREPROCESSING.ENVIRONMENT_DATA
-    for var in variables:
-        if var == "distance_to_shore_m":
-            continue
-        path = os.path.join(
-            config.DATA.ENVIRONMENTAL.FOLDER,
-            config.DATA.ENVIRONMENTAL.BIO_ORACLE.FOLDER,
-            f"{var}.nc",
-        )
-        ds = xr.open_dataset(path)
-        var_name = list(ds.data_vars.keys())[0]
-
-        # TODO: maybe this is faster but needs some correction
-        # gds = gpd.GeoDataFrame(
-        #     ds.to_dataframe().reset_index(),
-        #     geometry=gpd.points_from_xy(ds.longitude, ds.latitude),
-        #     crs="EPSG:4326",
-        # )
-        # gdf = gpd.sjoin_nearest(gdf, ds, how="left")
-        # gdf.drop(
-        #     columns=["index_right", "lon", "lat"],
-        #     inplace=True,
-        # )
-
-        gdf[var] = gdf.apply(
-            lambda row: get_variable_based_on_lat_and_lon(
-                ds, var_name, row["latitude"], row["longitude"]
-            ),
-            axis=1,
-        )
-        ds.close()
-    gdf = load_distance_to_shore(gdf)
+    lats = gdf["latitude"].values
+    lons = gdf["longitude"].values
+    if len(gdf) > 0:
+        cube = get_feature_cube(lons.min(), lons.max(), lats.min(), lats.max())
+        features = gather_environment_features(cube, lats, lons, distance_to_shore)
+    else:
+        features = np.empty((0, len(variables)))
+    for i, var in enumerate(variables):
+        gdf[var] = features[:, i]
 
     if config.PREPROCESSING.DROP_NA_ENVIRONMENTAL:
         gdf = gdf.dropna(subset=variables).reset_index(drop=True)
@@ -0,0 +1,318 @@
+from contextlib import contextmanager
+import json
+import os
+import shutil
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from ConfigHandler import config
+
+MANIFEST_FILE = "manifest.json"
+VALUES_FILE = "values.npy"
+LATITUDE_FILE = "latitude.npy"
+LONGITUDE_FILE = "longitude.npy"
+LOCK_FILE = ".lock"
+VERSION_PREFIX = "cube_"
+TIME_SLICE = "1970-01-01"
+
+
+def get_cube_folder():
+    return os.path.join(
+        config.DATA.ENVIRONMENTAL.FOLDER,
+        config.PREPROCESSING.FEATURE_CUBE.FOLDER,
+    )
+
+
+def get_source_path(var):
+    return os.path.join(
+        config.DATA.ENVIRONMENTAL.FOLDER,
+        config.DATA.ENVIRONMENTAL.BIO_ORACLE.FOLDER,
+        f"{var}.nc",
+    )
+
+
+def get_bathymetry_variable():
+    return os.path.splitext(config.DATA.ENVIRONMENTAL.BIO_ORACLE.BATHYMETRY_FILE)[0]
+
+
+def get_cube_variables():
+    """Bathymetry (for the accessible area) plus every Bio-ORACLE layer in ENVIRONMENT_DATA"""
+    bathymetry = get_bathymetry_variable()
+    return [bathymetry] + [
+        var
+        for var in config.PREPROCESSING.ENVIRONMENT_DATA
+        if var not in ("distance_to_shore_m", bathymetry)
+    ]
+
+
+def fingerprint_sources(variables):
+    fingerprints = {}
+    for var in variables:
+        stat = os.stat(get_source_path(var))
+        fingerprints[var] = [stat.st_size, stat.st_mtime_ns]
+    return fingerprints
+
+
+def get_source_dtype(var):
+    with xr.open_dataset(get_source_path(var)) as ds:
+        return ds[list(ds.data_vars.keys())[0]].dtype
+
+
+def read_layer(var, min_lon, max_lon, min_lat, max_lat):
+    with xr.open_dataset(get_source_path(var)) as ds:
+        var_name = list(ds.data_vars.keys())[0]
+        return (
+            ds[var_name]
+            .sel(time=TIME_SLICE, method="nearest")
+            .sel(longitude=slice(min_lon, max_lon), latitude=slice(min_lat, max_lat))
+            .load()
+        )
+
+
+class FeatureCube:
+    """All Bio-ORACLE layers on one (latitude, longitude, variable) array over the padded region"""
+
+    def __init__(self, variables, lats, lons, values, bounds):
+        self.variables = list(variables)
+        self.lats = lats
+        self.lons = lons
+        self.values = values
+        self.bounds = tuple(bounds)
+        self.lat_index = pd.Index(lats)
+        self.lon_index = pd.Index(lons)
+
+    @classmethod
+    def build(cls, variables, min_lon, max_lon, min_lat, max_lat, folder=None):
+        """Read each layer once into the cube - on disk, as a new version, if `folder` is given"""
+        print("Building environmental feature cube...")
+        padding = config.PREPROCESSING.FEATURE_CUBE.PADDING
+        padded_bounds = (
+            min_lon - padding,
+            max_lon + padding,
+            min_lat - padding,
+            max_lat + padding,
+        )
+        reference = read_layer(variables[0], *padded_bounds)
+        lats = reference["latitude"].values
+        lons = reference["longitude"].values
+        shape = (len(lats), len(lons), len(variables))
+        dtype = np.result_type(np.float32, *[get_source_dtype(var) for var in variables])
+        if folder is None:
+            values = np.empty(shape, dtype=dtype)
+        else:
+            version = f"{VERSION_PREFIX}{time.time_ns()}_{os.getpid()}"
+            os.makedirs(os.path.join(folder, version))
+            values = np.lib.format.open_memmap(
+                os.path.join(folder, version, VALUES_FILE),
+                mode="w+",
+                dtype=dtype,
+                shape=shape,
+            )
+
+        for k, var in enumerate(variables):
+            layer = reference if k == 0 else read_layer(var, *padded_bounds)
+            if not (
+                np.array_equal(layer["latitude"].values, lats)
+                and np.array_equal(layer["longitude"].values, lons)
+            ):
+                # Read a degree wider so edge cells still find their nearest neighbour
+                layer = read_layer(
+                    var,
+                    padded_bounds[0] - 1,
+                    padded_bounds[1] + 1,
+                    padded_bounds[2] - 1,
+                    padded_bounds[3] + 1,
+                )
+                layer = layer.sel(latitude=lats, longitude=lons, method="nearest")
+            values[:, :, k] = layer.values
+
+        cube = cls(variables, lats, lons, values, (min_lon, max_lon, min_lat, max_lat))
+        if folder is not None:
+            values.flush()
+            cube.save(folder, version)
+            print(f"Saved environmental feature cube {shape} to {folder}")
+        return cube
+
+    def save(self, folder, version):
+        """Arrays go in the (new) version folder; swapping in the manifest makes them current"""
+        np.save(os.path.join(folder, version, LATITUDE_FILE), self.lats)
+        np.save(os.path.join(folder, version, LONGITUDE_FILE), self.lons)
+        manifest = {
+            "version": version,
+            "variables": self.variables,
+            "bounds": list(self.bounds),
+            "padding": config.PREPROCESSING.FEATURE_CUBE.PADDING,
+            "time": TIME_SLICE,
+            "shape": list(self.values.shape),
+            "dtype": str(self.values.dtype),
+            "sources": fingerprint_sources(self.variables),
+        }
+        manifest_path = os.path.join(folder, MANIFEST_FILE)
+        previous_version = None
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                previous_version = json.load(f).get("version")
+        tmp_path = f"{manifest_path}.tmp{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(tmp_path, manifest_path)
+        remove_old_versions(folder, keep=(version, previous_version))
+
+    @classmethod
+    def open(cls, folder):
+        """The persisted cube and its manifest, or (None, None) if there isn't a complete one."""
+        manifest_path = os.path.join(folder, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return None, None
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if "version" not in manifest:
+            # Cube written before versioning - its files may be rewritten in place, so rebuild
+            return None, None
+        version_folder = os.path.join(folder, manifest["version"])
+        cube = cls(
+            manifest["variables"],
+            np.load(os.path.join(version_folder, LATITUDE_FILE)),
+            np.load(os.path.join(version_folder, LONGITUDE_FILE)),
+            np.load(os.path.join(version_folder, VALUES_FILE), mmap_mode="r"),
+            manifest["bounds"],
+        )
+        return cube, manifest
+
+    def covers(self, min_lon, max_lon, min_lat, max_lat):
+        cube_min_lon, cube_max_lon, cube_min_lat, cube_max_lat = self.bounds
+        return (
+            cube_min_lon <= min_lon
+            and max_lon <= cube_max_lon
+            and cube_min_lat <= min_lat
+            and max_lat <= cube_max_lat
+        )
+
+    def gather(self, lats, lons, variables):
+        """Feature rows for every point in one gather - columns in `variables` order, as floats."""
+        lat_idx = self.lat_index.get_indexer(np.asarray(lats), method="nearest")
+        lon_idx = self.lon_index.get_indexer(np.asarray(lons), method="nearest")
+        columns = [self.variables.index(var) for var in variables]
+        return self.values[lat_idx, lon_idx][:, columns].astype(float)
+
+    def layer(self, var):
+        return xr.DataArray(
+            self.values[:, :, self.variables.index(var)],
+            coords={"latitude": self.lats, "longitude": self.lons},
+            dims=("latitude", "longitude"),
+            name=var,
+        )
+
+
+def remove_old_versions(folder, keep):
+    """Delete cube versions other than `keep`, the current one and the one it replaced"""
+    for entry in os.listdir(folder):
+        if entry.startswith(VERSION_PREFIX) and entry not in keep:
+            shutil.rmtree(os.path.join(folder, entry), ignore_errors=True)
+        elif entry in (VALUES_FILE, LATITUDE_FILE, LONGITUDE_FILE):
+            # Arrays of a cube written before versioning
+            os.remove(os.path.join(folder, entry))
+
+
+def lock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return
+    while True:
+        try:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            # LK_LOCK gives up after 10 tries a second apart - keep waiting
+            pass
+
+
+def unlock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def cube_lock(folder):
+    """Exclusive lock across processes, so only one of them rebuilds the cube"""
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, LOCK_FILE), "w") as lock_file:
+        lock(lock_file)
+        try:
+            yield
+        finally:
+            unlock(lock_file)
+
+
+def is_compatible(manifest):
+    """Built with the same settings - so its variables and region can be carried over"""
+    return (
+        manifest["padding"] == config.PREPROCESSING.FEATURE_CUBE.PADDING
+        and manifest["time"] == TIME_SLICE
+    )
+
+
+def is_up_to_date(manifest, variables):
+    return (
+        set(variables) <= set(manifest["variables"])
+        and is_compatible(manifest)
+        and manifest["sources"] == fingerprint_sources(manifest["variables"])
+    )
+
+
+def get_usable_cube(folder, variables, min_lon, max_lon, min_lat, max_lat):
+    cube, manifest = FeatureCube.open(folder)
+    if (
+        cube is not None
+        and is_up_to_date(manifest, variables)
+        and cube.covers(min_lon, max_lon, min_lat, max_lat)
+    ):
+        return cube, manifest
+    return None, manifest
+
+
+def get_feature_cube(min_lon, max_lon, min_lat, max_lat, variables=None):
+    """Feature cube covering the bounding box - the persisted one while usable, else rebuilt"""
+    variables = list(variables or get_cube_variables())
+    if not config.PREPROCESSING.FEATURE_CUBE.USE:
+        return FeatureCube.build(variables, min_lon, max_lon, min_lat, max_lat)
+
+    folder = get_cube_folder()
+    bounds = (min_lon, max_lon, min_lat, max_lat)
+    cube, _ = get_usable_cube(folder, variables, *bounds)
+    if cube is not None:
+        return cube
+    if config.PREPROCESSING.FEATURE_CUBE.READ_ONLY:
+        raise RuntimeError(
+            f"Feature cube in {folder} is missing, outdated or doesn't cover {bounds} with "
+            f"{variables}, and FEATURE_CUBE.READ_ONLY is set - it must be built before the "
+            "worker processes start"
+        )
+
+    with cube_lock(folder):
+        # Another process may have rebuilt it while we waited for the lock
+        cube, manifest = get_usable_cube(folder, variables, *bounds)
+        if cube is not None:
+            return cube
+        if manifest is not None and is_compatible(manifest):
+            cube_min_lon, cube_max_lon, cube_min_lat, cube_max_lat = manifest["bounds"]
+            min_lon, max_lon = min(min_lon, cube_min_lon), max(max_lon, cube_max_lon)
+            min_lat, max_lat = min(min_lat, cube_min_lat), max(max_lat, cube_max_lat)
+            variables += [
+                var
+                for var in manifest["variables"]
+                if var not in variables and os.path.exists(get_source_path(var))
+            ]
+        return FeatureCube.build(variables, min_lon, max_lon, min_lat, max_lat, folder=folder)
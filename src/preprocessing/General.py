@@ -1,46 +1,61 @@
+import itertools
+
 import geopandas as gpd
 import numpy as np
 import pandas as pd
+from pyproj import Transformer
 from scipy.spatial import cKDTree
 
 from ConfigHandler import config
 
+EARTH_RADIUS_M = 6371008.8
+TO_METRES = Transformer.from_crs("EPSG:4326", "EPSG:3857", always_xy=True)
+# Points per chunk in spatial thinning - bounds the neighbour lists held at once
+THINNING_CHUNK_SIZE = 4096
 
-def filter_basic_issues_from_dataset(df):
-    num_to_remove = (
+
+def remove_basic_issues(df):
+    """
+    Drop rows with too uncertain (or, optionally, missing) coordinate uncertainty and rows without
+    lat/lon. Returns the filtered rows and how many rows each filter removed, in order.
+    """
+    removed = {}
+    too_uncertain = (
         df["coordinateUncertaintyInMeters"]
         >= config.PREPROCESSING.COORD_UNCERTAINTY_THRESHOLD
-    ).sum()
-    df = df[
-        (
-            df["coordinateUncertaintyInMeters"]
-            < config.PREPROCESSING.COORD_UNCERTAINTY_THRESHOLD
-        )
-        | (df["coordinateUncertaintyInMeters"].isna())
-    ].reset_index(drop=True)
-    print(
-        f"Filtered out {num_to_remove} rows based on coordinate uncertainty, leaving {df.shape[0]} rows"
     )
+    removed["coordinate uncertainty"] = too_uncertain.sum()
+    df = df[~too_uncertain].reset_index(drop=True)
 
     # Remove nans for co-ord uncertainty
     if config.PREPROCESSING.DROP_NA_COORD_UNCERTAINTY:
-        num_to_remove = df["coordinateUncertaintyInMeters"].isna().sum()
-        df = df[~df["coordinateUncertaintyInMeters"].isna()].reset_index(drop=True)
-        print(
-            f"Filtered out {num_to_remove} rows based on missing coordinate uncertainty, leaving {df.shape[0]} rows"
-        )
+        missing_uncertainty = df["coordinateUncertaintyInMeters"].isna()
+        removed["missing coordinate uncertainty"] = missing_uncertainty.sum()
+        df = df[~missing_uncertainty].reset_index(drop=True)
 
     # Remove rows with no lat/lon
-    num_to_remove = (df["decimalLatitude"].isna() | df["decimalLongitude"].isna()).sum()
-    df = df[
-        ~(df["decimalLatitude"].isna()) & ~(df["decimalLongitude"].isna())
-    ].reset_index(drop=True)
-    print(
-        f"Filtered out {num_to_remove} rows based on missing lat/lon, leaving {df.shape[0]} rows"
-    )
+    missing_coordinates = df["decimalLatitude"].isna() | df["decimalLongitude"].isna()
+    removed["missing lat/lon"] = missing_coordinates.sum()
+    df = df[~missing_coordinates].reset_index(drop=True)
     df = df.rename(
         columns={"decimalLatitude": "latitude", "decimalLongitude": "longitude"}
     )
+    return df, removed
+
+
+def print_filter_counts(num_rows, removed):
+    """Report how many rows each filter removed, given the number of rows before filtering"""
+    for reason, num_removed in removed.items():
+        num_rows -= num_removed
+        print(
+            f"Filtered out {num_removed} rows based on {reason}, leaving {num_rows} rows"
+        )
+
+
+def filter_basic_issues_from_dataset(df):
+    num_rows = df.shape[0]
+    df, removed = remove_basic_issues(df)
+    print_filter_counts(num_rows, removed)
     return df
 
 
@@ -51,61 +66,170 @@ def convert_to_geodataframe(df):
     return df
 
 
+def get_metric_coordinates(lats, lons, metric="projected"):
+    """
+    Coordinates in which plain Euclidean KD-tree queries measure distance:
+    - "projected": EPSG:3857 x/y in metres (stretched away from the equator)
+    - "great_circle": 3D points on a sphere with the Earth's radius, see `get_metric_radius`
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    if metric == "projected":
+        return np.vstack(TO_METRES.transform(lons, lats)).T
+    if metric == "great_circle":
+        lat_rad, lon_rad = np.radians(lats), np.radians(lons)
+        return EARTH_RADIUS_M * np.vstack(
+            [
+                np.cos(lat_rad) * np.cos(lon_rad),
+                np.cos(lat_rad) * np.sin(lon_rad),
+                np.sin(lat_rad),
+            ]
+        ).T
+    raise ValueError(f"Unknown distance metric: {metric}")
+
+
+def get_metric_radius(distance_m, metric="projected"):
+    """Query radius for `get_metric_coordinates` - great circle distances become chord lengths."""
+    if metric == "great_circle":
+        return 2 * EARTH_RADIUS_M * np.sin(min(distance_m / (2 * EARTH_RADIUS_M), np.pi / 2))
+    return distance_m
+
+
+def get_block_coordinates(lats, lons, metric="projected"):
+    """
+    2D x/y in metres for gridding the map into square blocks. "great_circle" uses the sinusoidal
+    (equal-area) projection, so blocks span the same ground distance at every latitude.
+    """
+    if metric == "great_circle":
+        lat_rad = np.radians(np.asarray(lats, dtype=float))
+        lon_rad = np.radians(np.asarray(lons, dtype=float))
+        return EARTH_RADIUS_M * np.vstack([lon_rad * np.cos(lat_rad), lat_rad]).T
+    return get_metric_coordinates(lats, lons, metric)
+
+
+def get_thinning_order(gdf):
+    """
+    Order in which points get the chance to be kept.
+    Without a priority column this is the row order. With one (e.g. coordinateUncertaintyInMeters),
+    lower values win and ties are broken by coordinates, so the result doesn't depend on row order.
+    """
+    priority_column = config.PREPROCESSING.SPATIAL_THINNING_PRIORITY_COLUMN
+    if priority_column is None:
+        return np.arange(len(gdf))
+    return np.lexsort(
+        (
+            np.arange(len(gdf)),
+            gdf["longitude"].values,
+            gdf["latitude"].values,
+            gdf[priority_column].values,
+        )
+    )
+
+
+def thin_coordinates(coords, min_distance, order):
+    """
+    Greedy thinning: walk points in `order`, keep a point unless an already kept point is within
+    min_distance. Points are walked in chunks of THINNING_CHUNK_SIZE: only the chunk's points that
+    are still in the running are queried against a KD-tree of all points, for their later
+    neighbours (a forward-only adjacency list), so memory is bounded by the chunk's neighbours
+    rather than every close pair in the dataset - which grows with the square of local density.
+    """
+    keep = np.zeros(len(coords), dtype=bool)
+    if len(coords) == 0:
+        return keep
+
+    # Exact duplicates can never be kept after their first occurrence, so drop them up front
+    ordered_coords = coords[order]
+    _, first_idx = np.unique(ordered_coords, axis=0, return_index=True)
+    first_idx = np.sort(first_idx)
+    candidates = order[first_idx]
+    candidate_coords = ordered_coords[first_idx]
+
+    tree = cKDTree(candidate_coords)
+    keep_candidate = np.ones(len(candidates), dtype=bool)
+    for start in range(0, len(candidates), THINNING_CHUNK_SIZE):
+        # Ranks follow `order`, so i < j means i is considered first
+        ranks = start + np.flatnonzero(keep_candidate[start : start + THINNING_CHUNK_SIZE])
+        if len(ranks) == 0:
+            continue
+        neighbours = tree.query_ball_point(
+            candidate_coords[ranks], min_distance, return_sorted=False
+        )
+        counts = np.fromiter(map(len, neighbours), dtype=np.intp, count=len(ranks))
+        sources = np.repeat(ranks, counts)
+        targets = np.fromiter(
+            itertools.chain.from_iterable(neighbours), dtype=np.intp, count=counts.sum()
+        )
+        # Sources are already grouped by rank, in rank order
+        forward = targets > sources
+        sources, targets = sources[forward], targets[forward]
+        bounds = np.searchsorted(sources, np.append(ranks, ranks[-1] + 1))
+        for k, i in enumerate(ranks):
+            if keep_candidate[i]:
+                keep_candidate[targets[bounds[k] : bounds[k + 1]]] = False
+    keep[candidates[keep_candidate]] = True
+    return keep
+
+
 def spatially_thin(gdf):
     """
     Spatially thin a dataset so that no points are within MIN_DISTANCE_M of each other.
     Reduces sampling bias for the 'presence' data.
-
-    TODO: Improve distance calculations to account for spherical nature of the Earth.
     """
-    gdf = gdf.to_crs(epsg=3857)
-    coords = np.vstack([gdf.geometry.x, gdf.geometry.y]).T
-
-    tree = cKDTree(coords)
-    to_keep = np.ones(len(gdf), dtype=bool)
-    for i in range(len(coords)):
-        if to_keep[i]:
-            neighbors = tree.query_ball_point(
-                coords[i], r=config.PREPROCESSING.SPATIAL_THINNING_MIN_DISTANCE_M
-            )
-            neighbors.remove(i)
-            to_keep[neighbors] = False
+    metric = config.PREPROCESSING.SPATIAL_THINNING_METRIC
+    coords = get_metric_coordinates(gdf["latitude"], gdf["longitude"], metric)
+    to_keep = thin_coordinates(
+        coords,
+        get_metric_radius(config.PREPROCESSING.SPATIAL_THINNING_MIN_DISTANCE_M, metric),
+        get_thinning_order(gdf),
+    )
     print(
         f"Spatially thinned dataset from {len(gdf)} to {to_keep.sum()} points to reduce sampling bias"
     )
-    gdf = gdf.to_crs(epsg=4326)
     return gdf[to_keep].reset_index(drop=True)
 
 
-def combine_presence_and_background_into_single_gdf(presence_gdf, background_gdf):
-    presence_gdf["label"] = 1
-    background_gdf["label"] = 0
-    presence_gdf = presence_gdf.to_crs(epsg=4326)
-    background_gdf = background_gdf.to_crs(epsg=4326)
-
-    combined_gdf = gpd.GeoDataFrame(
-        pd.concat([presence_gdf, background_gdf], ignore_index=True),
-        crs=presence_gdf.crs,
+def combine_presence_and_background_into_single_gdf(presence_df, background_df):
+    """Label, combine and shuffle - the point geometry is only built here, for the final dataset"""
+    presence_df["label"] = 1
+    background_df["label"] = 0
+    combined_df = pd.concat([presence_df, background_df], ignore_index=True)
+    combined_df = combined_df.sample(frac=1, replace=False, random_state=42).reset_index(
+        drop=True
+    )
+    combined_gdf = convert_to_geodataframe(
+        combined_df.drop(columns="geometry", errors="ignore")
     )
-    combined_gdf = combined_gdf.sample(
-        frac=1, replace=False, random_state=42
-    ).reset_index(drop=True)
     print(
         f"Combined presence and background data into single GeoDataFrame with {combined_gdf.shape[0]} rows"
     )
     return combined_gdf
 
 
-def filter_dataset_1_by_distance_to_dataset_2(gdf_1, gdf_2):
-    """TODO: Improve distance calculations to account for spherical nature of the Earth."""
-    gdf_1 = gdf_1.to_crs(epsg=3857)
-    gdf_2 = gdf_2.to_crs(epsg=3857)
-    joined = gdf_1.sjoin_nearest(gdf_2[["geometry"]], how="left", distance_col="dist_m")
-    joined = joined.drop_duplicates("gbifID")
-    gdf_1 = gdf_1.loc[
-        joined["dist_m"]
-        >= config.PREPROCESSING.MIN_DISTANCE_BETWEEN_PRESENCE_AND_ABSENCE_M
-    ].copy()
-    gdf_2 = gdf_2.to_crs(epsg=4326)
-    gdf_1 = gdf_1.to_crs(epsg=4326).reset_index(drop=True)
-    return gdf_1
+def get_nearest_metric_distances(df_1, df_2, metric="projected"):
+    """
+    Distance from every point of df_1 to its nearest point of df_2, in `get_metric_coordinates`
+    units (compare against `get_metric_radius`). Infinite if df_2 is empty.
+    """
+    if len(df_2) == 0:
+        return np.full(len(df_1), np.inf)
+    tree = cKDTree(get_metric_coordinates(df_2["latitude"], df_2["longitude"], metric))
+    distances, _ = tree.query(
+        get_metric_coordinates(df_1["latitude"], df_1["longitude"], metric)
+    )
+    return distances
+
+
+def filter_dataset_1_by_distance_to_dataset_2(df_1, df_2, threshold_m=None, metric=None):
+    """
+    Keep the points of df_1 at least threshold_m from every point of df_2 (default
+    MIN_DISTANCE_BETWEEN_PRESENCE_AND_ABSENCE_M). Distances follow PRESENCE_ABSENCE_DISTANCE_METRIC:
+    "great_circle" for true distances on the sphere, "projected" for EPSG:3857 metres.
+    """
+    if threshold_m is None:
+        threshold_m = config.PREPROCESSING.MIN_DISTANCE_BETWEEN_PRESENCE_AND_ABSENCE_M
+    metric = metric or config.PREPROCESSING.PRESENCE_ABSENCE_DISTANCE_METRIC
+    far_enough = get_nearest_metric_distances(df_1, df_2, metric) >= get_metric_radius(
+        threshold_m, metric
+    )
+    return df_1[far_enough].reset_index(drop=True)
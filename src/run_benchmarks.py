@@ -0,0 +1,54 @@
+import argparse
+import sys
+import warnings
+
+from benchmark.Runner import (
+    compare_benchmark_results,
+    load_benchmark_results,
+    print_comparison,
+    run_benchmarks,
+    save_benchmark_results,
+)
+from benchmark.Stages import BENCHMARKS
+from ConfigHandler import config
+
+warnings.filterwarnings("ignore")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark pipeline stages on synthetic data (see BENCHMARK in config.json)"
+    )
+    parser.add_argument("--stages", nargs="+", choices=list(BENCHMARKS), default=None)
+    parser.add_argument("--scales", nargs="+", type=int, default=None)
+    parser.add_argument("--output", default=None, help="Results file (default: timestamped)")
+    parser.add_argument(
+        "--compare",
+        nargs="?",
+        const=config.BENCHMARK.BASELINE_PATH,
+        default=None,
+        help="Flag regressions against a baseline results file (default: BENCHMARK.BASELINE_PATH)",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Also save the results as BENCHMARK.BASELINE_PATH",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    benchmark_results = run_benchmarks(stages=args.stages, scales=args.scales)
+    save_benchmark_results(benchmark_results, args.output)
+    num_regressions = 0
+    if args.compare:
+        comparison = compare_benchmark_results(
+            benchmark_results, load_benchmark_results(args.compare)
+        )
+        benchmark_results["comparison"] = comparison
+        num_regressions = print_comparison(comparison)
+    if args.save_baseline:
+        save_benchmark_results(benchmark_results, config.BENCHMARK.BASELINE_PATH)
+    # Non-zero exit on regressions, so this can gate CI
+    sys.exit(1 if num_regressions else 0)
@@ -0,0 +1,146 @@
+from collections import OrderedDict
+import hashlib
+import threading
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+import xgboost as xgb
+
+from ConfigHandler import config
+
+# XGBoost's default - the quantile cuts only depend on this and the data, not on anything optuna tunes
+QUANTILE_MAX_BIN = 256
+
+# Fold matrices (incl. quantised XGBoost DMatrices) shared by every optuna trial and the final CV
+FOLD_DATA_CACHE = OrderedDict()
+FOLD_DATA_CACHE_LOCK = threading.Lock()
+fold_data_cache_bytes = 0
+
+
+def split_train_val_test(X, y, fold_ids, test_fold_id):
+    """Also returns the val/test row positions in X, so their predictions can be traced back"""
+    fold_mask = fold_ids == test_fold_id
+    X_test, y_test = X[fold_mask], y[fold_mask]
+    X_train_val, y_train_val = X[~fold_mask], y[~fold_mask]
+    positions = np.arange(len(y))
+
+    X_train, X_val, y_train, y_val, _, val_positions = train_test_split(
+        X_train_val,
+        y_train_val,
+        positions[~fold_mask],
+        test_size=config.TRAINING.VAL_PROP,
+        random_state=0,
+        stratify=y_train_val,
+    )
+    return (
+        X_train,
+        X_val,
+        X_test,
+        y_train,
+        y_val,
+        y_test,
+        val_positions,
+        positions[fold_mask],
+    )
+
+
+def get_fold_data_key(X, y, fold_ids):
+    key = hashlib.sha1()
+    for array in (X, y, fold_ids):
+        array = np.ascontiguousarray(array)
+        key.update(str((array.shape, array.dtype)).encode())
+        key.update(array.tobytes())
+    key.update(f"{config.TRAINING.VAL_PROP}_{QUANTILE_MAX_BIN}".encode())
+    return key.hexdigest()
+
+
+def estimate_fold_data_bytes(fold_data):
+    """Raw arrays plus roughly one byte per quantised train/val entry (256 bins)"""
+    num_bytes = sum(
+        fold_data[name].nbytes
+        for name in [
+            "X_train",
+            "X_val",
+            "X_test",
+            "y_train",
+            "y_val",
+            "y_test",
+            "val_positions",
+            "test_positions",
+        ]
+    )
+    num_bytes += fold_data["X_train"].size + fold_data["X_val"].size
+    # Plain DMatrices used for prediction hold float32 copies
+    num_bytes += 4 * (fold_data["X_val"].size + fold_data["X_test"].size)
+    return num_bytes
+
+
+def create_fold_data(X, y, fold_ids, test_fold_id, n_jobs):
+    (
+        X_train,
+        X_val,
+        X_test,
+        y_train,
+        y_val,
+        y_test,
+        val_positions,
+        test_positions,
+    ) = split_train_val_test(X, y, fold_ids, test_fold_id)
+    # Same matrices XGBClassifier.fit would build: quantised train, val quantised with train's cuts
+    dtrain = xgb.QuantileDMatrix(
+        X_train, label=y_train, max_bin=QUANTILE_MAX_BIN, nthread=n_jobs
+    )
+    dval = xgb.QuantileDMatrix(
+        X_val, label=y_val, ref=dtrain, max_bin=QUANTILE_MAX_BIN, nthread=n_jobs
+    )
+    fold_data = {
+        "X_train": X_train,
+        "X_val": X_val,
+        "X_test": X_test,
+        "y_train": y_train,
+        "y_val": y_val,
+        "y_test": y_test,
+        "val_positions": val_positions,
+        "test_positions": test_positions,
+        "dtrain": dtrain,
+        "dval": dval,
+        "dval_predict": xgb.DMatrix(X_val, nthread=n_jobs),
+        "dtest_predict": xgb.DMatrix(X_test, nthread=n_jobs),
+    }
+    fold_data["num_bytes"] = estimate_fold_data_bytes(fold_data)
+    return fold_data
+
+
+def get_fold_data(X, y, fold_ids, test_fold_id, n_jobs=1, data_key=None):
+    """
+    Train/val/test split and XGBoost matrices for one fold, built once and cached.
+    The cache is LRU and evicts once it holds more than TRAINING.FOLD_DATA_CACHE_MAX_MB.
+    """
+    global fold_data_cache_bytes
+    if data_key is None:
+        data_key = get_fold_data_key(X, y, fold_ids)
+    key = (data_key, test_fold_id)
+    with FOLD_DATA_CACHE_LOCK:
+        if key in FOLD_DATA_CACHE:
+            FOLD_DATA_CACHE.move_to_end(key)
+            return FOLD_DATA_CACHE[key]
+
+    fold_data = create_fold_data(X, y, fold_ids, test_fold_id, n_jobs)
+
+    max_bytes = config.TRAINING.FOLD_DATA_CACHE_MAX_MB * 1024**2
+    with FOLD_DATA_CACHE_LOCK:
+        if key in FOLD_DATA_CACHE or fold_data["num_bytes"] > max_bytes:
+            return FOLD_DATA_CACHE.get(key, fold_data)
+        FOLD_DATA_CACHE[key] = fold_data
+        fold_data_cache_bytes += fold_data["num_bytes"]
+        while fold_data_cache_bytes > max_bytes:
+            _, evicted = FOLD_DATA_CACHE.popitem(last=False)
+            fold_data_cache_bytes -= evicted["num_bytes"]
+    return fold_data
+
+
+def clear_fold_data_cache():
+    global fold_data_cache_bytes
+    with FOLD_DATA_CACHE_LOCK:
+        FOLD_DATA_CACHE.clear()
+        fold_data_cache_bytes = 0
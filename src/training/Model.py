@@ -1,22 +1,35 @@
 import xgboost as xgb
 
+from training.Parallel import get_available_threads
 from ConfigHandler import config
 
 
-def create_xgboost_model(positive_weight):
+def get_model_params(model_params=None):
+    """config.MODEL with any per-call overrides (e.g. an optuna trial's params) applied on top."""
+    params = config.MODEL.to_dict()
+    if model_params:
+        params.update(model_params)
+    return params
+
+
+def create_xgboost_model(positive_weight, n_jobs=None, model_params=None, callbacks=None):
+    if n_jobs is None:
+        n_jobs = get_available_threads()
+    params = get_model_params(model_params)
     model = xgb.XGBClassifier(
         objective="binary:logistic",
         eval_metric="aucpr",
-        n_estimators=config.MODEL.N_ESTIMATORS,
-        max_depth=config.MODEL.MAX_DEPTH,
-        learning_rate=config.MODEL.LEARNING_RATE,
-        subsample=config.MODEL.SUBSAMPLE,
-        colsample_bytree=config.MODEL.COLSAMPLE_BYTREE,
-        reg_lambda=config.MODEL.REG_LAMBDA,
-        reg_alpha=config.MODEL.REG_ALPHA,
+        n_estimators=params["N_ESTIMATORS"],
+        max_depth=params["MAX_DEPTH"],
+        learning_rate=params["LEARNING_RATE"],
+        subsample=params["SUBSAMPLE"],
+        colsample_bytree=params["COLSAMPLE_BYTREE"],
+        reg_lambda=params["REG_LAMBDA"],
+        reg_alpha=params["REG_ALPHA"],
         scale_pos_weight=positive_weight,
-        n_jobs=4,
-        early_stopping_rounds=config.MODEL.EARLY_STOPPING_ROUNDS,
+        n_jobs=n_jobs,
+        early_stopping_rounds=params["EARLY_STOPPING_ROUNDS"],
+        callbacks=callbacks,
     )
     return model
 
@@ -24,3 +37,41 @@ def create_xgboost_model(positive_weight):
 def train_xgboost_model(model, X_train, y_train, X_val, y_val):
     model.fit(X_train, y_train, eval_set=[(X_val, y_val)], verbose=False)
     return model
+
+
+def train_xgboost_booster(
+    dtrain, dval, positive_weight, n_jobs=None, model_params=None, callbacks=None
+):
+    """
+    Native-API equivalent of create_xgboost_model + train_xgboost_model on prebuilt (cached)
+    DMatrices, so the data isn't quantised again for every model.
+    """
+    if n_jobs is None:
+        n_jobs = get_available_threads()
+    params = get_model_params(model_params)
+    booster = xgb.train(
+        {
+            "objective": "binary:logistic",
+            "eval_metric": "aucpr",
+            "max_depth": params["MAX_DEPTH"],
+            "learning_rate": params["LEARNING_RATE"],
+            "subsample": params["SUBSAMPLE"],
+            "colsample_bytree": params["COLSAMPLE_BYTREE"],
+            "reg_lambda": params["REG_LAMBDA"],
+            "reg_alpha": params["REG_ALPHA"],
+            "scale_pos_weight": positive_weight,
+            "n_jobs": n_jobs,
+        },
+        dtrain,
+        num_boost_round=params["N_ESTIMATORS"],
+        evals=[(dval, "validation_0")],
+        early_stopping_rounds=params["EARLY_STOPPING_ROUNDS"],
+        callbacks=callbacks,
+        verbose_eval=False,
+    )
+    return booster
+
+
+def predict_proba_with_booster(booster, dmatrix):
+    """Positive class probabilities up to the best iteration, as XGBClassifier.predict_proba does"""
+    return booster.predict(dmatrix, iteration_range=(0, booster.best_iteration + 1))
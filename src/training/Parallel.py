@@ -0,0 +1,23 @@
+import os
+
+from ConfigHandler import config
+
+
+def get_available_threads():
+    """CPU threads this process may use - MAX_THREADS if set, otherwise every core we can run on."""
+    if config.TRAINING.MAX_THREADS:
+        return config.TRAINING.MAX_THREADS
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def split_thread_budget(num_tasks, max_workers=None):
+    """
+    Divide the thread budget between outer workers (e.g. CV folds) and inner threads per worker
+    (e.g. XGBoost n_jobs), so that workers * inner threads never exceeds the budget.
+    """
+    total_threads = get_available_threads()
+    num_workers = max(1, min(num_tasks, max_workers or total_threads, total_threads))
+    threads_per_worker = max(1, total_threads // num_workers)
+    return num_workers, threads_per_worker
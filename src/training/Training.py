@@ -1,14 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+
 import numpy as np
+import optuna
 import pandas as pd
 from scipy.spatial import cKDTree
-from sklearn.model_selection import train_test_split
 
-from optimisation.Threshold import find_optimal_threshold
-from training.Model import create_xgboost_model, train_xgboost_model
-from evaluation.Prediction import predict_on_dataset, evaluate_model_performance
+from optimisation.Pruning import (
+    BoostingPruningCallback,
+    add_boosting_rounds,
+    is_fold_by_fold,
+    is_pruning_enabled,
+    report_fold,
+)
+from optimisation.Threshold import find_optimal_threshold_from_probs
+from preprocessing.General import (
+    get_block_coordinates,
+    get_metric_coordinates,
+    get_metric_radius,
+)
+from training.FoldData import get_fold_data, get_fold_data_key
+from training.Model import predict_proba_with_booster, train_xgboost_booster
+from training.Parallel import split_thread_budget
+from evaluation.Prediction import apply_threshold, evaluate_model_performance
 
 from ConfigHandler import config
 
+# Fold IDs only depend on the coordinates and fold settings, so every fold and every
+# optuna trial on the same dataset can share them
+FOLD_ID_CACHE = {}
+MAX_FOLD_ID_CACHE_ENTRIES = 16
+
 
 def prepare_data_for_modelling(dataset):
     X = dataset[config.PREPROCESSING.ENVIRONMENT_DATA].values
@@ -19,44 +41,52 @@ def prepare_data_for_modelling(dataset):
     return X, y
 
 
-def create_spatial_folds(dataset):
-    """TODO: improve distance calculation to account for spherical geometry"""
-    dataset = dataset.to_crs(epsg=3857)
-    coords = np.vstack([dataset.geometry.x, dataset.geometry.y]).T
-    tree = cKDTree(coords)
-    fold_ids = -1 * np.ones(len(dataset), dtype=int)
+def get_fold_cache_key(dataset):
+    key = hashlib.sha1()
+    key.update(np.ascontiguousarray(dataset["latitude"].values, dtype=float).tobytes())
+    key.update(np.ascontiguousarray(dataset["longitude"].values, dtype=float).tobytes())
+    key.update(
+        f"{config.TRAINING.NUM_FOLDS}_{config.TRAINING.MIN_DISTANCE_BETWEEN_FOLDS_M}_"
+        f"{config.TRAINING.DISTANCE_METRIC}".encode()
+    )
+    return key.hexdigest()
+
+
+def assign_spatial_blocks_to_folds(coords, block_size, num_folds):
+    """
+    Split the map into square blocks of block_size metres and give each block a fold.
+    Blocks are numbered in order of first appearance in the (shuffled) dataset and folds are
+    cycled through - i.e. each fold will be distributed across the map.
+    Good balance between aiming for both spatial separation and decent generalisation.
+    """
+    if len(coords) == 0:
+        return np.zeros(0, dtype=int)
+    blocks = np.floor(coords / block_size).astype(np.int64)
+    _, first_idx, block_ids = np.unique(
+        blocks, axis=0, return_index=True, return_inverse=True
+    )
+    block_ranks = np.empty(len(first_idx), dtype=int)
+    block_ranks[np.argsort(first_idx)] = np.arange(len(first_idx))
+    return block_ranks[block_ids.ravel()] % num_folds
 
-    current_fold = 0
-    for i in range(len(dataset)):
-        if fold_ids[i] != -1:
-            continue
-        fold_ids[i] = current_fold
-        neighbors = tree.query_ball_point(
-            coords[i], r=config.TRAINING.MIN_DISTANCE_BETWEEN_FOLDS_M
+
+def create_spatial_folds(dataset):
+    cache_key = get_fold_cache_key(dataset)
+    if cache_key not in FOLD_ID_CACHE:
+        coords = get_block_coordinates(
+            dataset["latitude"], dataset["longitude"], config.TRAINING.DISTANCE_METRIC
+        )
+        if len(FOLD_ID_CACHE) >= MAX_FOLD_ID_CACHE_ENTRIES:
+            FOLD_ID_CACHE.pop(next(iter(FOLD_ID_CACHE)))
+        FOLD_ID_CACHE[cache_key] = assign_spatial_blocks_to_folds(
+            coords,
+            config.TRAINING.MIN_DISTANCE_BETWEEN_FOLDS_M,
+            config.TRAINING.NUM_FOLDS,
         )
-        neighbors.remove(i)
-        fold_ids[neighbors] = current_fold
-        # Cycle through - i.e. each fold will be distributed across the map.
-        # Good balance between aiming for both spatial separation and decent generalisation.
-        current_fold = (current_fold + 1) % config.TRAINING.NUM_FOLDS
+    fold_ids = FOLD_ID_CACHE[cache_key].copy()
+    dataset = dataset.copy()
     dataset["fold_id"] = fold_ids
-    dataset = dataset.to_crs(epsg=4326)
-    return dataset, dataset["fold_id"].values
-
-
-def split_train_val_test(X, y, fold_ids, test_fold_id):
-    fold_mask = fold_ids == test_fold_id
-    X_test, y_test = X[fold_mask], y[fold_mask]
-    X_train_val, y_train_val = X[~fold_mask], y[~fold_mask]
-
-    X_train, X_val, y_train, y_val = train_test_split(
-        X_train_val,
-        y_train_val,
-        test_size=config.TRAINING.VAL_PROP,
-        random_state=0,
-        stratify=y_train_val,
-    )
-    return X_train, X_val, X_test, y_train, y_val, y_test
+    return dataset, fold_ids
 
 
 def calculate_class_weights(y_train):
@@ -66,51 +96,154 @@ def calculate_class_weights(y_train):
     return positive_weight
 
 
-def cross_validate(dataset):
-    precisions, recalls, f1_scores, best_thresholds, num_trees = [], [], [], [], []
-    for i in range(config.TRAINING.NUM_FOLDS):
-        X, y = prepare_data_for_modelling(dataset)
-        dataset, fold_ids = create_spatial_folds(dataset)
-        X_train, X_val, X_test, y_train, y_val, y_test = split_train_val_test(
-            X, y, fold_ids, test_fold_id=i
+def train_and_evaluate_fold(
+    X, y, fold_ids, test_fold_id, n_jobs=None, model_params=None, trial=None, data_key=None
+):
+    """
+    Train and score one spatial fold on its cached matrices. With an optuna trial and boosting-level
+    pruning enabled, validation AUCPR is reported while boosting and the trial is pruned as soon as
+    it falls behind.
+    """
+    fold_data = get_fold_data(X, y, fold_ids, test_fold_id, n_jobs, data_key)
+    pruning_callback = None
+    if is_pruning_enabled(trial) and config.OPTIMISATION.PRUNING.REPORT == "boosting":
+        pruning_callback = BoostingPruningCallback(trial, test_fold_id)
+    pos_weight = calculate_class_weights(fold_data["y_train"])
+    booster = train_xgboost_booster(
+        fold_data["dtrain"],
+        fold_data["dval"],
+        pos_weight,
+        n_jobs=n_jobs,
+        model_params=model_params,
+        callbacks=None if pruning_callback is None else [pruning_callback],
+    )
+    num_rounds = booster.num_boosted_rounds()
+    if trial is not None:
+        add_boosting_rounds(trial, num_rounds)
+    if pruning_callback is not None and pruning_callback.pruned:
+        raise optuna.TrialPruned()
+    val_probs = predict_proba_with_booster(booster, fold_data["dval_predict"])
+    best_threshold = find_optimal_threshold_from_probs(fold_data["y_val"], val_probs)
+    test_probs = predict_proba_with_booster(booster, fold_data["dtest_predict"])
+    y_preds = apply_threshold(test_probs, best_threshold)
+    precision, recall, f1 = evaluate_model_performance(fold_data["y_test"], y_preds)
+    predictions = {
+        "val": (fold_data["val_positions"], fold_data["y_val"], val_probs),
+        "test": (fold_data["test_positions"], fold_data["y_test"], test_probs),
+    }
+    return precision, recall, f1, best_threshold, booster.best_iteration, num_rounds, predictions
+
+
+def cross_validate(dataset, model_params=None, trial=None, prediction_store=None):
+    """
+    Train the spatial folds concurrently. XGBoost releases the GIL while training, so a thread
+    pool is enough, and the thread budget is split between folds and XGBoost's own threads.
+    model_params override config.MODEL for this run only.
+
+    Pruning an optuna trial during boosting (PRUNING.REPORT "boosting") with the median pruner keeps
+    the folds concurrent - each fold reports on its own steps. Otherwise (see is_fold_by_fold) folds
+    run one after another, with every thread given to XGBoost, and per-fold pruning (REPORT "fold")
+    reports the running mean F1 after each fold so hopeless trials skip the remaining folds.
+
+    With a prediction_store, every fold's validation and out-of-fold probabilities are kept in it.
+    """
+    X, y = prepare_data_for_modelling(dataset)
+    _, fold_ids = create_spatial_folds(dataset)
+    data_key = get_fold_data_key(X, y, fold_ids)
+
+    if is_fold_by_fold(trial):
+        _, threads_per_fold = split_thread_budget(1)
+        fold_results = []
+        for i in range(config.TRAINING.NUM_FOLDS):
+            fold_results.append(
+                train_and_evaluate_fold(
+                    X, y, fold_ids, i, threads_per_fold, model_params, trial, data_key
+                )
+            )
+            if config.OPTIMISATION.PRUNING.REPORT != "fold":
+                continue
+            if report_fold(trial, i, [result[2] for result in fold_results]):
+                raise optuna.TrialPruned()
+    else:
+        # Boosting-level pruning callbacks need the trial; they count its rounds themselves
+        pruning_trial = trial if is_pruning_enabled(trial) else None
+        num_workers, threads_per_fold = split_thread_budget(
+            config.TRAINING.NUM_FOLDS, config.TRAINING.MAX_FOLD_WORKERS
         )
-        pos_weight = calculate_class_weights(y_train)
-        model = create_xgboost_model(pos_weight)
-        model = train_xgboost_model(model, X_train, y_train, X_val, y_val)
-        best_threshold = find_optimal_threshold(model, X_val, y_val)
-        y_preds, _ = predict_on_dataset(model, X_test, best_threshold)
-        precision, recall, f1 = evaluate_model_performance(y_test, y_preds)
-        num_trees.append(model.best_iteration)
-        precisions.append(precision)
-        recalls.append(recall)
-        f1_scores.append(f1)
-        best_thresholds.append(best_threshold)
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            fold_results = list(
+                executor.map(
+                    lambda i: train_and_evaluate_fold(
+                        X, y, fold_ids, i, threads_per_fold, model_params, pruning_trial, data_key
+                    ),
+                    range(config.TRAINING.NUM_FOLDS),
+                )
+            )
+        if trial is not None and pruning_trial is None:
+            add_boosting_rounds(trial, sum(result[5] for result in fold_results))
+
+    precisions, recalls, f1_scores, best_thresholds, num_trees, _, predictions = (
+        list(values) for values in zip(*fold_results)
+    )
+    if prediction_store is not None:
+        rows = dataset.index.values
+        for i, fold_predictions in enumerate(predictions):
+            for split, (positions, y_true, y_probs) in fold_predictions.items():
+                prediction_store.add("cv", split, rows[positions], y_true, y_probs, fold=i)
     return precisions, recalls, f1_scores, best_thresholds, num_trees
 
 
+def remove_candidates(candidates, positions, num_remaining, indices):
+    """Swap-remove indices from the front `num_remaining` entries of candidates in O(1) each."""
+    num_removed = 0
+    for i in indices:
+        pos = positions[i]
+        if pos < 0:
+            continue
+        last = candidates[num_remaining - 1]
+        candidates[pos] = last
+        positions[last] = pos
+        positions[i] = -1
+        num_remaining -= 1
+        num_removed += 1
+    return num_remaining, num_removed
+
+
 def create_spatial_train_test_split(dataset):
-    """Create a spatially separated train/test split based on minimum distance."""
-    np.random.seed(42)
-    dataset = dataset.copy().to_crs(epsg=3857)
-    coords = np.vstack([dataset.geometry.x, dataset.geometry.y]).T
-    all_indices = np.arange(len(dataset))
-    remaining_indices = set(all_indices)
+    """
+    Create a spatially separated train/test split based on minimum distance.
+    Remaining candidates live in an array with a position lookup, so each random draw and
+    each removal is O(1).
+    """
+    rng = np.random.default_rng(config.DATA_SPLIT.SEED)
+    metric = config.DATA_SPLIT.DISTANCE_METRIC
+    coords = get_metric_coordinates(dataset["latitude"], dataset["longitude"], metric)
+    radius = get_metric_radius(config.DATA_SPLIT.MIN_DISTANCE_BETWEEN_TRAIN_AND_TEST_M, metric)
     tree = cKDTree(coords)
+    candidates = np.arange(len(dataset))
+    positions = np.arange(len(dataset))
+    num_remaining = len(dataset)
 
     test_indices = []
+    removed_per_draw = []
     num_test_target = int(len(dataset) * config.DATA_SPLIT.TEST_PROP)
 
-    while len(test_indices) < num_test_target and remaining_indices:
-        i = np.random.choice(list(remaining_indices))
+    while len(test_indices) < num_test_target and num_remaining:
+        i = candidates[rng.integers(num_remaining)]
         test_indices.append(i)
-        nearby = tree.query_ball_point(
-            coords[i], r=config.DATA_SPLIT.MIN_DISTANCE_BETWEEN_TRAIN_AND_TEST_M
+        nearby = tree.query_ball_point(coords[i], r=radius, return_sorted=True)
+        num_remaining, num_removed = remove_candidates(
+            candidates, positions, num_remaining, nearby
         )
-        remaining_indices.difference_update(nearby)
+        removed_per_draw.append(num_removed)
 
     test_mask = np.zeros(len(dataset), dtype=bool)
     test_mask[test_indices] = True
 
-    test_gdf = dataset[test_mask].to_crs(epsg=4326)
-    train_gdf = dataset[~test_mask].to_crs(epsg=4326)
-    return train_gdf, test_gdf
+    test_gdf = dataset[test_mask]
+    train_gdf = dataset[~test_mask]
+    split_stats = {
+        "num_draws": len(test_indices),
+        "removed_per_draw": np.array(removed_per_draw, dtype=int),
+    }
+    return train_gdf, test_gdf, split_stats
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The pipeline modules import each other from src/, as they do when run from there
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
+
+
+@pytest.fixture(params=[0, 1, 2])
+def seed(request):
+    """Each test using it runs on a few small random inputs"""
+    return request.param
+
+
+@pytest.fixture
+def classification_data(seed):
+    """Train and validation features/labels with a learnable signal"""
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(600, 4)).astype(np.float32)
+    logits = X[:, 0] - 0.5 * X[:, 1] + rng.normal(scale=0.5, size=len(X))
+    y = (logits > 0.8).astype(int)
+    return X[:400], y[:400], X[400:], y[400:]
@@ -0,0 +1,39 @@
+import geopandas as gpd
+import numpy as np
+import xarray as xr
+
+from preprocessing.AccessibleArea import filter_data_to_be_within_accessible_area
+
+
+def test_filter_matches_sel_nearest_loop(seed):
+    rng = np.random.default_rng(seed)
+    lats, lons = np.arange(5, -5, -0.5), np.arange(-8, 8, 0.5)
+    accessible_area = xr.DataArray(
+        (rng.random((len(lats), len(lons))) > 0.4).astype(int),
+        coords={"latitude": lats, "longitude": lons},
+        dims=["latitude", "longitude"],
+    )
+    # Multiples of 0.25 fall exactly between cells; some points are outside the bounding box
+    latitude = rng.integers(-24, 24, size=300) * 0.25
+    longitude = rng.integers(-36, 36, size=300) * 0.25
+    gdf = gpd.GeoDataFrame(
+        {"latitude": latitude, "longitude": longitude, "row": np.arange(300)},
+        geometry=gpd.points_from_xy(longitude, latitude),
+        crs="EPSG:4326",
+    )
+
+    in_box = gdf[
+        gdf["longitude"].between(lons.min(), lons.max())
+        & gdf["latitude"].between(lats.min(), lats.max())
+    ]
+    expected = in_box[
+        in_box.geometry.apply(
+            lambda point: accessible_area.sel(
+                longitude=point.x, latitude=point.y, method="nearest"
+            ).values
+            == 1
+        )
+    ]
+
+    filtered = filter_data_to_be_within_accessible_area(gdf, accessible_area)
+    np.testing.assert_array_equal(filtered["row"], expected["row"])
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from preprocessing import BackgroundSampling
+from ConfigHandler import config
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_find_nearest_coordinate_indices_matches_argmin(seed, descending):
+    rng = np.random.default_rng(seed)
+    coords = np.arange(-10, 10, 0.5)
+    if descending:
+        coords = coords[::-1]
+    # Multiples of 0.25 fall exactly between cells, plus values outside the grid
+    values = np.concatenate([rng.integers(-48, 48, size=200) * 0.25, rng.uniform(-12, 12, 200)])
+    expected = [np.abs(coords - value).argmin() for value in values]
+    np.testing.assert_array_equal(
+        BackgroundSampling.find_nearest_coordinate_indices(coords, values), expected
+    )
+    np.testing.assert_array_equal(
+        BackgroundSampling.find_nearest_coordinate_indices(coords[:1], values), 0
+    )
+
+
+def test_create_raw_raster_matches_point_loop(seed):
+    rng = np.random.default_rng(seed)
+    lats, lons = np.arange(5, -5, -0.5), np.arange(-8, 8, 0.5)
+    accessible_area = xr.DataArray(
+        (rng.random((len(lats), len(lons))) > 0.3).astype(int),
+        coords={"latitude": lats, "longitude": lons},
+        dims=["latitude", "longitude"],
+    )
+    gdf = pd.DataFrame(
+        {
+            "latitude": rng.integers(-22, 22, size=400) * 0.25,
+            "longitude": rng.integers(-34, 34, size=400) * 0.25,
+        }
+    )
+    weights = rng.random(len(gdf))
+
+    expected = np.zeros(accessible_area.shape)
+    for (lat, lon), weight in zip(gdf[["latitude", "longitude"]].values, weights):
+        if accessible_area.sel(longitude=lon, latitude=lat, method="nearest").values == 0:
+            continue
+        expected[np.abs(lats - lat).argmin(), np.abs(lons - lon).argmin()] += weight
+
+    raster = BackgroundSampling.create_raw_raster(gdf, accessible_area, weights=weights)
+    np.testing.assert_allclose(raster, expected)
+
+
+def get_prob_raster(rng, shape=(30, 40)):
+    raster = rng.random(shape) * (rng.random(shape) > 0.6)
+    return raster / raster.sum()
+
+
+def test_draws_with_replacement_match_choice_over_full_raster(seed):
+    prob_raster = get_prob_raster(np.random.default_rng(seed))
+    sampling_table = BackgroundSampling.create_sampling_table(prob_raster)
+
+    draws = BackgroundSampling.draw_from_sampling_table(
+        sampling_table, 5000, np.random.default_rng(seed), replace=True
+    )
+    expected = np.random.default_rng(seed).choice(
+        prob_raster.size, size=5000, p=prob_raster.ravel()
+    )
+    np.testing.assert_array_equal(draws, expected)
+
+
+def test_draw_frequencies_follow_probabilities(seed):
+    prob_raster = get_prob_raster(np.random.default_rng(seed))
+    sampling_table = BackgroundSampling.create_sampling_table(prob_raster)
+    num_draws = 200_000
+
+    draws = BackgroundSampling.draw_from_sampling_table(
+        sampling_table, num_draws, np.random.default_rng(seed), replace=True
+    )
+    frequencies = np.bincount(draws, minlength=prob_raster.size) / num_draws
+    probs = prob_raster.ravel()
+    assert np.all(frequencies[probs == 0] == 0)
+    np.testing.assert_array_less(
+        np.abs(frequencies - probs), 5 * np.sqrt(probs * (1 - probs) / num_draws) + 1e-12
+    )
+
+
+def test_draws_without_replacement_are_unique(seed):
+    prob_raster = get_prob_raster(np.random.default_rng(seed))
+    sampling_table = BackgroundSampling.create_sampling_table(prob_raster)
+    support = sampling_table[0]
+    rng = np.random.default_rng(seed)
+
+    for size in (0, 1, len(support) // 2, len(support)):
+        draws = BackgroundSampling.draw_from_sampling_table(
+            sampling_table, size, rng, replace=False
+        )
+        assert len(draws) == len(np.unique(draws)) == size
+        assert np.isin(draws, support).all()
+    with pytest.raises(ValueError):
+        BackgroundSampling.draw_from_sampling_table(
+            sampling_table, len(support) + 1, rng, replace=False
+        )
+
+
+def test_replicates_are_independent_of_their_count(monkeypatch, seed):
+    monkeypatch.setattr(config.PREPROCESSING, "BG_SAMPLE_SIZE", 50)
+    monkeypatch.setattr(config.PREPROCESSING, "BG_WEIGHT_COLUMN", None)
+    rng = np.random.default_rng(seed)
+    lats, lons = np.arange(5, -5, -0.5), np.arange(-8, 8, 0.5)
+    accessible_area = xr.DataArray(
+        (rng.random((len(lats), len(lons))) > 0.3).astype(int),
+        coords={"latitude": lats, "longitude": lons},
+        dims=["latitude", "longitude"],
+    )
+    background_gdf = pd.DataFrame(
+        {"latitude": rng.uniform(-5, 5, 500), "longitude": rng.uniform(-8, 8, 500)}
+    )
+
+    for replace in (True, False):
+        one = BackgroundSampling.sample_background_point_replicates(
+            accessible_area, background_gdf, n_replicates=1, seed=seed, replace=replace
+        )
+        three = BackgroundSampling.sample_background_point_replicates(
+            accessible_area, background_gdf, n_replicates=3, seed=seed, replace=replace
+        )
+        pd.testing.assert_frame_equal(one[0], three[0])
+        assert not three[0].equals(three[1])
+        assert not three[1].equals(three[2])
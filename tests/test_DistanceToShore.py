@@ -0,0 +1,51 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+from benchmark.SyntheticData import create_environment_data
+from preprocessing.DistanceToShore import TO_METRES, DistanceToShore, get_coastline_path
+from ConfigHandler import config
+
+REGION = (1.0, 2.5, 1.0, 2.5)
+
+
+@pytest.fixture
+def synthetic_coastline(tmp_path, monkeypatch, seed):
+    """Synthetic Bio-ORACLE layers and coastline, with config.DATA pointed at them"""
+    folder = tmp_path / "environmental"
+    create_environment_data(str(folder), (0, 4, 0, 4), resolution=0.05, seed=seed)
+    monkeypatch.setattr(config.DATA.ENVIRONMENTAL, "FOLDER", str(folder))
+    # A narrow clip box so many points need the full coastline
+    monkeypatch.setattr(config.PREPROCESSING.DISTANCE_TO_SHORE, "CLIP_PADDING", 0.2)
+    monkeypatch.setattr(config.PREPROCESSING.DISTANCE_TO_SHORE, "READ_ONLY", False)
+
+
+def full_scan_distances(lats, lons):
+    coastline = gpd.read_file(get_coastline_path()).to_crs(epsg=3857)
+    x, y = TO_METRES.transform(lons, lats)
+    return shapely.distance(shapely.points(x, y), shapely.union_all(coastline.geometry.values))
+
+
+def get_points(rng, size=300):
+    min_lon, max_lon, min_lat, max_lat = REGION
+    lats = rng.uniform(min_lat, max_lat, size)
+    lons = rng.uniform(min_lon, max_lon, size)
+    # Plus a few outside the region, which are answered exactly in both modes
+    return np.append(lats, rng.uniform(0.2, 3.8, 20)), np.append(lons, rng.uniform(0.2, 3.8, 20))
+
+
+def test_exact_mode_matches_full_coastline_scan(synthetic_coastline, seed):
+    lats, lons = get_points(np.random.default_rng(seed))
+    distances = DistanceToShore(*REGION, mode="exact").query(lats, lons)
+    np.testing.assert_allclose(distances, full_scan_distances(lats, lons), rtol=1e-9)
+
+
+def test_fast_mode_within_max_error(synthetic_coastline, seed):
+    lats, lons = get_points(np.random.default_rng(seed))
+    distance_to_shore = DistanceToShore(*REGION, mode="fast")
+    distances = distance_to_shore.query(lats, lons)
+    max_error_m = distance_to_shore.max_error_m()
+
+    assert 0 < max_error_m
+    assert np.all(np.abs(distances - full_scan_distances(lats, lons)) <= max_error_m + 1e-6)
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from preprocessing.EnvironmentData import get_nearest_grid_indices
+from preprocessing.FeatureCube import FeatureCube
+
+
+def get_grid_dataset(rng, descending_lats):
+    lats = np.arange(-5, 5, 0.5)
+    if descending_lats:
+        lats = lats[::-1]
+    lons = np.arange(-8, 8, 0.5)
+    return xr.Dataset(
+        {
+            var: (("latitude", "longitude"), rng.random((len(lats), len(lons))))
+            for var in ("thetao_mean", "so_mean", "bathymetry_mean")
+        },
+        coords={"latitude": lats, "longitude": lons},
+    )
+
+
+def get_points(rng, size=100):
+    # Multiples of 0.25 fall exactly between cells, plus values outside the grid
+    lats = np.concatenate([rng.integers(-22, 22, size) * 0.25, rng.uniform(-7, 7, size)])
+    lons = np.concatenate([rng.integers(-34, 34, size) * 0.25, rng.uniform(-10, 10, size)])
+    return lats, lons
+
+
+@pytest.mark.parametrize("descending_lats", [False, True])
+def test_nearest_grid_indices_match_sel_nearest(seed, descending_lats):
+    rng = np.random.default_rng(seed)
+    ds = get_grid_dataset(rng, descending_lats)
+    lats, lons = get_points(rng)
+
+    lat_idx, lon_idx = get_nearest_grid_indices(ds, lats, lons)
+    for var in ds.data_vars:
+        expected = [
+            ds[var].sel(latitude=lat, longitude=lon, method="nearest").item()
+            for lat, lon in zip(lats, lons)
+        ]
+        np.testing.assert_array_equal(ds[var].values[lat_idx, lon_idx], expected)
+
+
+@pytest.mark.parametrize("descending_lats", [False, True])
+def test_feature_cube_gather_matches_sel_nearest(seed, descending_lats):
+    rng = np.random.default_rng(seed)
+    ds = get_grid_dataset(rng, descending_lats)
+    lats, lons = get_points(rng)
+    variables = list(ds.data_vars)
+    cube = FeatureCube(
+        variables,
+        ds["latitude"].values,
+        ds["longitude"].values,
+        np.stack([ds[var].values for var in variables], axis=-1),
+        (-8, 8, -5, 5),
+    )
+
+    columns = ["so_mean", "thetao_mean"]
+    expected = [
+        [ds[var].sel(latitude=lat, longitude=lon, method="nearest").item() for var in columns]
+        for lat, lon in zip(lats, lons)
+    ]
+    np.testing.assert_array_equal(cube.gather(lats, lons, columns), expected)
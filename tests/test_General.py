@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from preprocessing import General
+
+
+def thin_coordinates_reference(coords, min_distance, order):
+    keep = np.zeros(len(coords), dtype=bool)
+    kept = []
+    for i in order:
+        if all(np.linalg.norm(coords[i] - coords[j]) > min_distance for j in kept):
+            keep[i] = True
+            kept.append(i)
+    return keep
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_thin_coordinates_matches_greedy_loop(monkeypatch, seed, chunk_size):
+    monkeypatch.setattr(General, "THINNING_CHUNK_SIZE", chunk_size)
+    rng = np.random.default_rng(seed)
+    # Coarse grid so there are exact duplicates and pairs exactly min_distance apart
+    coords = rng.integers(0, 20, size=(300, 2)).astype(float)
+    order = rng.permutation(len(coords))
+    for min_distance in (0.5, 1.0, 2.5):
+        np.testing.assert_array_equal(
+            General.thin_coordinates(coords, min_distance, order),
+            thin_coordinates_reference(coords, min_distance, order),
+        )
@@ -0,0 +1,32 @@
+import numpy as np
+import xgboost as xgb
+
+from training.Model import (
+    create_xgboost_model,
+    predict_proba_with_booster,
+    train_xgboost_booster,
+    train_xgboost_model,
+)
+
+
+def test_booster_matches_xgb_classifier(classification_data):
+    X_train, y_train, X_val, y_val = classification_data
+    positive_weight = (y_train == 0).sum() / (y_train == 1).sum()
+    model_params = {"N_ESTIMATORS": 60, "EARLY_STOPPING_ROUNDS": 10}
+
+    model = create_xgboost_model(positive_weight, n_jobs=1, model_params=model_params)
+    model = train_xgboost_model(model, X_train, y_train, X_val, y_val)
+    booster = train_xgboost_booster(
+        xgb.DMatrix(X_train, label=y_train),
+        xgb.DMatrix(X_val, label=y_val),
+        positive_weight,
+        n_jobs=1,
+        model_params=model_params,
+    )
+
+    assert booster.best_iteration == model.best_iteration
+    np.testing.assert_allclose(
+        predict_proba_with_booster(booster, xgb.DMatrix(X_val)),
+        model.predict_proba(X_val)[:, 1],
+        rtol=1e-6,
+    )
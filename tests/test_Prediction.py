@@ -0,0 +1,45 @@
+import numpy as np
+
+from evaluation.Prediction import get_calibration
+from evaluation.PredictionStore import PredictionStore
+from optimisation.Threshold import find_optimal_threshold, find_optimal_threshold_from_probs
+from training.Model import create_xgboost_model, train_xgboost_model
+
+
+def test_threshold_from_stored_predictions_matches_model(tmp_path, classification_data):
+    X_train, y_train, X_val, y_val = classification_data
+    model = create_xgboost_model(1.0, n_jobs=1, model_params={"N_ESTIMATORS": 30})
+    model = train_xgboost_model(model, X_train, y_train, X_val, y_val)
+
+    store = PredictionStore()
+    store.add("final", "val", np.arange(len(y_val)), y_val, model.predict_proba(X_val)[:, 1])
+    store.save(tmp_path)
+    predictions = PredictionStore.load(tmp_path).get("final", "val")
+
+    assert find_optimal_threshold_from_probs(
+        predictions["label"].values, predictions["prob"].values
+    ) == find_optimal_threshold(model, X_val, y_val)
+
+
+def test_calibration_matches_bin_loop(seed):
+    rng = np.random.default_rng(seed)
+    y_probs = np.append(rng.beta(0.5, 2, size=300), [0.0, 1.0])
+    y_true = (rng.random(len(y_probs)) < y_probs).astype(int)
+    num_bins = 10
+
+    calibration = get_calibration(y_true, y_probs, num_bins)
+    bin_lower, mean_prob, presence_rate, count = [], [], [], []
+    for i in range(num_bins):
+        upper = (i + 1) / num_bins
+        in_bin = (y_probs >= i / num_bins) & ((y_probs < upper) | (i == num_bins - 1))
+        if in_bin.any():
+            bin_lower.append(round(i / num_bins, 4))
+            mean_prob.append(round(y_probs[in_bin].mean(), 4))
+            presence_rate.append(round(y_true[in_bin].mean(), 4))
+            count.append(int(in_bin.sum()))
+
+    assert calibration["bin_lower"] == bin_lower
+    assert calibration["count"] == count
+    np.testing.assert_allclose(calibration["mean_prob"], mean_prob, atol=1e-4)
+    np.testing.assert_allclose(calibration["presence_rate"], presence_rate, atol=1e-4)
+    assert calibration["brier_score"] == round(np.mean((y_probs - y_true) ** 2), 4)
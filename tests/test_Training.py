@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from preprocessing.General import get_metric_coordinates, get_metric_radius
+from training import Training
+from ConfigHandler import config
+
+
+def get_dataset(rng, size=400):
+    return pd.DataFrame(
+        {
+            "latitude": rng.uniform(-3, 3, size),
+            "longitude": rng.uniform(-4, 4, size),
+            "label": rng.integers(0, 2, size),
+        }
+    )
+
+
+def assign_spatial_blocks_to_folds_reference(coords, block_size, num_folds):
+    block_ranks = {}
+    fold_ids = []
+    for x, y in coords:
+        block = (np.floor(x / block_size), np.floor(y / block_size))
+        block_ranks.setdefault(block, len(block_ranks))
+        fold_ids.append(block_ranks[block] % num_folds)
+    return np.array(fold_ids, dtype=int)
+
+
+@pytest.mark.parametrize("num_folds", [1, 3, 5])
+def test_block_folds_match_dict_loop(seed, num_folds):
+    rng = np.random.default_rng(seed)
+    # Integer coordinates put points exactly on block edges, including negative ones
+    coords = np.concatenate(
+        [rng.integers(-200, 200, size=(200, 2)) * 1000.0, rng.uniform(-2e5, 2e5, (200, 2))]
+    )
+    np.testing.assert_array_equal(
+        Training.assign_spatial_blocks_to_folds(coords, 50000, num_folds),
+        assign_spatial_blocks_to_folds_reference(coords, 50000, num_folds),
+    )
+
+
+def test_spatial_folds_are_cached_per_dataset(monkeypatch, seed):
+    monkeypatch.setattr(Training, "FOLD_ID_CACHE", {})
+    calls = []
+    assign_spatial_blocks_to_folds = Training.assign_spatial_blocks_to_folds
+
+    def counting_assign(*args):
+        calls.append(args)
+        return assign_spatial_blocks_to_folds(*args)
+
+    monkeypatch.setattr(Training, "assign_spatial_blocks_to_folds", counting_assign)
+    dataset = get_dataset(np.random.default_rng(seed))
+
+    folded, fold_ids = Training.create_spatial_folds(dataset)
+    fold_ids[:] = -1
+    folded_again, fold_ids_again = Training.create_spatial_folds(dataset)
+    assert len(calls) == 1
+    assert "fold_id" not in dataset
+    assert (fold_ids_again >= 0).all()
+    np.testing.assert_array_equal(folded["fold_id"], folded_again["fold_id"])
+
+    monkeypatch.setattr(config.TRAINING, "NUM_FOLDS", config.TRAINING.NUM_FOLDS + 1)
+    Training.create_spatial_folds(dataset)
+    assert len(calls) == 2
+
+
+def spatial_train_test_split_reference(coords, radius, num_test_target, seed):
+    """Same draws, with candidates swap-removed from a list and distances from a full scan"""
+    rng = np.random.default_rng(seed)
+    candidates = list(range(len(coords)))
+    test_indices, removed_per_draw = [], []
+    while len(test_indices) < num_test_target and candidates:
+        i = candidates[rng.integers(len(candidates))]
+        test_indices.append(i)
+        nearby = np.flatnonzero(np.linalg.norm(coords - coords[i], axis=1) <= radius)
+        num_removed = 0
+        for j in nearby:
+            if j in candidates:
+                pos = candidates.index(j)
+                candidates[pos] = candidates[-1]
+                candidates.pop()
+                num_removed += 1
+        removed_per_draw.append(num_removed)
+    return test_indices, removed_per_draw
+
+
+@pytest.mark.parametrize("metric", ["projected", "great_circle"])
+def test_spatial_train_test_split_matches_reference(monkeypatch, seed, metric):
+    monkeypatch.setattr(config.DATA_SPLIT, "SEED", seed)
+    monkeypatch.setattr(config.DATA_SPLIT, "DISTANCE_METRIC", metric)
+    monkeypatch.setattr(config.DATA_SPLIT, "MIN_DISTANCE_BETWEEN_TRAIN_AND_TEST_M", 50000)
+    monkeypatch.setattr(config.DATA_SPLIT, "TEST_PROP", 0.2)
+    dataset = get_dataset(np.random.default_rng(seed))
+    coords = get_metric_coordinates(dataset["latitude"], dataset["longitude"], metric)
+    radius = get_metric_radius(50000, metric)
+
+    train, test, split_stats = Training.create_spatial_train_test_split(dataset)
+    test_indices, removed_per_draw = spatial_train_test_split_reference(
+        coords, radius, int(len(dataset) * 0.2), seed
+    )
+
+    np.testing.assert_array_equal(test.index, np.sort(test_indices))
+    np.testing.assert_array_equal(train.index, np.setdiff1d(dataset.index, test_indices))
+    assert split_stats["num_draws"] == len(test_indices)
+    np.testing.assert_array_equal(split_stats["removed_per_draw"], removed_per_draw)
+    # Every test point removed its neighbours from the candidates, so none are within the radius
+    test_coords = coords[test.index]
+    distances = np.linalg.norm(test_coords[:, None] - test_coords[None], axis=-1)
+    assert (distances[~np.eye(len(test), dtype=bool)] > radius).all()